@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark the wire size and encode/decode cost of chat frames.
+
+Compares the JSON dict frames the chat sends by default with compact
+``[username, text, timestamp, uid]`` arrays, over JSON and over
+MessagePack (SOCKETIO_SERIALIZER = 'msgpack'). A room emit is encoded once
+on the server and decoded once by every client in the room, so bytes on
+the wire and client CPU are reported for the whole room. The room figures
+are simulated: they multiply the measured per-frame bytes and decode time
+by --clients, and no connections are opened. The arrays save
+the bytes; MessagePack mostly saves encode and decode time, and its
+compact frames can come out slightly larger than compact JSON.
+
+Usage:
+    python -m benchmarks.chat_framing [--messages N] [--clients N]
+                                      [--batch N]
+"""
+
+import argparse
+from datetime import datetime
+from time import perf_counter
+from uuid import uuid4
+from socketio import packet
+
+try:
+    from socketio.msgpack_packet import MsgPackPacket
+except ImportError:  # msgpack is not installed
+    MsgPackPacket = None
+
+from flask_ambrosial.chats.utils import chat_frame
+
+
+def make_frames(count, batch, compact):
+    """Build the payloads for count messages, batch messages per frame."""
+    messages = [
+        chat_frame(
+            f'user{i % 50}', f'Message number {i} about tonight\'s jollof',
+            datetime(2024, 1, 1, 12, 0, i % 60).isoformat(),
+            uid=uuid4().hex, compact=compact
+        )
+        for i in range(count)
+    ]
+    if batch <= 1:
+        return messages
+    return [messages[i:i + batch] for i in range(0, count, batch)]
+
+
+def measure(packet_class, frames):
+    """Encode and decode every frame; return bytes and seconds spent."""
+    encoded = []
+    start = perf_counter()
+    for frame in frames:
+        encoded.append(packet_class(
+            packet.EVENT, data=['message', frame], namespace='/'
+        ).encode())
+    encode_time = perf_counter() - start
+
+    start = perf_counter()
+    for data in encoded:
+        packet_class(encoded_packet=data)
+    decode_time = perf_counter() - start
+
+    size = sum(len(data) for data in encoded)
+    return size, encode_time, decode_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--batch', type=int, default=1,
+                        help='messages per frame (CHAT_EMIT_INTERVAL > 0)')
+    args = parser.parse_args()
+
+    formats = [
+        ('json, dict', packet.Packet, False),
+        ('json, compact', packet.Packet, True),
+    ]
+    if MsgPackPacket is not None:
+        formats.append(('msgpack, compact', MsgPackPacket, True))
+    else:
+        print('msgpack is not installed; skipping the MessagePack rows\n')
+
+    print(f'{args.messages} messages, {args.batch} per frame, '
+          f'{args.clients} simulated clients in the room')
+    print('(room MB and room CPU s multiply one client\'s bytes and '
+          'decode time; no connections are opened)\n')
+    print(f'{"format":<18}{"bytes/msg":>10}{"room MB":>10}'
+          f'{"encode us/msg":>15}{"decode us/msg":>15}{"room CPU s":>12}')
+    for name, packet_class, compact in formats:
+        frames = make_frames(args.messages, args.batch, compact)
+        size, encode_time, decode_time = measure(packet_class, frames)
+        per_message = size / args.messages
+        room_cpu = encode_time + decode_time * args.clients
+        print(f'{name:<18}{per_message:>10.1f}'
+              f'{size * args.clients / 1e6:>10.1f}'
+              f'{encode_time / args.messages * 1e6:>15.2f}'
+              f'{decode_time / args.messages * 1e6:>15.2f}'
+              f'{room_cpu:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark concurrent database-bound requests in green mode.
+
+The process is monkey-patched as run.py does. A burst of slow requests
+(each running one expensive SQLite query) is issued together with a
+stream of quick ones (a single-row lookup), every request on its own
+green thread, as the eventlet server would serve them. With SQLite called
+on the hub ('blocking') each query holds the whole process and the quick
+requests queue behind the slow ones; with SQLITE_THREAD_POOL ('green')
+the queries run on pool threads and the requests overlap.
+
+Usage:
+    python -m benchmarks.db_concurrency [--slow N] [--fast N]
+                                        [--rows N]
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from flask_ambrosial import create_app, db  # noqa: E402
+from flask_ambrosial.config import Config  # noqa: E402
+
+SLOW_QUERY = text(
+    'WITH RECURSIVE r(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM r '
+    'WHERE n < :rows) SELECT count(*) FROM r'
+)
+
+
+def percentile(values, fraction):
+    """Return the value at a fraction of the sorted values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def make_app(path, thread_pool):
+    """Create an app on the benchmark database with two test routes."""
+    class BenchmarkConfig(Config):
+        SECRET_KEY = 'benchmark'
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLITE_THREAD_POOL = thread_pool
+
+    app = create_app(BenchmarkConfig)
+    in_flight = app.in_flight = [0, 0]
+
+    def track(query, **params):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        try:
+            return str(db.session.execute(query, params).scalar())
+        finally:
+            in_flight[0] -= 1
+
+    app.add_url_rule(
+        '/bench/slow', 'bench_slow',
+        lambda: track(SLOW_QUERY, rows=app.config['BENCH_ROWS'])
+    )
+    app.add_url_rule(
+        '/bench/fast', 'bench_fast',
+        lambda: track(text('SELECT count(*) FROM user'))
+    )
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def burst(app, slow, fast, interval=0.005):
+    """Serve slow and quick requests at once.
+
+    Returns:
+        tuple: Quick request latencies in milliseconds, the burst's
+        duration in seconds and the most requests seen in flight.
+    """
+    client = app.test_client()
+
+    def request(path, due):
+        eventlet.sleep(max(0.0, due - time.perf_counter()))
+        assert client.get(path).status_code == 200
+        # Measured from when the request was due, so time spent queued
+        # behind a blocked hub counts
+        return (time.perf_counter() - due) * 1000
+
+    start = time.perf_counter()
+    quick_threads = [
+        eventlet.spawn(request, '/bench/fast', start + i * interval)
+        for i in range(fast)
+    ]
+    slow_threads = [
+        eventlet.spawn(request, '/bench/slow', start) for _ in range(slow)
+    ]
+    latencies = [thread.wait() for thread in quick_threads]
+    for thread in slow_threads:
+        thread.wait()
+    return latencies, time.perf_counter() - start, app.in_flight[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--slow', type=int, default=8,
+                        help='concurrent slow requests')
+    parser.add_argument('--fast', type=int, default=50,
+                        help='quick requests, one every 5 ms')
+    parser.add_argument('--rows', type=int, default=300000,
+                        help='rows counted by each slow query')
+    args = parser.parse_args()
+
+    print(f'{args.slow} slow requests ({args.rows} rows each) and '
+          f'{args.fast} quick requests\n')
+    print(f'{"mode":<10}{"burst s":>9}{"in flight":>11}'
+          f'{"quick p50 ms":>14}{"quick max ms":>14}')
+    with tempfile.TemporaryDirectory() as directory:
+        for name, thread_pool in [('blocking', False), ('green', True)]:
+            path = os.path.join(directory, f'{name}.db')
+            app = make_app(path, thread_pool)
+            app.config['BENCH_ROWS'] = args.rows
+            latencies, elapsed, in_flight = burst(app, args.slow, args.fast)
+            print(f'{name:<10}{elapsed:>9.2f}{in_flight:>11}'
+                  f'{percentile(latencies, 0.5):>14.1f}'
+                  f'{max(latencies):>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
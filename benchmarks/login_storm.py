@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark chat latency on the eventlet hub during a storm of logins.
+
+A probe green thread stands in for a chat socket: it asks to wake every
+few milliseconds and records how late it actually wakes. Meanwhile a
+burst of concurrent logins checks passwords, first with Flask-Bcrypt
+called inline on the hub (as users.login used to) and then through
+PasswordHasher, which hands the work to worker threads.
+
+Usage:
+    python -m benchmarks.login_storm [--logins N] [--workers N]
+                                     [--rounds N]
+"""
+
+import argparse
+import time
+import eventlet
+from flask_bcrypt import Bcrypt
+from flask_ambrosial.passwords import PasswordHasher
+
+
+def percentile(values, fraction):
+    """Return the value at a fraction of the sorted values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def storm(check, pw_hash, logins, interval=0.005):
+    """Run concurrent logins while probing the hub's responsiveness.
+
+    Returns:
+        tuple: Probe wake-up delays in milliseconds and the storm's
+        duration in seconds.
+    """
+    delays = []
+    done = []
+
+    def probe():
+        while not done:
+            start = time.perf_counter()
+            eventlet.sleep(interval)
+            delays.append((time.perf_counter() - start - interval) * 1000)
+
+    prober = eventlet.spawn(probe)
+    eventlet.sleep(interval * 4)
+    start = time.perf_counter()
+    threads = [
+        eventlet.spawn(check, pw_hash, 'password') for _ in range(logins)
+    ]
+    assert all(thread.wait() for thread in threads)
+    elapsed = time.perf_counter() - start
+    done.append(True)
+    prober.wait()
+    return delays, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--logins', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--rounds', type=int, default=12,
+                        help='bcrypt log rounds')
+    args = parser.parse_args()
+
+    bcrypt = Bcrypt()
+    bcrypt._log_rounds = args.rounds
+    pw_hash = bcrypt.generate_password_hash('password')
+    hasher = PasswordHasher(bcrypt, workers=args.workers)
+
+    print(f'{args.logins} concurrent logins, bcrypt rounds {args.rounds}, '
+          f'{args.workers} workers\n')
+    print(f'{"mode":<10}{"storm s":>9}{"chat p50 ms":>13}'
+          f'{"chat p99 ms":>13}{"chat max ms":>13}')
+    for name, check in [
+        ('inline', bcrypt.check_password_hash),
+        ('pooled', hasher.check_password_hash),
+    ]:
+        delays, elapsed = storm(check, pw_hash, args.logins)
+        print(f'{name:<10}{elapsed:>9.2f}{percentile(delays, 0.5):>13.1f}'
+              f'{percentile(delays, 0.99):>13.1f}{max(delays):>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,14 +16,25 @@ from flask_cors import CORS
 from flask_babel import Babel, lazy_gettext as _l, gettext
 
 from flask_ambrosial.config import Config, TestingConfig
+from flask_ambrosial.cache import LRUCache, TTLCache
+from flask_ambrosial.buffer import WriteBehindBuffer
+from flask_ambrosial.queues import message_queue_options
+from flask_ambrosial.passwords import PasswordHasher
+from flask_ambrosial.diagnostics import HubMonitor
+from flask_ambrosial.green import engine_options, init_green_database
+from flask_ambrosial.outbox import (
+    MailOutbox, send_mail_command, mail_worker_command
+)
 
 # Initialize Flask extensions
 db = SQLAlchemy()
 bcrypt = Bcrypt()
+password_hasher = PasswordHasher(bcrypt, config_key='PASSWORD_HASH_WORKERS')
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'
 login_manager.login_message_category = 'info'
 mail = Mail()
+outbox = MailOutbox(db, mail, config_prefix='MAIL_OUTBOX')
 migrate = Migrate()
 socketio = SocketIO(
     cors_allowed_origins=[
@@ -34,6 +45,13 @@ socketio = SocketIO(
     async_mode='eventlet'
 )
 babel = Babel()
+post_card_cache = LRUCache(config_key='POST_CARD_CACHE_SIZE')
+response_cache = LRUCache(config_key='RESPONSE_CACHE_SIZE')
+chat_buffer = WriteBehindBuffer(db, config_prefix='CHAT_BUFFER')
+identity_cache = TTLCache(
+    config_key='IDENTITY_CACHE_SIZE', ttl_config_key='IDENTITY_CACHE_TTL'
+)
+hub_monitor = HubMonitor(config_prefix='HUB_MONITOR')
 
 def get_locale():
     """
@@ -66,17 +84,49 @@ def create_app(config_class=Config, use_socketio=False):
         static_url_path='/static'
     )
     app.config.from_object(config_class)
+    # Explicit SQLALCHEMY_ENGINE_OPTIONS win over the DB_POOL_* settings
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(app.config),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    }
 
     # Initialize extensions with the app
     db.init_app(app)
+    from flask_ambrosial.models import init_foreign_keys
+    init_foreign_keys(app)
+    init_green_database(app, db)
     bcrypt.init_app(app)
+    password_hasher.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
+    outbox.init_app(app)
     migrate.init_app(app, db)
     babel.init_app(app, locale_selector=get_locale)
+    post_card_cache.init_app(app)
+    response_cache.init_app(app)
+    chat_buffer.init_app(app)
+    identity_cache.init_app(app)
+    hub_monitor.init_app(app)
 
     if use_socketio:
-        socketio.init_app(app, async_mode='eventlet')
+        # With a message queue configured, rooms span every worker
+        options = message_queue_options(app.config)
+        if app.config['SOCKETIO_SERIALIZER'] == 'msgpack':
+            options['serializer'] = 'msgpack'
+        socketio.init_app(app, async_mode='eventlet', **options)
+        chat_buffer.start(socketio)
+        if app.config['HUB_MONITOR']:
+            hub_monitor.start()
+        if app.config['CHAT_ARCHIVE_INTERVAL']:
+            from flask_ambrosial.chats.archive import start_archiver
+            start_archiver(app, socketio)
+
+    if app.config.get('QUERY_BUDGET') is not None:
+        from flask_ambrosial.profiling import init_query_budget
+        init_query_budget(app)
+
+    app.cli.add_command(send_mail_command)
+    app.cli.add_command(mail_worker_command)
 
     # Register blueprints
     from flask_ambrosial.users.routes import users
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Write-behind buffering of inserts used by the Flask application.
+"""
+
+import atexit
+import logging
+import os
+import signal
+from time import perf_counter
+from threading import RLock, current_thread, main_thread
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the database is unavailable, not that a row is bad;
+# rows that fail with them are kept for the next flush
+UNAVAILABLE_ERRORS = (InterfaceError, OperationalError, TimeoutError)
+
+
+class WriteBehindBuffer:
+    """
+    An in-process queue of rows that are inserted in batches.
+
+    Rows are group-inserted with one commit per batch, either once
+    ``batch_size`` rows are pending or every ``interval`` seconds from a
+    background task. At most ``maxsize`` rows are held: a caller that
+    fills the buffer flushes it itself, and rows are only dropped if the
+    database stays unavailable past ``maxsize`` or rejects the row itself.
+    Pending rows are flushed when the process exits, and, once the buffer
+    is started in a server, when the server is sent SIGTERM.
+    """
+
+    def __init__(self, db, batch_size=100, interval=0.25, maxsize=5000,
+                 config_prefix=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.maxsize = maxsize
+        self.config_prefix = config_prefix
+        self.app = None
+        self._pending = []
+        # Reentrant, so a signal arriving mid-add or mid-flush can flush
+        self._lock = RLock()
+        self._flush_lock = RLock()
+        self._task = None
+        self._registered = False
+        self._signal_handled = False
+        self._reset_counters()
+
+    def _reset_counters(self):
+        """Zero the flush counters."""
+        self.flushed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def init_app(self, app):
+        """Configure the buffer from the app config and start it empty.
+
+        Args:
+            app (Flask): The application whose database receives the rows.
+        """
+        if self.config_prefix:
+            for name in ('batch_size', 'interval', 'maxsize'):
+                key = f'{self.config_prefix}_{name.upper()}'
+                setattr(self, name, app.config.get(key, getattr(self, name)))
+        self.app = app
+        self.clear()
+        if not self._registered:
+            atexit.register(self.flush)
+            self._registered = True
+
+    def start(self, socketio):
+        """Flush every ``interval`` seconds from a Socket.IO background task.
+
+        Args:
+            socketio (SocketIO): The server whose async mode runs the task.
+        """
+        if current_thread() is main_thread():
+            self.flush_on_signal()
+        if self._task is not None or not self.interval:
+            return
+
+        def run():
+            while True:
+                socketio.sleep(self.interval)
+                self.flush()
+
+        self._task = socketio.start_background_task(run)
+
+    def flush_on_signal(self, signum=signal.SIGTERM):
+        """Flush pending rows when the process is sent a signal.
+
+        Servers stop their workers with SIGTERM, which skips atexit
+        handlers. The handler flushes, then passes the signal on to the
+        handler it replaced, or delivers it again with the default action
+        so the process still ends. Must be called from the main thread.
+
+        Args:
+            signum (int): The signal to flush on.
+        """
+        if self._signal_handled:
+            return
+        previous = signal.getsignal(signum)
+
+        def handler(number, frame):
+            self.flush()
+            if callable(previous):
+                previous(number, frame)
+            elif previous != signal.SIG_IGN:
+                signal.signal(number, signal.SIG_DFL)
+                os.kill(os.getpid(), number)
+
+        signal.signal(signum, handler)
+        self._signal_handled = True
+
+    def add(self, model, values):
+        """Queue a row for insertion.
+
+        Args:
+            model (Model): The mapped class to insert into.
+            values (dict): Column values for the new row.
+        """
+        with self._lock:
+            self._pending.append((model, values))
+            depth = len(self._pending)
+        if depth >= self.maxsize or (
+            depth >= self.batch_size and self._task is None
+        ):
+            self.flush()
+
+    def flush(self):
+        """Insert every pending row, one statement per model, in one commit.
+
+        A batch the database is unavailable for is put back at the front
+        of the queue to be retried on the next flush; if that overflows
+        ``maxsize`` the oldest rows are dropped. If the batch fails for
+        any other reason its rows are retried one at a time, and those
+        still refused are logged and dropped.
+
+        Returns:
+            int: Number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch or self.app is None:
+                return 0
+
+            db = self.db
+            grouped = {}
+            for model, values in batch:
+                grouped.setdefault(model, []).append(values)
+            start = perf_counter()
+            with self.app.app_context():
+                try:
+                    for model, rows in grouped.items():
+                        db.session.execute(insert(model), rows)
+                    db.session.commit()
+                    written = len(batch)
+                except Exception as error:
+                    db.session.rollback()
+                    self.failures += 1
+                    logger.exception(
+                        'Write-behind flush of %d rows failed', len(batch)
+                    )
+                    if isinstance(error, UNAVAILABLE_ERRORS):
+                        self._requeue(batch)
+                        return 0
+                    written = self._insert_each(batch)
+
+            elapsed = (perf_counter() - start) * 1000
+            self.flushed += written
+            self.batches += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            return written
+
+    def _insert_each(self, batch):
+        """Insert a failed batch row by row, dropping the rows refused.
+
+        Stops and puts the rest back if the database becomes unavailable.
+
+        Returns:
+            int: Number of rows written.
+        """
+        session = self.db.session
+        written = 0
+        for index, (model, values) in enumerate(batch):
+            try:
+                session.execute(insert(model), [values])
+                session.commit()
+            except UNAVAILABLE_ERRORS:
+                session.rollback()
+                self._requeue(batch[index:])
+                break
+            except Exception as error:
+                session.rollback()
+                self.rejected += 1
+                logger.error(
+                    'Dropping %s row rejected by the database: %r (%s)',
+                    model.__name__, values, error
+                )
+            else:
+                written += 1
+        return written
+
+    def _requeue(self, rows):
+        """Put rows back at the front of the queue, within ``maxsize``."""
+        with self._lock:
+            self._pending[:0] = rows
+            overflow = len(self._pending) - self.maxsize
+            if overflow > 0:
+                del self._pending[:overflow]
+                self.dropped += overflow
+
+    def clear(self):
+        """Discard every pending row and reset the counters."""
+        with self._lock:
+            self._pending = []
+        self._reset_counters()
+
+    def stats(self):
+        """Return the buffer counters.
+
+        Returns:
+            dict: Queue depth, rows and batches written, failed flushes,
+            rows dropped on overflow, rows rejected by the database and
+            flush latency in milliseconds.
+        """
+        return {
+            'depth': len(self),
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failures': self.failures,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'last_flush_ms': self.last_flush_ms,
+            'max_flush_ms': self.max_flush_ms
+        }
+
+    def __len__(self):
+        return len(self._pending)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Bounded in-process caches used by the Flask application.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache with hit/miss counters.
+
+    Keys are tuples whose first element is the "owner" of the entry (for
+    example a post ID), so every entry for one owner can be dropped at once.
+    """
+
+    def __init__(self, maxsize=1024, config_key=None):
+        self.maxsize = maxsize
+        self.config_key = config_key
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def init_app(self, app):
+        """Size the cache from the app config and start it empty.
+
+        Args:
+            app (Flask): The application being configured.
+        """
+        if self.config_key:
+            self.maxsize = app.config.get(self.config_key, self.maxsize)
+        self.clear()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss.
+
+        Args:
+            key (tuple): The cache key.
+
+        Returns:
+            object: The cached value, or None.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entry if full.
+
+        Args:
+            key (tuple): The cache key.
+            value (object): The value to cache.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, owner):
+        """Drop every entry whose key starts with owner.
+
+        Args:
+            owner (object): The first element of the keys to drop.
+        """
+        with self._lock:
+            for key in [key for key in self._data if key[0] == owner]:
+                del self._data[key]
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the cache counters.
+
+        Returns:
+            dict: Hits, misses, hit ratio and current size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'size': len(self._data),
+                'maxsize': self.maxsize
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """
+    An LRUCache whose entries also expire ``ttl`` seconds after being set.
+
+    Expiry bounds how stale an entry can get when a change is made
+    somewhere that does not invalidate it.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, config_key=None,
+                 ttl_config_key=None):
+        super().__init__(maxsize=maxsize, config_key=config_key)
+        self.ttl = ttl
+        self.ttl_config_key = ttl_config_key
+
+    def init_app(self, app):
+        """Size the cache and set its TTL from the app config.
+
+        Args:
+            app (Flask): The application being configured.
+        """
+        if self.ttl_config_key:
+            self.ttl = app.config.get(self.ttl_config_key, self.ttl)
+        super().init_app(app)
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired.
+
+        Args:
+            key (tuple): The cache key.
+
+        Returns:
+            object: The cached value, or None.
+        """
+        with self._lock:
+            try:
+                expires_at, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires_at <= monotonic():
+                self.misses += 1
+                return None
+            self._data[key] = (expires_at, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store a value for ``ttl`` seconds.
+
+        Args:
+            key (tuple): The cache key.
+            value (object): The value to cache.
+        """
+        super().set(key, (monotonic() + self.ttl, value))
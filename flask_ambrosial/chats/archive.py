@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Retention for chat history: old messages move to compressed archive files.
+"""
+
+import fcntl
+import gzip
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import click
+from flask import current_app
+from sqlalchemy import delete, select
+from flask_ambrosial import db
+from flask_ambrosial.models import User, ChatMessage
+from flask_ambrosial.chats.utils import conversation_room
+from flask_ambrosial.passwords import in_green_thread
+
+# Archive room of messages sent to the public chat
+PUBLIC_ARCHIVE = 'public'
+
+
+class ChatArchive:
+    """
+    Append-only, gzip-compressed NDJSON segments of archived messages.
+
+    Each room has one segment per month (``<room>/<YYYY-MM>.ndjson.gz``).
+    Every append adds a gzip member to the end of the segment, so nothing
+    already written is rewritten. A small ``index.json`` records each
+    segment's message count, ID range and committed size; bytes past that
+    size are the remains of an interrupted append and are cut off before
+    the next one. Writers hold an exclusive lock on ``index.json.lock``
+    (see lock()), so two of them never append to a segment at once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, 'index.json')
+
+    @contextmanager
+    def lock(self, wait=True):
+        """Hold the archive's exclusive writer lock.
+
+        Args:
+            wait (bool): Wait for another writer to finish, rather than
+                give up at once.
+
+        Yields:
+            bool: Whether the lock is held.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.index_path + '.lock', 'a') as lock_file:
+            flags = fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load_index(self):
+        """Return the segment index.
+
+        Returns:
+            dict: Segment entries keyed by room, then by month.
+        """
+        try:
+            with open(self.index_path) as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            return {}
+
+    def _save_index(self, index):
+        """Replace the index atomically."""
+        partial = self.index_path + '.tmp'
+        with open(partial, 'w') as index_file:
+            json.dump(index, index_file, indent=1, sort_keys=True)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(partial, self.index_path)
+
+    def append(self, room, month, records):
+        """Append messages to a room's segment for a month.
+
+        Args:
+            room (str): The archive room name.
+            month (str): The month, as ``YYYY-MM``.
+            records (list): The messages, as dicts with an ``id``.
+        """
+        index = self.load_index()
+        entry = index.setdefault(room, {}).setdefault(month, {
+            'file': f'{room}/{month}.ndjson.gz', 'messages': 0, 'size': 0,
+            'first_id': records[0]['id'], 'last_id': records[0]['id']
+        })
+        path = os.path.join(self.root, entry['file'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as raw:
+            # Drop whatever an interrupted append left past the last commit
+            raw.truncate(entry['size'])
+            with gzip.GzipFile(fileobj=raw, mode='ab') as segment:
+                for record in records:
+                    segment.write(
+                        json.dumps(record).encode('utf-8') + b'\n'
+                    )
+            raw.flush()
+            os.fsync(raw.fileno())
+            entry['size'] = raw.tell()
+        entry['messages'] += len(records)
+        entry['first_id'] = min(
+            entry['first_id'], min(record['id'] for record in records)
+        )
+        entry['last_id'] = max(
+            entry['last_id'], max(record['id'] for record in records)
+        )
+        self._save_index(index)
+
+    def segments(self, room):
+        """Return a room's segments, oldest month first.
+
+        Args:
+            room (str): The archive room name.
+
+        Returns:
+            list: (month, entry) pairs from the index.
+        """
+        return sorted(self.load_index().get(room, {}).items())
+
+    def stream(self, room, month=None):
+        """Yield a room's archived messages, oldest month first.
+
+        A batch that was archived but not deleted before a crash is
+        archived again on the next run; the repeat is skipped here.
+
+        Args:
+            room (str): The archive room name.
+            month (str): Only stream this month, as ``YYYY-MM``.
+
+        Yields:
+            dict: One archived message.
+        """
+        for segment_month, entry in self.segments(room):
+            if month is not None and segment_month != month:
+                continue
+            seen = set()
+            path = os.path.join(self.root, entry['file'])
+            with open(path, 'rb') as raw:
+                with gzip.GzipFile(fileobj=raw) as segment:
+                    try:
+                        for line in segment:
+                            record = json.loads(line)
+                            if record['id'] not in seen:
+                                seen.add(record['id'])
+                                yield record
+                    except EOFError:
+                        # An interrupted append at the end of the segment
+                        pass
+
+
+def archive_room_name(conversation_id):
+    """Return the archive room of a conversation, or of the public chat.
+
+    Args:
+        conversation_id (int): The conversation ID, or None.
+
+    Returns:
+        str: The archive room name.
+    """
+    if conversation_id is None:
+        return PUBLIC_ARCHIVE
+    return conversation_room(conversation_id)
+
+
+def archive_messages(archive, cutoff, batch_size=1000, wait=True):
+    """Move messages sent before a cutoff from the database to an archive.
+
+    Messages are taken oldest first in batches off the (timestamp, id)
+    index; each batch is written to its segments before its rows are
+    deleted and committed, so a crash loses nothing. The archive's lock is
+    held for the whole run, so concurrent runs cannot overwrite each
+    other's appends.
+
+    In a green thread, the gzip and fsync work of each append runs on
+    eventlet's thread pool and the hub gets a turn between batches, so a
+    large backlog does not stall live chat in the same process.
+
+    Args:
+        archive (ChatArchive): The archive to append to.
+        cutoff (datetime): Messages sent before this time are archived.
+        batch_size (int): Messages moved per batch.
+        wait (bool): Wait for a run in another process to finish, rather
+            than skip this one.
+
+    Returns:
+        int: Number of messages archived, or None if skipped.
+    """
+    with archive.lock(wait) as locked:
+        if not locked:
+            return None
+        return _archive_batches(archive, cutoff, batch_size)
+
+
+def _archive_batches(archive, cutoff, batch_size):
+    """Archive messages batch by batch, under the archive's lock."""
+    query = select(
+        ChatMessage.id, ChatMessage.conversation_id, ChatMessage.user_id,
+        User.username, ChatMessage.content, ChatMessage.timestamp
+    ).outerjoin(User, ChatMessage.user_id == User.id).where(
+        ChatMessage.timestamp < cutoff
+    ).order_by(ChatMessage.timestamp, ChatMessage.id).limit(batch_size)
+
+    green = in_green_thread()
+    archived = 0
+    while True:
+        rows = db.session.execute(query).all()
+        if not rows:
+            return archived
+        segments = {}
+        for row in rows:
+            room = archive_room_name(row.conversation_id)
+            segments.setdefault(
+                (room, row.timestamp.strftime('%Y-%m')), []
+            ).append({
+                'id': row.id, 'user_id': row.user_id,
+                'username': row.username, 'content': row.content,
+                'timestamp': row.timestamp.isoformat()
+            })
+        for (room, month), records in segments.items():
+            if green:
+                from eventlet import tpool
+                tpool.execute(archive.append, room, month, records)
+            else:
+                archive.append(room, month, records)
+        db.session.execute(
+            delete(ChatMessage).where(
+                ChatMessage.id.in_([row.id for row in rows])
+            )
+        )
+        db.session.commit()
+        archived += len(rows)
+        if green:
+            import eventlet
+            eventlet.sleep(0)
+
+
+def retention_cutoff(days):
+    """Return the time before which messages are archived.
+
+    Args:
+        days (int): Days of history kept in the database.
+
+    Returns:
+        datetime: The naive UTC cutoff.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now - timedelta(days=days)
+
+
+def get_chat_archive():
+    """Return the archive configured for the current app.
+
+    Returns:
+        ChatArchive: The archive under CHAT_ARCHIVE_DIR, or under the
+        instance folder if that is not set.
+    """
+    root = current_app.config['CHAT_ARCHIVE_DIR'] or os.path.join(
+        current_app.instance_path, 'chat_archive'
+    )
+    return ChatArchive(root)
+
+
+@click.command('archive')
+@click.option('--days', type=int, default=None,
+              help='Days of history to keep (CHAT_RETENTION_DAYS).')
+@click.option('--batch-size', type=int, default=None,
+              help='Messages moved per batch (CHAT_ARCHIVE_BATCH_SIZE).')
+def archive_command(days, batch_size):
+    """Move old chat messages into compressed archive files."""
+    config = current_app.config
+    days = config['CHAT_RETENTION_DAYS'] if days is None else days
+    archive = get_chat_archive()
+    cutoff = retention_cutoff(days)
+    count = archive_messages(
+        archive, cutoff,
+        batch_size=batch_size or config['CHAT_ARCHIVE_BATCH_SIZE']
+    )
+    click.echo(
+        f'Archived {count} messages sent before {cutoff:%Y-%m-%d %H:%M} '
+        f'to {archive.root}'
+    )
+
+
+def claim_archiver(archive):
+    """Try to become the one process that runs the periodic archive job.
+
+    Args:
+        archive (ChatArchive): The archive the job writes to.
+
+    Returns:
+        file: The open lock file, to be kept for as long as the process
+        runs the job, or None if another process runs it.
+    """
+    os.makedirs(archive.root, exist_ok=True)
+    lock_file = open(os.path.join(archive.root, 'archiver.lock'), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def start_archiver(app, socketio):
+    """Run the archive job every CHAT_ARCHIVE_INTERVAL seconds.
+
+    With several workers, the job runs in whichever one claims it first;
+    the others check again every interval, in case that worker exits.
+
+    Args:
+        app (Flask): The application whose history is archived.
+        socketio (SocketIO): The server whose async mode runs the task.
+    """
+    interval = app.config['CHAT_ARCHIVE_INTERVAL']
+
+    def run():
+        claim = None
+        while True:
+            socketio.sleep(interval)
+            with app.app_context():
+                archive = get_chat_archive()
+                if claim is None:
+                    claim = claim_archiver(archive)
+                    if claim is None:
+                        continue
+                try:
+                    # Skipped while `flask chat archive` is running, rather
+                    # than blocking the server
+                    archive_messages(
+                        archive,
+                        retention_cutoff(app.config['CHAT_RETENTION_DAYS']),
+                        batch_size=app.config['CHAT_ARCHIVE_BATCH_SIZE'],
+                        wait=False
+                    )
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('Chat archive job failed')
+
+    socketio.start_background_task(run)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Room fan-out for chat messages, with optional coalescing and backpressure.
+"""
+
+import logging
+from collections import defaultdict
+from threading import Lock
+from flask import current_app
+from flask_ambrosial import socketio
+
+logger = logging.getLogger(__name__)
+
+class RoomEmitter:
+    """
+    Sends chat messages to rooms on behalf of the socket handlers.
+
+    With a non-zero ``interval`` the messages for each room are held and
+    sent as one list per tick, so a burst costs each client one frame
+    instead of one per message. Before every send, local clients with more
+    than ``queue_limit`` frames still waiting to go out are skipped
+    (``'drop'``) or disconnected (``'disconnect'``), so a slow reader
+    cannot build an unbounded queue.
+    """
+
+    def __init__(self, socketio, interval=0, queue_limit=0, policy='drop'):
+        self.socketio = socketio
+        self.interval = interval
+        self.queue_limit = queue_limit
+        self.policy = policy
+        self._pending = defaultdict(list)
+        self._lock = Lock()
+        self._task = None
+        self.frames_sent = 0
+        self.messages_sent = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self._queues_unavailable = False
+
+    def send(self, room, message):
+        """Send a message to a room, now or on the next tick.
+
+        Args:
+            room (str): The room name.
+            message (dict): The message payload.
+        """
+        if not self.interval:
+            self._emit(room, message, 1)
+            return
+        with self._lock:
+            self._pending[room].append(message)
+            if self._task is None:
+                self._task = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        """Flush the pending messages once per tick."""
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing room messages failed')
+
+    def flush(self):
+        """Send each room's pending messages as a single list.
+
+        A room whose frame fails to go out has its messages counted as
+        dropped, so the other rooms and later ticks still go out.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(list)
+        for room, messages in pending.items():
+            try:
+                self._emit(room, messages, len(messages))
+            except Exception:
+                logger.exception('Emitting to room %s failed', room)
+                self.dropped += len(messages)
+
+    def _congested(self, room):
+        """Return the local clients in a room whose send queue is over limit.
+
+        Args:
+            room (str): The room name.
+
+        Returns:
+            list: Socket.IO session IDs of the congested clients.
+        """
+        if not self.queue_limit:
+            return []
+        sio = self.socketio.server
+        # Send queues are private python-engineio state (written against
+        # python-engineio 4.x: Server.sockets maps each Engine.IO session
+        # ID to a Socket with a ``queue``). If an upgrade moves them, every
+        # client is treated as keeping up rather than failing the emit.
+        sockets = getattr(getattr(sio, 'eio', None), 'sockets', None)
+        if not isinstance(sockets, dict):
+            self._queues_missing()
+            return []
+        congested = []
+        for sid, eio_sid in sio.manager.get_participants('/', room):
+            socket = sockets.get(eio_sid)
+            if socket is None:
+                continue
+            qsize = getattr(getattr(socket, 'queue', None), 'qsize', None)
+            if qsize is None:
+                self._queues_missing()
+                return []
+            if qsize() > self.queue_limit:
+                congested.append(sid)
+        return congested
+
+    def _queues_missing(self):
+        """Warn, once, that client send queues cannot be inspected."""
+        if not self._queues_unavailable:
+            self._queues_unavailable = True
+            logger.warning(
+                'Cannot read Engine.IO send queues; slow chat clients '
+                'will not be shed'
+            )
+
+    def _emit(self, room, payload, count):
+        """Emit one frame to a room, applying the slow-client policy.
+
+        Args:
+            room (str): The room name.
+            payload (dict or list): One message or a batch of messages.
+            count (int): Number of messages in the payload.
+        """
+        congested = self._congested(room)
+        if congested:
+            self.dropped += count * len(congested)
+            if self.policy == 'disconnect':
+                for sid in congested:
+                    self.socketio.server.disconnect(sid)
+                self.disconnected += len(congested)
+        self.socketio.emit(
+            'message', payload, to=room, skip_sid=congested or None
+        )
+        self.frames_sent += 1
+        self.messages_sent += count
+
+    def stats(self):
+        """Return the fan-out counters.
+
+        Returns:
+            dict: Frames and messages sent, messages per frame, messages
+            dropped for slow clients and clients disconnected.
+        """
+        return {
+            'frames_sent': self.frames_sent,
+            'messages_sent': self.messages_sent,
+            'messages_per_frame': (
+                self.messages_sent / self.frames_sent
+                if self.frames_sent else 0.0
+            ),
+            'dropped': self.dropped,
+            'disconnected': self.disconnected
+        }
+
+
+def get_room_emitter():
+    """Return the current app's room emitter, creating it on first use.
+
+    Returns:
+        RoomEmitter: The emitter configured from the app config.
+    """
+    emitter = current_app.extensions.get('chat_emitter')
+    if emitter is None:
+        config = current_app.config
+        emitter = current_app.extensions['chat_emitter'] = RoomEmitter(
+            socketio, interval=config['CHAT_EMIT_INTERVAL'],
+            queue_limit=config['CHAT_CLIENT_QUEUE_LIMIT'],
+            policy=config['CHAT_SLOW_CLIENT_POLICY']
+        )
+    return emitter
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Read receipts for conversations, stored as one watermark per member.
+"""
+
+import logging
+from datetime import datetime, timezone
+from threading import Lock
+from flask import current_app
+from sqlalchemy import bindparam, select
+from flask_ambrosial import socketio, db, chat_buffer
+from flask_ambrosial.models import ChatMessage, ConversationMember
+from flask_ambrosial.chats.utils import conversation_room
+
+logger = logging.getLogger(__name__)
+
+
+class ReadReceipts:
+    """
+    Coalesces read events into member watermarks and room notifications.
+
+    A member's read state is the ID of the newest message they have read,
+    so it costs one column however long the history grows. Read events
+    are held for ``interval`` seconds; each tick then writes every
+    advanced watermark in one statement and sends each conversation's
+    members a single ``read`` event listing who has read how far. A
+    watermark only ever moves forward.
+    """
+
+    def __init__(self, socketio, interval=0):
+        self.socketio = socketio
+        self.interval = interval
+        self.app = None
+        self._pending = {}
+        self._lock = Lock()
+        self._task = None
+        self.events = 0
+        self.writes = 0
+
+    def mark(self, conversation_id, user_id, username, message_id=None,
+             timestamp=None):
+        """Record that a member has read a conversation up to a point.
+
+        Clients that know the message ID send it; live messages are only
+        given an ID when the write-behind buffer flushes, so clients may
+        send the timestamp of the newest message they have shown instead.
+
+        Args:
+            conversation_id (int): The conversation ID.
+            user_id (int): The reader's user ID.
+            username (str): The reader's name, sent to the other members.
+            message_id (int): ID of the newest message read.
+            timestamp (datetime): Time of the newest message read.
+        """
+        with self._lock:
+            self.events += 1
+            self._merge(
+                (conversation_id, user_id), username, message_id, timestamp
+            )
+            if self.interval and self._task is None:
+                self._task = self.socketio.start_background_task(self._run)
+        if not self.interval:
+            self.flush()
+
+    def _merge(self, key, username, message_id, timestamp):
+        """Fold a receipt into the pending one for the same member.
+
+        Must be called with the lock held.
+        """
+        _, read_id, read_at = self._pending.get(key, (None, None, None))
+        if message_id is not None:
+            read_id = max(read_id or 0, message_id)
+        if timestamp is not None:
+            read_at = max(read_at or timestamp, timestamp)
+        self._pending[key] = (username, read_id, read_at)
+
+    def _run(self):
+        """Flush the pending receipts once per tick."""
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing read receipts failed')
+
+    def _resolve(self, conversation_id, read_id, read_at):
+        """Return the message ID a receipt points at.
+
+        Args:
+            conversation_id (int): The conversation ID.
+            read_id (int): The message ID sent by the client, if any.
+            read_at (datetime): The message time sent by the client, if any.
+
+        Returns:
+            int: The newest message ID covered by the receipt.
+        """
+        if read_at is not None:
+            # Walks back from the newest message of the conversation
+            newest = db.session.execute(
+                select(ChatMessage.id).where(
+                    ChatMessage.conversation_id == conversation_id,
+                    ChatMessage.timestamp <= read_at
+                ).order_by(ChatMessage.id.desc()).limit(1)
+            ).scalar()
+            read_id = max(read_id or 0, newest or 0)
+        return read_id or 0
+
+    def flush(self):
+        """Write the pending watermarks and notify each conversation.
+
+        If the write fails it is rolled back and the receipts are put back
+        for the next tick before the error is raised.
+
+        Returns:
+            int: Number of receipts written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.app is None:
+            return 0
+
+        if any(read_at is not None for _, _, read_at in pending.values()):
+            # Messages still waiting in the buffer need their IDs
+            chat_buffer.flush()
+        rows = []
+        rooms = {}
+        with self.app.app_context():
+            try:
+                for (conversation_id, user_id), entry in pending.items():
+                    username, read_id, read_at = entry
+                    read_id = self._resolve(conversation_id, read_id, read_at)
+                    if not read_id:
+                        continue
+                    rows.append({
+                        'b_conversation_id': conversation_id,
+                        'b_user_id': user_id, 'b_read_id': read_id
+                    })
+                    rooms.setdefault(conversation_id, []).append({
+                        'username': username, 'message_id': read_id
+                    })
+                if rows:
+                    table = ConversationMember.__table__
+                    db.session.execute(
+                        table.update().where(
+                            table.c.conversation_id ==
+                            bindparam('b_conversation_id'),
+                            table.c.user_id == bindparam('b_user_id'),
+                            table.c.last_read_id < bindparam('b_read_id')
+                        ).values(last_read_id=bindparam('b_read_id')),
+                        rows
+                    )
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    # Newer receipts may have come in meanwhile
+                    for key, (username, read_id, read_at) in pending.items():
+                        self._merge(key, username, read_id, read_at)
+                raise
+
+        for conversation_id, receipts in rooms.items():
+            self.socketio.emit(
+                'read', receipts, to=conversation_room(conversation_id)
+            )
+        self.writes += len(rows)
+        return len(rows)
+
+    def stats(self):
+        """Return the receipt counters.
+
+        Returns:
+            dict: Read events received, watermarks written and receipts
+            waiting for the next tick.
+        """
+        return {
+            'events': self.events,
+            'writes': self.writes,
+            'pending': len(self._pending)
+        }
+
+
+def get_read_receipts():
+    """Return the current app's read receipts, creating them on first use.
+
+    Returns:
+        ReadReceipts: The receipts coalesced over CHAT_READ_INTERVAL.
+    """
+    receipts = current_app.extensions.get('chat_receipts')
+    if receipts is None:
+        receipts = current_app.extensions['chat_receipts'] = ReadReceipts(
+            socketio, interval=current_app.config['CHAT_READ_INTERVAL']
+        )
+        receipts.app = current_app._get_current_object()
+    return receipts
+
+
+def parse_read_timestamp(value):
+    """Parse the message time sent with a read event.
+
+    Args:
+        value (str): An ISO timestamp, naive UTC like the server sends.
+
+    Returns:
+        datetime: The naive UTC time, or None if the value is invalid.
+    """
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.replace(tzinfo=None)
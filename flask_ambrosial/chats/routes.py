@@ -5,15 +5,36 @@ This module defines the chat routes and socket events for the Flask
 application.
 """
 
-from flask import Blueprint, render_template, request, jsonify
+from flask import (
+    Blueprint, current_app, render_template, request, jsonify, session,
+    abort, Response, stream_with_context
+)
 from flask_login import login_required, current_user
 from flask_socketio import emit, join_room
-from flask_ambrosial import socketio, db
-from flask_ambrosial.models import ChatMessage
+from datetime import datetime, timezone
+from uuid import uuid4
+from flask_ambrosial import socketio, db, chat_buffer
+from flask_ambrosial.models import User, ChatMessage
+from flask_ambrosial.chats.utils import (
+    fetch_messages, serialize_message, encode_message_cursor,
+    get_room_backlog, chat_frame, fetch_conversation_messages,
+    conversation_room, is_member, start_conversation, list_conversations,
+    serialize_conversation, DEFAULT_ROOM, MAX_MESSAGE_LENGTH
+)
+from flask_ambrosial.chats.emitter import get_room_emitter
+from flask_ambrosial.chats.archive import (
+    archive_command, archive_room_name, get_chat_archive
+)
+from flask_ambrosial.chats.receipts import (
+    get_read_receipts, parse_read_timestamp
+)
+import json
 import logging
 
 # Create a Blueprint for chat routes
 chat = Blueprint('chat', __name__)
+# `flask chat archive` moves old messages out of the database
+chat.cli.add_command(archive_command)
 
 @chat.route("/chat")
 @login_required
@@ -24,25 +45,63 @@ def chat_room():
     Returns:
         str: Rendered HTML template for the chat room.
     """
-    return render_template('chat.html', username=current_user.username)
+    return render_template(
+        'chat.html', username=current_user.username,
+        serializer=current_app.config['SOCKETIO_SERIALIZER'],
+        conversation_id=None
+    )
+
+@chat.route("/chat/<int:conversation_id>")
+@login_required
+def conversation_room_page(conversation_id):
+    """
+    Render the chat room template for a private conversation.
+
+    Args:
+        conversation_id (int): The ID of the conversation.
+
+    Returns:
+        str: Rendered HTML template for the conversation.
+    """
+    if not is_member(conversation_id, current_user.id):
+        abort(403)
+    return render_template(
+        'chat.html', username=current_user.username,
+        serializer=current_app.config['SOCKETIO_SERIALIZER'],
+        conversation_id=conversation_id
+    )
 
 @chat.route("/api/messages", methods=['GET'])
 @login_required
 def get_messages():
     """
-    Fetch all chat messages from the database.
+    Fetch one page of chat messages, oldest first.
+
+    Query parameters ``before`` and ``after`` take the cursors returned by
+    a previous page; ``since_id`` returns everything after a message ID,
+    for clients catching up after a reconnect. ``limit`` sets the page
+    size, up to MAX_PAGE_SIZE.
 
     Returns:
-        jsonify: JSON response containing all chat messages.
+        jsonify: JSON response containing the page of chat messages.
     """
-    messages = ChatMessage.query.all()
-    return jsonify([
-        {
-            'id': msg.id,
-            'username': msg.user.username,
-            'content': msg.content
-        } for msg in messages
-    ])
+    rows, has_more = fetch_messages(
+        before=request.args.get('before'), after=request.args.get('after'),
+        since_id=request.args.get('since_id', type=int),
+        limit=request.args.get('limit', 50, type=int)
+    )
+    return jsonify({
+        'messages': [serialize_message(row) for row in rows],
+        'has_more': has_more,
+        'before': (
+            encode_message_cursor(rows[0].timestamp, rows[0].id)
+            if rows else None
+        ),
+        'after': (
+            encode_message_cursor(rows[-1].timestamp, rows[-1].id)
+            if rows else None
+        )
+    })
 
 @chat.route("/api/messages", methods=['POST'])
 @login_required
@@ -61,21 +120,215 @@ def post_message():
     db.session.commit()
     return jsonify({
         'id': chat_message.id,
+        'uid': chat_message.uid,
         'username': current_user.username,
         'content': data['msg']
     }), 201
 
+@chat.route("/api/conversations", methods=['GET'])
+@login_required
+def get_conversations():
+    """
+    List the current user's conversations with their unread counts.
+
+    Returns:
+        jsonify: JSON response containing the conversations.
+    """
+    return jsonify({'conversations': list_conversations(current_user.id)})
+
+@chat.route("/api/conversations", methods=['POST'])
+@login_required
+def create_conversation():
+    """
+    Start a conversation with other users.
+
+    The JSON body holds the other members' ``usernames`` and an optional
+    ``name``. A one-to-one conversation without a name is reused if the
+    two users already have one. The current user is always a member, so
+    naming only oneself is refused.
+
+    Returns:
+        jsonify: JSON response containing the conversation.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    usernames = data.get('usernames')
+    name = data.get('name')
+    others = []
+    if (isinstance(usernames, list)
+            and all(isinstance(username, str) for username in usernames)
+            and (name is None or isinstance(name, str))):
+        usernames = set(usernames) - {current_user.username}
+        if usernames:
+            others = User.query.filter(User.username.in_(usernames)).all()
+    if not others or len(others) != len(usernames):
+        return jsonify({'success': False, 'message': 'Invalid data'}), 400
+    conversation, created = start_conversation(
+        current_user, others, name=name
+    )
+    return jsonify(serialize_conversation(conversation)), (
+        201 if created else 200
+    )
+
+@chat.route(
+    "/api/conversations/<int:conversation_id>/messages", methods=['GET']
+)
+@login_required
+def get_conversation_messages(conversation_id):
+    """
+    Fetch one page of a conversation's messages, oldest first.
+
+    Query parameters ``before`` and ``after`` take message IDs; ``limit``
+    sets the page size, up to MAX_PAGE_SIZE.
+
+    Args:
+        conversation_id (int): The ID of the conversation.
+
+    Returns:
+        jsonify: JSON response containing the page of messages.
+    """
+    if not is_member(conversation_id, current_user.id):
+        abort(403)
+    rows, has_more = fetch_conversation_messages(
+        conversation_id, before_id=request.args.get('before', type=int),
+        after_id=request.args.get('after', type=int),
+        limit=request.args.get('limit', 50, type=int)
+    )
+    return jsonify({
+        'messages': [serialize_message(row) for row in rows],
+        'has_more': has_more,
+        'before': rows[0].id if rows else None,
+        'after': rows[-1].id if rows else None
+    })
+
+def stream_archive(conversation_id):
+    """
+    Stream a room's archived messages as newline-delimited JSON.
+
+    The ``month`` query parameter (``YYYY-MM``) limits the stream to one
+    month of the archive.
+
+    Args:
+        conversation_id (int): The conversation ID, or None for the public
+            room.
+
+    Returns:
+        Response: The streamed NDJSON response.
+    """
+    archive = get_chat_archive()
+    records = archive.stream(
+        archive_room_name(conversation_id), month=request.args.get('month')
+    )
+    lines = (json.dumps(record) + '\n' for record in records)
+    return Response(
+        stream_with_context(lines), mimetype='application/x-ndjson'
+    )
+
+@chat.route("/api/messages/archive", methods=['GET'])
+@login_required
+def get_archived_messages():
+    """
+    Stream the public room's archived messages, oldest first.
+
+    Returns:
+        Response: The streamed NDJSON response.
+    """
+    return stream_archive(None)
+
+@chat.route(
+    "/api/conversations/<int:conversation_id>/archive", methods=['GET']
+)
+@login_required
+def get_archived_conversation_messages(conversation_id):
+    """
+    Stream a conversation's archived messages, oldest first.
+
+    Args:
+        conversation_id (int): The ID of the conversation.
+
+    Returns:
+        Response: The streamed NDJSON response.
+    """
+    if not is_member(conversation_id, current_user.id):
+        abort(403)
+    return stream_archive(conversation_id)
+
+def socket_identity():
+    """
+    Return the (user ID, username) of the socket sending an event.
+
+    The identity is resolved once on connect and kept in the socket's
+    session, so events neither carry it nor cost a user lookup. A name
+    sent by the client is never used.
+
+    Returns:
+        tuple: The user ID and the username.
+    """
+    return tuple(session['chat_identity'])
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    """
+    Resolve the connecting user once and store it in the socket session.
+
+    Sockets without a logged-in user are refused.
+    """
+    if not current_user.is_authenticated:
+        return False
+    session['chat_identity'] = (current_user.id, current_user.username)
+
+def socket_room(data, user_id, joining=False):
+    """
+    Return the room a socket event is addressed to, or None if not allowed.
+
+    Events name either the public ``room``, DEFAULT_ROOM, or a private
+    ``conversation``. Other room names are refused: each would get its own
+    backlog in memory, and its messages would be stored as public ones.
+    Membership of a conversation is checked once, on join, and remembered
+    in the socket session, so messages to it cost no query.
+
+    Args:
+        data (dict): The event payload.
+        user_id (int): The sender's user ID.
+        joining (bool): Whether the event is a join.
+
+    Returns:
+        tuple: The room name and conversation ID (None for the public
+        room), or None.
+    """
+    if not isinstance(data, dict):
+        return None
+    conversation_id = data.get('conversation')
+    if conversation_id is None:
+        if data.get('room', DEFAULT_ROOM) != DEFAULT_ROOM:
+            return None
+        return DEFAULT_ROOM, None
+    if not isinstance(conversation_id, int):
+        return None
+    joined = session.get('conversations', [])
+    if conversation_id not in joined:
+        if not joining or not is_member(conversation_id, user_id):
+            return None
+        session['conversations'] = joined + [conversation_id]
+    return conversation_room(conversation_id), conversation_id
+
 @socketio.on('join')
 def handle_join(data):
     """
-    Handle a user joining a chat room.
+    Handle a user joining a chat room or conversation.
 
     Args:
-        data (dict): Data containing room and username information.
+        data (dict): Data containing the room name or conversation ID.
     """
-    room = data['room']
-    username = data['username']
+    user_id, username = socket_identity()
+    target = socket_room(data, user_id, joining=True)
+    if target is None:
+        return
+    room, _ = target
     join_room(room)
+    # Replay recent messages to the joining socket only
+    emit('history', get_room_backlog().get(room))
     emit('message', {'msg': f'{username} has entered the room.'}, room=room)
     print(f"Emitted join message for {username} to room {room}")  # Debugging
 
@@ -85,11 +338,56 @@ def handle_message(data):
     Handle a new chat message.
 
     Args:
-        data (dict): Data containing room, message, and username information.
+        data (dict): Data containing the room or conversation and the
+            message text.
     """
-    room = data['room']
-    msg = data['msg']
-    username = data['username']
+    user_id, username = socket_identity()
+    target = socket_room(data, user_id)
+    if target is None:
+        return
+    msg = data.get('msg')
+    if not isinstance(msg, str) or not msg:
+        return
+    msg = msg[:MAX_MESSAGE_LENGTH]
+    room, conversation_id = target
     print(f"User {username} sent message to room {room}: {msg}")  # Debugging
-    emit('message', {'msg': f'{username}: {msg}'}, room=room)
+    timestamp = datetime.now(timezone.utc)
+    uid = uuid4().hex
+    # Persisted in batches by the write-behind buffer, not per message
+    chat_buffer.add(ChatMessage, {
+        'content': msg, 'user_id': user_id,
+        'conversation_id': conversation_id, 'timestamp': timestamp,
+        'uid': uid
+    })
+    # Stored naive, like the timestamps read back from the database
+    sent_at = timestamp.replace(tzinfo=None).isoformat()
+    get_room_backlog().append(room, {
+        'uid': uid, 'username': username, 'content': msg,
+        'timestamp': sent_at
+    })
+    # Sent straight away, or batched with the room's other messages
+    get_room_emitter().send(room, chat_frame(
+        username, msg, sent_at, uid=uid,
+        compact=current_app.config['SOCKETIO_SERIALIZER'] == 'msgpack'
+    ))
     print(f"Emitted message for {username} to room {room}: {msg}")  # Debugging
+
+@socketio.on('read')
+def handle_read(data):
+    """
+    Handle a member reporting how far they have read a conversation.
+
+    Args:
+        data (dict): Data containing the conversation ID and either the
+            ``message_id`` or the ``timestamp`` of the newest message read.
+    """
+    user_id, username = socket_identity()
+    target = socket_room(data, user_id)
+    if target is None or target[1] is None:
+        return
+    message_id = data.get('message_id')
+    get_read_receipts().mark(
+        target[1], user_id, username,
+        message_id=message_id if isinstance(message_id, int) else None,
+        timestamp=parse_read_timestamp(data.get('timestamp'))
+    )
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Unit tests for chat retention and archival in the flask_ambrosial.chats
+module.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import eventlet
+from datetime import datetime, timedelta
+from flask import g
+from flask_ambrosial import create_app, db
+from flask_ambrosial.models import User, ChatMessage
+from flask_ambrosial.profiling import count_queries
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.chats.utils import start_conversation
+from flask_ambrosial.chats.archive import (
+    ChatArchive, archive_messages, claim_archiver, get_chat_archive,
+    PUBLIC_ARCHIVE
+)
+
+
+class ChatArchiveTestCase(unittest.TestCase):
+    """
+    Test cases for moving old chat messages to archive files.
+    """
+
+    def setUp(self):
+        """
+        Set up old and recent messages and an empty archive directory.
+        """
+        self.app = create_app(TestingConfig)
+        self.archive_dir = tempfile.mkdtemp()
+        self.app.config['CHAT_ARCHIVE_DIR'] = self.archive_dir
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        self.other = User(
+            username='otheruser', email='other@example.com',
+            password='password'
+        )
+        db.session.add_all([self.user, self.other])
+        db.session.commit()
+        self.conversation, _ = start_conversation(self.user, [self.other])
+        for i, day in enumerate([1, 15, 40, 45]):
+            db.session.add(ChatMessage(
+                content=f'Old {i}', user=self.user,
+                timestamp=datetime(2024, 1, 1) + timedelta(days=day)
+            ))
+        db.session.add(ChatMessage(
+            content='Old private', user=self.other,
+            conversation_id=self.conversation.id,
+            timestamp=datetime(2024, 1, 20)
+        ))
+        db.session.add(ChatMessage(
+            content='Recent', user=self.user, timestamp=datetime(2024, 6, 1)
+        ))
+        db.session.commit()
+        self.cutoff = datetime(2024, 5, 1)
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.archive_dir)
+
+    def test_old_messages_move_to_segments(self):
+        """
+        Test that old messages are archived by room and month in batches
+        and deleted from the database.
+        """
+        archive = get_chat_archive()
+        with count_queries() as statements:
+            self.assertEqual(
+                archive_messages(archive, self.cutoff, batch_size=2), 5
+            )
+        # Three full or partial batches, each a select and a delete, and a
+        # final empty select
+        self.assertEqual(len(statements), 7)
+        self.assertEqual(
+            [m.content for m in ChatMessage.query.all()], ['Recent']
+        )
+        self.assertEqual(
+            [month for month, _ in archive.segments(PUBLIC_ARCHIVE)],
+            ['2024-01', '2024-02']
+        )
+        self.assertEqual(
+            [m['content'] for m in archive.stream(PUBLIC_ARCHIVE)],
+            ['Old 0', 'Old 1', 'Old 2', 'Old 3']
+        )
+        self.assertEqual(
+            [m['content'] for m in archive.stream(
+                PUBLIC_ARCHIVE, month='2024-02'
+            )],
+            ['Old 2', 'Old 3']
+        )
+        january = dict(archive.segments(PUBLIC_ARCHIVE))['2024-01']
+        self.assertEqual(january['messages'], 2)
+        private = list(
+            archive.stream(f'conversation-{self.conversation.id}')
+        )
+        self.assertEqual(private[0]['username'], 'otheruser')
+
+    def test_green_run_yields_to_the_hub(self):
+        """
+        Test that in a green thread the appends run off the hub and other
+        green threads run between batches.
+        """
+        archive = get_chat_archive()
+        append = archive.append
+        append_threads = set()
+        ticks = []
+
+        def tracked_append(*args):
+            append_threads.add(threading.get_ident())
+            append(*args)
+
+        def job():
+            with self.app.app_context():
+                return archive_messages(archive, self.cutoff, batch_size=2)
+
+        def ticker():
+            while True:
+                ticks.append(len(append_threads))
+                eventlet.sleep(0)
+
+        archive.append = tracked_append
+        hub_thread = threading.get_ident()
+        ticking = eventlet.spawn(ticker)
+        run = eventlet.spawn(job)
+        self.assertEqual(run.wait(), 5)
+        ticking.kill()
+        self.assertNotIn(hub_thread, append_threads)
+        # The ticker ran while the job was part way through
+        self.assertTrue(any(ticks))
+        self.assertEqual(
+            [m.content for m in ChatMessage.query.all()], ['Recent']
+        )
+
+    def test_interrupted_append_is_discarded(self):
+        """
+        Test that a partial append is cut off and a repeated batch is
+        streamed once.
+        """
+        archive = ChatArchive(self.archive_dir)
+        records = [{'id': 1, 'content': 'One'}, {'id': 2, 'content': 'Two'}]
+        archive.append('room', '2024-01', records)
+        path = os.path.join(self.archive_dir, 'room', '2024-01.ndjson.gz')
+        with open(path, 'ab') as segment:
+            segment.write(b'\x1f\x8b\x08 partial')
+        archive.append('room', '2024-01', records[1:])
+        self.assertEqual(
+            [m['id'] for m in archive.stream('room')], [1, 2]
+        )
+
+    def test_concurrent_runs_are_serialized(self):
+        """
+        Test that a run waits for, or skips past, one holding the lock, and
+        that only one process claims the periodic job.
+        """
+        archive = get_chat_archive()
+        with archive.lock():
+            self.assertIsNone(
+                archive_messages(archive, self.cutoff, wait=False)
+            )
+            self.assertEqual(ChatMessage.query.count(), 6)
+        self.assertEqual(archive_messages(archive, self.cutoff, wait=False), 5)
+
+        claim = claim_archiver(archive)
+        self.assertIsNotNone(claim)
+        self.assertIsNone(claim_archiver(archive))
+        claim.close()
+        claim = claim_archiver(archive)
+        self.assertIsNotNone(claim)
+        claim.close()
+
+    def test_cli_and_streaming_route(self):
+        """
+        Test the archive command and streaming archived history back.
+        """
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['chat', 'archive', '--days', '0'])
+        self.assertIn('Archived 6 messages', result.output)
+        self.assertEqual(ChatMessage.query.count(), 0)
+
+        client = self.app.test_client()
+        self.assertEqual(
+            client.get('/api/messages/archive').status_code, 302
+        )
+        # Forget the anonymous user Flask-Login cached in the test's g
+        g.pop('_login_user', None)
+        with client.session_transaction() as session:
+            session['_user_id'] = str(self.user.id)
+            session['_fresh'] = True
+        response = client.get('/api/messages/archive?month=2024-01')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(response.get_data(as_text=True).count('\n'), 2)
+        response = client.get(
+            f'/api/conversations/{self.conversation.id}/archive'
+        )
+        self.assertIn('Old private', response.get_data(as_text=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the room emitter in the flask_ambrosial.chats module.
+"""
+
+import unittest
+from queue import Queue
+from types import SimpleNamespace
+from unittest.mock import patch
+from flask import g
+from flask_socketio import SocketIOTestClient
+from flask_ambrosial import create_app, db, socketio
+from flask_ambrosial.models import User
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.chats.emitter import RoomEmitter
+
+
+class RoomEmitterTestCase(unittest.TestCase):
+    """
+    Test cases for coalescing and backpressure in RoomEmitter.
+    """
+
+    def setUp(self):
+        """
+        Set up the app and a socket client in the default room.
+        """
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        user = User(
+            username='reader', email='reader@example.com',
+            password='password'
+        )
+        db.session.add(user)
+        db.session.commit()
+        socketio.init_app(self.app)
+        http_client = self.app.test_client()
+        with http_client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        self.client = SocketIOTestClient(
+            self.app, socketio, flask_test_client=http_client
+        )
+        g.pop('_login_user', None)
+        self.client.emit('join', {'room': 'default'})
+        self.client.get_received()
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        if self.client.is_connected():
+            self.client.disconnect()
+        socketio.server.eio.sockets.pop(self.client.eio_sid, None)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def congest_client(self, frames):
+        """
+        Pretend the client has frames waiting in its send queue.
+        """
+        queue = Queue()
+        for _ in range(frames):
+            queue.put(None)
+        socketio.server.eio.sockets[self.client.eio_sid] = SimpleNamespace(
+            queue=queue
+        )
+
+    def test_send_immediately(self):
+        """
+        Test that without an interval each message is its own frame.
+        """
+        emitter = RoomEmitter(socketio)
+        emitter.send('default', {'msg': 'one'})
+        emitter.send('default', {'msg': 'two'})
+        received = self.client.get_received()
+        self.assertEqual(
+            [event['args'] for event in received],
+            [{'msg': 'one'}, {'msg': 'two'}]
+        )
+        self.assertEqual(emitter.stats()['frames_sent'], 2)
+
+    def test_burst_is_coalesced(self):
+        """
+        Test that a burst is sent to the room as one batched frame.
+        """
+        emitter = RoomEmitter(socketio, interval=1)
+        emitter._task = object()  # Flushed by hand instead of on a timer
+        for i in range(3):
+            emitter.send('default', {'msg': f'Burst {i}'})
+        self.assertEqual(self.client.get_received(), [])
+        emitter.flush()
+        received = self.client.get_received()
+        self.assertEqual(len(received), 1)
+        self.assertEqual(
+            [message['msg'] for message in received[0]['args']],
+            ['Burst 0', 'Burst 1', 'Burst 2']
+        )
+        stats = emitter.stats()
+        self.assertEqual(stats['frames_sent'], 1)
+        self.assertEqual(stats['messages_per_frame'], 3)
+
+    def test_failed_emit_is_counted(self):
+        """
+        Test that a frame that fails to send is dropped, not retried forever.
+        """
+        emitter = RoomEmitter(socketio, interval=1)
+        emitter._task = object()  # Flushed by hand instead of on a timer
+        emitter.send('default', {'msg': 'lost'})
+        with patch.object(socketio, 'emit', side_effect=RuntimeError):
+            with self.assertLogs('flask_ambrosial.chats.emitter', 'ERROR'):
+                emitter.flush()
+        self.assertEqual(emitter.stats()['dropped'], 1)
+        self.assertEqual(emitter._pending, {})
+
+        emitter.send('default', {'msg': 'delivered'})
+        emitter.flush()
+        self.assertEqual(len(self.client.get_received()), 1)
+        self.assertEqual(emitter.stats()['frames_sent'], 1)
+
+    def test_slow_client_is_skipped(self):
+        """
+        Test that a client over the queue limit misses the frame.
+        """
+        emitter = RoomEmitter(socketio, queue_limit=2)
+        self.congest_client(3)
+        emitter.send('default', {'msg': 'skipped'})
+        self.assertEqual(self.client.get_received(), [])
+        self.assertEqual(emitter.stats()['dropped'], 1)
+        self.assertTrue(self.client.is_connected())
+
+        self.congest_client(2)
+        emitter.send('default', {'msg': 'delivered'})
+        self.assertEqual(len(self.client.get_received()), 1)
+
+    def test_unreadable_queue_is_not_congested(self):
+        """
+        Test that a client whose send queue cannot be read still gets the
+        frame, with a single warning.
+        """
+        emitter = RoomEmitter(socketio, queue_limit=2)
+        socketio.server.eio.sockets[self.client.eio_sid] = SimpleNamespace()
+        with self.assertLogs('flask_ambrosial.chats.emitter', 'WARNING') \
+                as logs:
+            emitter.send('default', {'msg': 'one'})
+            emitter.send('default', {'msg': 'two'})
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(len(self.client.get_received()), 2)
+        self.assertEqual(emitter.stats()['dropped'], 0)
+
+    def test_slow_client_is_disconnected(self):
+        """
+        Test that the disconnect policy closes a congested client.
+        """
+        emitter = RoomEmitter(socketio, queue_limit=2, policy='disconnect')
+        self.congest_client(3)
+        emitter.send('default', {'msg': 'closing'})
+        self.assertFalse(self.client.is_connected())
+        self.assertEqual(emitter.stats()['disconnected'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
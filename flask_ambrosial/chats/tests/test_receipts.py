@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the read receipts in the flask_ambrosial.chats module.
+"""
+
+import unittest
+from datetime import datetime, timedelta
+from flask import g
+from sqlalchemy import text
+from flask_socketio import SocketIOTestClient
+from flask_ambrosial import create_app, db, socketio
+from flask_ambrosial.models import User, ChatMessage, ConversationMember
+from flask_ambrosial.profiling import count_queries
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.chats.utils import (
+    start_conversation, unread_counts, conversation_room
+)
+from flask_ambrosial.chats.receipts import (
+    ReadReceipts, parse_read_timestamp
+)
+
+
+class ReadReceiptsTestCase(unittest.TestCase):
+    """
+    Test cases for coalesced read watermarks.
+    """
+
+    def setUp(self):
+        """
+        Set up a conversation with messages and a socket in its room.
+        """
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        self.other = User(
+            username='otheruser', email='other@example.com',
+            password='password'
+        )
+        db.session.add_all([self.user, self.other])
+        db.session.commit()
+        self.conversation, _ = start_conversation(self.user, [self.other])
+        start = datetime(2024, 1, 1)
+        self.messages = [
+            ChatMessage(
+                content=f'Message {i}', user=self.other,
+                conversation_id=self.conversation.id,
+                timestamp=start + timedelta(seconds=i)
+            )
+            for i in range(4)
+        ]
+        db.session.add_all(self.messages)
+        db.session.commit()
+        socketio.init_app(self.app)
+        http_client = self.app.test_client()
+        with http_client.session_transaction() as session:
+            session['_user_id'] = str(self.user.id)
+        self.client = SocketIOTestClient(
+            self.app, socketio, flask_test_client=http_client
+        )
+        g.pop('_login_user', None)
+        # Joined directly; membership checks are covered by the route tests
+        sid = socketio.server.manager.sid_from_eio_sid(
+            self.client.eio_sid, '/'
+        )
+        socketio.server.enter_room(
+            sid, conversation_room(self.conversation.id)
+        )
+        self.receipts = ReadReceipts(socketio, interval=1)
+        self.receipts.app = self.app
+        self.receipts._task = object()  # Flushed by hand instead of a timer
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        self.client.disconnect()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def watermark(self, user):
+        """
+        Return a member's stored watermark.
+        """
+        db.session.expire_all()
+        return db.session.get(
+            ConversationMember, (self.conversation.id, user.id)
+        ).last_read_id
+
+    def test_reads_are_coalesced(self):
+        """
+        Test that a burst of reads is one write and one room event.
+        """
+        for message in self.messages[:3]:
+            self.receipts.mark(
+                self.conversation.id, self.user.id, 'testuser',
+                message_id=message.id
+            )
+        self.assertEqual(self.receipts.stats()['pending'], 1)
+        with count_queries() as statements:
+            self.assertEqual(self.receipts.flush(), 1)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(self.watermark(self.user), self.messages[2].id)
+        received = self.client.get_received()
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]['name'], 'read')
+        self.assertEqual(received[0]['args'][0], [
+            {'username': 'testuser', 'message_id': self.messages[2].id}
+        ])
+        self.assertEqual(unread_counts(self.user.id)[self.conversation.id], 1)
+
+    def test_watermark_never_moves_back(self):
+        """
+        Test that an older receipt does not lower the watermark.
+        """
+        self.receipts.mark(
+            self.conversation.id, self.user.id, 'testuser',
+            message_id=self.messages[3].id
+        )
+        self.receipts.flush()
+        self.receipts.mark(
+            self.conversation.id, self.user.id, 'testuser',
+            message_id=self.messages[0].id
+        )
+        self.receipts.flush()
+        self.assertEqual(self.watermark(self.user), self.messages[3].id)
+        self.assertEqual(unread_counts(self.user.id)[self.conversation.id], 0)
+
+    def test_failed_write_keeps_receipts(self):
+        """
+        Test that receipts survive a failed write and go out on the next.
+        """
+        self.receipts.mark(
+            self.conversation.id, self.user.id, 'testuser',
+            message_id=self.messages[1].id
+        )
+        db.session.execute(text(
+            'ALTER TABLE conversation_member RENAME TO conversation_member_'
+        ))
+        with self.assertRaises(Exception):
+            self.receipts.flush()
+        db.session.execute(text(
+            'ALTER TABLE conversation_member_ RENAME TO conversation_member'
+        ))
+        db.session.commit()
+        self.assertEqual(self.receipts.stats()['pending'], 1)
+        self.receipts.mark(
+            self.conversation.id, self.user.id, 'testuser',
+            message_id=self.messages[0].id
+        )
+        self.assertEqual(self.receipts.flush(), 1)
+        self.assertEqual(self.watermark(self.user), self.messages[1].id)
+
+    def test_read_by_timestamp(self):
+        """
+        Test that a timestamp receipt resolves to the newest message sent
+        at or before it.
+        """
+        read_at = parse_read_timestamp(
+            self.messages[1].timestamp.isoformat()
+        )
+        self.receipts.mark(
+            self.conversation.id, self.other.id, 'otheruser',
+            timestamp=read_at
+        )
+        self.receipts.mark(
+            self.conversation.id, self.user.id, 'testuser',
+            timestamp=read_at + timedelta(milliseconds=500)
+        )
+        self.assertEqual(self.receipts.flush(), 2)
+        self.assertEqual(self.watermark(self.other), self.messages[1].id)
+        self.assertEqual(self.watermark(self.user), self.messages[1].id)
+        self.assertEqual(unread_counts(self.user.id)[self.conversation.id], 2)
+        self.assertIsNone(parse_read_timestamp('yesterday'))
+        self.assertEqual(
+            parse_read_timestamp('2024-01-01T01:00:00+01:00'),
+            datetime(2024, 1, 1)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,13 @@
 
 import unittest
 import time
-from flask import current_app
-from flask_ambrosial import create_app, db, socketio
+from flask import current_app, g
+from flask_ambrosial import create_app, db, socketio, chat_buffer
+from flask_ambrosial.profiling import count_queries
 from flask_ambrosial.models import User, ChatMessage
+from flask_ambrosial.chats.utils import (
+    start_conversation, get_room_backlog, MAX_MESSAGE_LENGTH
+)
 from flask_ambrosial.config import TestingConfig
 from flask_socketio import SocketIOTestClient
 from flask_login import login_user
@@ -37,7 +41,7 @@ class ChatRoutesTestCase(unittest.TestCase):
         db.session.commit()
         self.client = self.app.test_client()
         socketio.init_app(self.app)  # Ensure Socket.IO is initialized
-        self.socketio_client = SocketIOTestClient(self.app, socketio)
+        self.socketio_client = self.socket_client(self.user)
         self.login()
         assert self.socketio_client.is_connected()  # Ensure client is connected
 
@@ -61,6 +65,29 @@ class ChatRoutesTestCase(unittest.TestCase):
             ), follow_redirects=True
         )
 
+    def socket_client(self, user):
+        """
+        Connect a Socket.IO client logged in as a user.
+
+        Args:
+            user (User): The user the socket belongs to.
+
+        Returns:
+            SocketIOTestClient: The connected client.
+        """
+        http_client = self.app.test_client()
+        with http_client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        # Forget the user Flask-Login cached in the test's g, before and
+        # after the socket resolves its own
+        g.pop('_login_user', None)
+        client = SocketIOTestClient(
+            self.app, socketio, flask_test_client=http_client
+        )
+        g.pop('_login_user', None)
+        return client
+
     def wait_for_event(self, client, event_name, timeout=5):
         """
         Wait for a specific event from the Socket.IO client.
@@ -91,6 +118,37 @@ class ChatRoutesTestCase(unittest.TestCase):
         response = self.client.get('/api/messages')
         self.assertEqual(response.status_code, 302)
 
+    def test_get_messages_page(self):
+        """
+        Test that GET /api/messages returns a page with cursors.
+        """
+        db.session.add_all([
+            ChatMessage(content=f'Message {i}', user=self.user)
+            for i in range(3)
+        ])
+        db.session.commit()
+        self.client.post('/login', data=dict(
+            email='test@example.com', password='password'
+        ))
+        response = self.client.get('/api/messages?limit=2')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(
+            [m['content'] for m in data['messages']],
+            ['Message 1', 'Message 2']
+        )
+        self.assertTrue(data['has_more'])
+        self.assertEqual(data['messages'][0]['username'], 'testuser')
+
+        response = self.client.get(
+            '/api/messages', query_string={'before': data['before']}
+        )
+        data = response.get_json()
+        self.assertEqual(
+            [m['content'] for m in data['messages']], ['Message 0']
+        )
+        self.assertFalse(data['has_more'])
+
     def test_post_message(self):
         """
         Test that the POST /api/messages endpoint returns a 302 status code.
@@ -142,5 +200,236 @@ class ChatRoutesTestCase(unittest.TestCase):
             'testuser has entered the room.', event['args']['msg']
         )
 
+    def test_join_replays_backlog(self):
+        """
+        Test that joining a room replays its recent messages to the joiner.
+        """
+        db.session.add(ChatMessage(content='Stored', user=self.user))
+        db.session.commit()
+        self.socketio_client.emit(
+            'message', {'room': 'default', 'msg': 'Live', 'username': 'x'}
+        )
+        self.socketio_client.get_received()
+        joiner = self.socket_client(self.user)
+        joiner.emit('join', {'room': 'default'})
+        event = self.wait_for_event(joiner, 'history')
+        history = event['args'][0]
+        self.assertEqual([m['content'] for m in history], ['Stored', 'Live'])
+        # The live message keeps its uid once stored, so a client catching
+        # up after a reconnect can tell it has already shown it
+        chat_buffer.flush()
+        stored = [
+            m.uid for m in ChatMessage.query.order_by(ChatMessage.id)
+        ]
+        self.assertEqual(stored, [m['uid'] for m in history])
+        self.assertEqual(len(set(stored)), 2)
+        joiner.disconnect()
+
+    def test_socket_messages_are_persisted(self):
+        """
+        Test that socket messages are written in a batch on flush.
+        """
+        self.client.post('/login', data=dict(
+            email='test@example.com', password='password'
+        ))
+        client = SocketIOTestClient(
+            self.app, socketio, flask_test_client=self.client
+        )
+        for i in range(3):
+            client.emit('message', {
+                'room': 'default', 'msg': f'Burst {i}', 'username': 'testuser'
+            })
+        self.assertEqual(ChatMessage.query.count(), 0)
+        self.assertEqual(chat_buffer.flush(), 3)
+        self.assertEqual(
+            [m.content for m in ChatMessage.query.order_by(ChatMessage.id)],
+            ['Burst 0', 'Burst 1', 'Burst 2']
+        )
+        self.assertEqual(ChatMessage.query.first().user_id, self.user.id)
+        client.disconnect()
+
+    def test_identity_resolved_on_connect(self):
+        """
+        Test that events use the connect-time identity without queries.
+        """
+        self.client.post('/login', data=dict(
+            email='test@example.com', password='password'
+        ))
+        client = SocketIOTestClient(
+            self.app, socketio, flask_test_client=self.client
+        )
+        client.emit('join', {'room': 'default'})
+        client.get_received()
+        with count_queries() as statements:
+            client.emit('message', {
+                'room': 'default', 'msg': 'Hi', 'username': 'impostor'
+            })
+        self.assertEqual(statements, [])
+        event = self.wait_for_event(client, 'message')
+        self.assertEqual(event['args']['msg'], 'testuser: Hi')
+        chat_buffer.flush()
+        self.assertEqual(ChatMessage.query.one().user_id, self.user.id)
+        client.disconnect()
+
+    def test_anonymous_socket_is_refused(self):
+        """
+        Test that a socket without a logged-in user cannot connect, so it
+        cannot chat under a name of its choosing.
+        """
+        g.pop('_login_user', None)
+        client = SocketIOTestClient(self.app, socketio)
+        self.assertFalse(client.is_connected())
+        with self.assertRaises(RuntimeError):
+            client.emit('message', {
+                'room': 'default', 'msg': 'Hi', 'username': 'testuser'
+            })
+        self.assertEqual(len(chat_buffer), 0)
+
+    def test_malformed_room_is_ignored(self):
+        """
+        Test that join and message events naming a room other than the
+        public one are dropped rather than raising or opening a new room.
+        """
+        for room in (5, ['default'], 'elsewhere', 'conversation-1'):
+            self.socketio_client.emit('join', {'room': room})
+            self.socketio_client.emit('message', {'room': room, 'msg': 'Hi'})
+        self.socketio_client.emit('join', 'default')
+        self.assertEqual(self.socketio_client.get_received(), [])
+        self.assertEqual(len(chat_buffer), 0)
+        self.assertEqual(list(get_room_backlog()._rooms), [])
+
+    def test_message_text_is_checked_and_capped(self):
+        """
+        Test that messages without text are dropped, and that a long one
+        is cut once, so history replays exactly what was broadcast.
+        """
+        self.socketio_client.emit('join', {'room': 'default'})
+        self.socketio_client.get_received()
+        for data in ({'room': 'default'}, {'room': 'default', 'msg': 5},
+                     {'room': 'default', 'msg': ''}, ['Hi']):
+            self.socketio_client.emit('message', data)
+        self.assertEqual(self.socketio_client.get_received(), [])
+        self.assertEqual(len(chat_buffer), 0)
+
+        self.socketio_client.emit(
+            'message', {'room': 'default', 'msg': 'x' * 600}
+        )
+        event = self.wait_for_event(self.socketio_client, 'message')
+        sent = 'x' * MAX_MESSAGE_LENGTH
+        self.assertEqual(event['args']['msg'], f'testuser: {sent}')
+        self.assertEqual(
+            get_room_backlog().get('default')[-1]['content'], sent
+        )
+        chat_buffer.flush()
+        self.assertEqual(ChatMessage.query.one().content, sent)
+
+    def test_conversations_api(self):
+        """
+        Test starting a conversation and listing it with its unread count.
+        """
+        other = User(
+            username='otheruser', email='other@example.com',
+            password='password'
+        )
+        db.session.add(other)
+        db.session.commit()
+        self.client.post('/login', data=dict(
+            email='test@example.com', password='password'
+        ))
+        response = self.client.post(
+            '/api/conversations', json={'usernames': ['otheruser']}
+        )
+        self.assertEqual(response.status_code, 201)
+        conversation_id = response.get_json()['id']
+        response = self.client.post(
+            '/api/conversations', json={'usernames': ['otheruser']}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['id'], conversation_id)
+        response = self.client.post(
+            '/api/conversations', json={'usernames': ['nobody']}
+        )
+        self.assertEqual(response.status_code, 400)
+        for body in (
+            {'usernames': 'otheruser'}, {'usernames': [1]},
+            {'usernames': ['testuser']}, ['otheruser'],
+            {'usernames': ['otheruser'], 'name': ['Supper']}
+        ):
+            response = self.client.post('/api/conversations', json=body)
+            self.assertEqual(response.status_code, 400)
+
+        db.session.add(ChatMessage(
+            content='Psst', user=other, conversation_id=conversation_id
+        ))
+        db.session.commit()
+        data = self.client.get('/api/conversations').get_json()
+        self.assertEqual(data['conversations'][0]['unread'], 1)
+        data = self.client.get(
+            f'/api/conversations/{conversation_id}/messages'
+        ).get_json()
+        self.assertEqual(
+            [m['content'] for m in data['messages']], ['Psst']
+        )
+        self.assertEqual(
+            self.client.get(f'/chat/{conversation_id}').status_code, 200
+        )
+
+    def test_conversation_fan_out_is_members_only(self):
+        """
+        Test that conversation messages reach members only and that
+        non-members cannot join the conversation's room.
+        """
+        other = User(
+            username='otheruser', email='other@example.com',
+            password='password'
+        )
+        outsider = User(
+            username='outsider', email='out@example.com',
+            password=bcrypt.generate_password_hash('password').decode('utf-8')
+        )
+        db.session.add_all([other, outsider])
+        db.session.commit()
+        conversation, _ = start_conversation(self.user, [other])
+        conversation_id = conversation.id
+
+        self.client.post('/login', data=dict(
+            email='test@example.com', password='password'
+        ))
+        member = SocketIOTestClient(
+            self.app, socketio, flask_test_client=self.client
+        )
+        # The test's app context outlives requests, so forget the user
+        # Flask-Login cached in g before acting as someone else
+        g.pop('_login_user', None)
+        outsider_client = self.app.test_client()
+        outsider_client.post('/login', data=dict(
+            email='out@example.com', password='password'
+        ))
+        self.assertEqual(
+            outsider_client.get(f'/chat/{conversation_id}').status_code, 403
+        )
+        intruder = SocketIOTestClient(
+            self.app, socketio, flask_test_client=outsider_client
+        )
+        intruder.emit('join', {'conversation': conversation_id})
+        intruder.emit('join', {'room': f'conversation-{conversation_id}'})
+        member.emit('join', {'conversation': conversation_id})
+        self.assertIsNotNone(self.wait_for_event(member, 'history'))
+        intruder.get_received()
+
+        member.emit('message', {'conversation': conversation_id, 'msg': 'Hi'})
+        event = self.wait_for_event(member, 'message')
+        self.assertEqual(event['args']['msg'], 'testuser: Hi')
+        self.assertEqual(intruder.get_received(), [])
+        intruder.emit('message', {'conversation': conversation_id, 'msg': 'x'})
+        self.assertEqual(member.get_received(), [])
+
+        chat_buffer.flush()
+        self.assertEqual(
+            ChatMessage.query.one().conversation_id, conversation_id
+        )
+        member.disconnect()
+        intruder.disconnect()
+
 if __name__ == '__main__':
     unittest.main()
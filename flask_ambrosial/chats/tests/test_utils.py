@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the chat history helpers in the flask_ambrosial.chats module.
+"""
+
+import unittest
+from unittest.mock import patch
+from datetime import datetime, timedelta
+from socketio import packet
+from socketio.msgpack_packet import MsgPackPacket
+from flask_ambrosial import create_app, db
+from flask_ambrosial.models import (
+    User, ChatMessage, Conversation, ConversationMember
+)
+from flask_ambrosial.profiling import count_queries
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.chats import utils
+from flask_ambrosial.chats.utils import (
+    encode_message_cursor, decode_message_cursor, fetch_messages,
+    serialize_message, chat_frame, MAX_PAGE_SIZE, RoomBacklog, DEFAULT_ROOM,
+    fetch_conversation_messages, start_conversation, unread_counts,
+    list_conversations, conversation_room
+)
+
+
+class ChatUtilsTestCase(unittest.TestCase):
+    """
+    Test cases for chat history helper functions.
+    """
+
+    def setUp(self):
+        """
+        Set up the database with two users and a run of chat messages.
+        """
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        self.other = User(
+            username='otheruser', email='other@example.com',
+            password='password'
+        )
+        db.session.add_all([self.user, self.other])
+        start = datetime(2024, 1, 1)
+        # Pairs of messages share a timestamp so the id tie-breaker counts
+        for i in range(7):
+            db.session.add(ChatMessage(
+                content=f'Message {i}',
+                user=self.user if i % 2 else self.other,
+                timestamp=start + timedelta(seconds=i // 2)
+            ))
+        db.session.commit()
+        self.ids = [
+            message.id for message in ChatMessage.query.order_by(
+                ChatMessage.timestamp, ChatMessage.id
+            )
+        ]
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_cursor_round_trip(self):
+        """
+        Test that a cursor decodes back to the message's sort key.
+        """
+        timestamp = datetime(2024, 1, 1, 12, 30)
+        self.assertEqual(
+            decode_message_cursor(encode_message_cursor(timestamp, 5)),
+            (timestamp, 5)
+        )
+        self.assertIsNone(decode_message_cursor('not-a-cursor'))
+
+    def test_latest_page_and_older_history(self):
+        """
+        Test that paging back with before visits every message once.
+        """
+        rows, has_more = fetch_messages(limit=3)
+        self.assertTrue(has_more)
+        self.assertEqual([row.id for row in rows], self.ids[-3:])
+        seen = [row.id for row in rows]
+        while has_more:
+            rows, has_more = fetch_messages(
+                before=encode_message_cursor(rows[0].timestamp, rows[0].id),
+                limit=3
+            )
+            seen = [row.id for row in rows] + seen
+        self.assertEqual(seen, self.ids)
+
+    def test_after_and_since_id(self):
+        """
+        Test that newer messages are returned after a cursor or an ID.
+        """
+        first = ChatMessage.query.get(self.ids[2])
+        rows, has_more = fetch_messages(
+            after=encode_message_cursor(first.timestamp, first.id), limit=2
+        )
+        self.assertEqual([row.id for row in rows], self.ids[3:5])
+        self.assertTrue(has_more)
+        rows, has_more = fetch_messages(since_id=self.ids[4])
+        self.assertEqual([row.id for row in rows], self.ids[5:])
+        self.assertFalse(has_more)
+
+    def test_usernames_in_one_query(self):
+        """
+        Test that a page and its authors' names come from one query.
+        """
+        with count_queries() as statements:
+            rows, _ = fetch_messages(limit=MAX_PAGE_SIZE * 2)
+            messages = [serialize_message(row) for row in rows]
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(len(messages), 7)
+        self.assertEqual(messages[0]['username'], 'otheruser')
+        self.assertEqual(messages[1]['username'], 'testuser')
+        self.assertEqual(messages[0]['timestamp'], '2024-01-01T00:00:00')
+
+    def test_page_size_is_capped(self):
+        """
+        Test that the page size cannot exceed MAX_PAGE_SIZE.
+        """
+        db.session.add_all([
+            ChatMessage(content='Bulk', user=self.user)
+            for _ in range(MAX_PAGE_SIZE)
+        ])
+        db.session.commit()
+        rows, has_more = fetch_messages(limit=MAX_PAGE_SIZE * 2)
+        self.assertEqual(len(rows), MAX_PAGE_SIZE)
+        self.assertTrue(has_more)
+
+    def test_room_backlog_seeds_once(self):
+        """
+        Test that a room is seeded with one query and then served from memory.
+        """
+        backlog = RoomBacklog(maxlen=5)
+        with count_queries() as statements:
+            first = backlog.get(DEFAULT_ROOM)
+            backlog.get(DEFAULT_ROOM)
+            backlog.append(DEFAULT_ROOM, {'content': 'Live'})
+            latest = backlog.get(DEFAULT_ROOM)
+            self.assertEqual(backlog.get('elsewhere'), [])
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(
+            [m['content'] for m in first],
+            [f'Message {i}' for i in range(2, 7)]
+        )
+        self.assertEqual(
+            [m['content'] for m in latest],
+            [f'Message {i}' for i in range(3, 7)] + ['Live']
+        )
+
+    def test_room_backlog_refresh(self):
+        """
+        Test that a refreshing backlog picks up messages stored by other
+        workers and keeps its own unsaved ones.
+        """
+        backlog = RoomBacklog(maxlen=3, refresh=0)
+        backlog.get(DEFAULT_ROOM)
+        backlog.append(DEFAULT_ROOM, {
+            'uid': 'unsaved', 'username': 'testuser', 'content': 'Here',
+            'timestamp': '2024-01-01T00:00:10'
+        })
+        # Sent through another worker and already flushed
+        db.session.add(ChatMessage(
+            content='There', user=self.other,
+            timestamp=datetime(2024, 1, 1, 0, 0, 5)
+        ))
+        db.session.commit()
+        self.assertEqual(
+            [m['content'] for m in backlog.get(DEFAULT_ROOM)],
+            ['Message 6', 'There', 'Here']
+        )
+        with count_queries() as statements:
+            RoomBacklog(maxlen=3, refresh=60).get(DEFAULT_ROOM)
+            backlog.refresh = 60
+            backlog.get(DEFAULT_ROOM)
+        self.assertEqual(len(statements), 1)
+
+    def test_direct_conversation_is_reused(self):
+        """
+        Test that a pair of users shares one direct conversation.
+        """
+        conversation, created = start_conversation(self.user, [self.other])
+        self.assertTrue(created)
+        self.assertFalse(conversation.is_group)
+        again, created = start_conversation(self.other, [self.user])
+        self.assertFalse(created)
+        self.assertEqual(again.id, conversation.id)
+        group, created = start_conversation(
+            self.user, [self.other], name='Supper club'
+        )
+        self.assertTrue(created)
+        self.assertTrue(group.is_group)
+        self.assertEqual(Conversation.query.count(), 2)
+
+    def test_concurrent_direct_conversation(self):
+        """
+        Test that losing the race to create a pair's conversation returns
+        the one the other request stored.
+        """
+        existing, _ = start_conversation(self.user, [self.other])
+        lookup = utils.direct_conversation
+        with patch.object(
+            utils, 'direct_conversation',
+            side_effect=[None, lookup(existing.dm_key)]
+        ):
+            conversation, created = start_conversation(
+                self.other, [self.user]
+            )
+        self.assertFalse(created)
+        self.assertEqual(conversation.id, existing.id)
+        self.assertEqual(Conversation.query.count(), 1)
+
+    def test_conversation_history_is_separate(self):
+        """
+        Test that conversation messages page by ID and stay out of the
+        public history.
+        """
+        conversation, _ = start_conversation(self.user, [self.other])
+        db.session.add_all([
+            ChatMessage(
+                content=f'Private {i}', user=self.other,
+                conversation_id=conversation.id
+            )
+            for i in range(5)
+        ])
+        db.session.commit()
+        rows, has_more = fetch_conversation_messages(conversation.id, limit=3)
+        self.assertEqual(
+            [row.content for row in rows], ['Private 2', 'Private 3',
+                                            'Private 4']
+        )
+        self.assertTrue(has_more)
+        rows, has_more = fetch_conversation_messages(
+            conversation.id, before_id=rows[0].id, limit=3
+        )
+        self.assertEqual(
+            [row.content for row in rows], ['Private 0', 'Private 1']
+        )
+        self.assertFalse(has_more)
+        rows, _ = fetch_messages(limit=MAX_PAGE_SIZE)
+        self.assertEqual(len(rows), 7)
+        backlog = RoomBacklog(maxlen=2)
+        self.assertEqual(
+            [m['content'] for m in backlog.get(
+                conversation_room(conversation.id)
+            )],
+            ['Private 3', 'Private 4']
+        )
+
+    def test_unread_counts(self):
+        """
+        Test that unread counts start from each member's watermark and
+        skip the member's own messages.
+        """
+        direct, _ = start_conversation(self.user, [self.other])
+        group, _ = start_conversation(self.user, [self.other], name='Group')
+        messages = [
+            ChatMessage(
+                content=f'To direct {i}', user=self.other,
+                conversation_id=direct.id
+            )
+            for i in range(3)
+        ] + [ChatMessage(
+            content='Mine', user=self.user, conversation_id=direct.id
+        )]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.assertEqual(unread_counts(self.user.id), {
+            direct.id: 3, group.id: 0
+        })
+        membership = db.session.get(
+            ConversationMember, (direct.id, self.user.id)
+        )
+        membership.last_read_id = messages[1].id
+        db.session.commit()
+        self.assertEqual(unread_counts(self.user.id)[direct.id], 1)
+        self.assertEqual(unread_counts(self.other.id)[direct.id], 1)
+
+        with count_queries() as statements:
+            conversations = list_conversations(self.user.id)
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(
+            [(c['name'], c['unread']) for c in conversations],
+            [('Group', 0), (None, 1)]
+        )
+        self.assertEqual(
+            conversations[1]['members'], ['otheruser', 'testuser']
+        )
+
+    def test_chat_frame(self):
+        """
+        Test the dict and compact shapes of a live chat frame.
+        """
+        self.assertEqual(
+            chat_frame('testuser', 'Hi', '2024-01-01T00:00:00', uid='abc'),
+            {
+                'msg': 'testuser: Hi', 'timestamp': '2024-01-01T00:00:00',
+                'uid': 'abc'
+            }
+        )
+        self.assertEqual(
+            chat_frame('testuser', 'Hi', '2024-01-01T00:00:00', uid='abc',
+                       compact=True),
+            ['testuser', 'Hi', '2024-01-01T00:00:00', 'abc']
+        )
+
+    def test_compact_frames_shrink_over_msgpack(self):
+        """
+        Test that a batch of compact frames survives MessagePack and is
+        smaller than the same batch of JSON dicts.
+        """
+        batch = [
+            chat_frame('testuser', f'Message {i}', '2024-01-01T00:00:00',
+                       uid=f'{i:032x}')
+            for i in range(10)
+        ]
+        compact = [
+            chat_frame('testuser', f'Message {i}', '2024-01-01T00:00:00',
+                       uid=f'{i:032x}', compact=True)
+            for i in range(10)
+        ]
+        json_frame = packet.Packet(
+            packet.EVENT, data=['message', batch], namespace='/'
+        ).encode()
+        msgpack_frame = MsgPackPacket(
+            packet.EVENT, data=['message', compact], namespace='/'
+        ).encode()
+        self.assertLess(len(msgpack_frame), len(json_frame))
+        decoded = MsgPackPacket(encoded_packet=msgpack_frame)
+        self.assertEqual(decoded.data, ['message', compact])
+
+
+if __name__ == '__main__':
+    unittest.main()
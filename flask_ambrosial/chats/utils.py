@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Helpers for paging through and replaying chat history, and for private
+conversations, in the Flask application.
+"""
+
+import base64
+from collections import deque
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+from flask import current_app
+from sqlalchemy import and_, func, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from flask_ambrosial import db
+from flask_ambrosial.models import (
+    User, ChatMessage, Conversation, ConversationMember
+)
+
+# Largest page of history a client may ask for at once
+MAX_PAGE_SIZE = 100
+
+# Room the chat page joins; stored messages are replayed into it
+DEFAULT_ROOM = 'default'
+
+# Longest chat message kept, the size of the content column; longer ones
+# are cut before they are stored, replayed or broadcast
+MAX_MESSAGE_LENGTH = ChatMessage.content.type.length
+
+# Socket.IO rooms of private conversations are named with this prefix and
+# the conversation ID; clients cannot join them by name
+CONVERSATION_ROOM_PREFIX = 'conversation-'
+
+
+def encode_message_cursor(timestamp, message_id):
+    """Encode a message's position in the history as an opaque cursor.
+
+    Args:
+        timestamp (datetime): The message timestamp.
+        message_id (int): The message ID.
+
+    Returns:
+        str: A URL-safe cursor string.
+    """
+    raw = f'{timestamp.isoformat()}|{message_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_message_cursor(cursor):
+    """Decode a cursor produced by encode_message_cursor.
+
+    Args:
+        cursor (str): The opaque cursor string.
+
+    Returns:
+        tuple: The (timestamp, id) pair, or None if the cursor is invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, message_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def message_rows():
+    """Return a SELECT of the message columns joined to the author's name.
+
+    Returns:
+        Select: Rows of (id, content, timestamp, username, uid).
+    """
+    return select(
+        ChatMessage.id, ChatMessage.content, ChatMessage.timestamp,
+        User.username, ChatMessage.uid
+    ).outerjoin(User, ChatMessage.user_id == User.id)
+
+
+def fetch_messages(before=None, after=None, since_id=None, limit=50):
+    """Fetch one page of public chat history, oldest message first.
+
+    With no cursor the newest page is returned. ``before`` pages back into
+    older history, ``after`` pages forward from a cursor, and ``since_id``
+    returns what a reconnecting client missed after the last message it
+    saw. Every page walks the (timestamp, id) index and stops after
+    ``limit`` rows.
+
+    Args:
+        before (str): Cursor of the oldest message seen; fetch older ones.
+        after (str): Cursor of the newest message seen; fetch newer ones.
+        since_id (int): ID of the last message seen; fetch newer ones.
+        limit (int): Page size, capped at MAX_PAGE_SIZE.
+
+    Returns:
+        tuple: The rows on the page and whether more remain in the
+        direction of travel.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    key = tuple_(ChatMessage.timestamp, ChatMessage.id)
+    query = message_rows().where(ChatMessage.conversation_id.is_(None))
+    newest_first = False
+    after_key = decode_message_cursor(after)
+    before_key = decode_message_cursor(before)
+
+    if since_id is not None:
+        query = query.where(ChatMessage.id > since_id).order_by(
+            ChatMessage.id
+        )
+    elif after_key is not None:
+        query = query.where(key > tuple_(*after_key)).order_by(
+            ChatMessage.timestamp, ChatMessage.id
+        )
+    else:
+        if before_key is not None:
+            query = query.where(key < tuple_(*before_key))
+        query = query.order_by(
+            ChatMessage.timestamp.desc(), ChatMessage.id.desc()
+        )
+        newest_first = True
+
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newest_first:
+        rows.reverse()
+    return rows, has_more
+
+
+def fetch_conversation_messages(conversation_id, before_id=None,
+                                after_id=None, limit=50):
+    """Fetch one page of a conversation's history, oldest message first.
+
+    Pages are walked by message ID on the (conversation_id, id) index, so
+    a small conversation costs the same however busy the others are.
+
+    Args:
+        conversation_id (int): The conversation ID.
+        before_id (int): Oldest message ID seen; fetch older ones.
+        after_id (int): Newest message ID seen; fetch newer ones.
+        limit (int): Page size, capped at MAX_PAGE_SIZE.
+
+    Returns:
+        tuple: The rows on the page and whether more remain in the
+        direction of travel.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = message_rows().where(
+        ChatMessage.conversation_id == conversation_id
+    )
+    if after_id is not None:
+        query = query.where(ChatMessage.id > after_id).order_by(
+            ChatMessage.id
+        )
+    else:
+        if before_id is not None:
+            query = query.where(ChatMessage.id < before_id)
+        query = query.order_by(ChatMessage.id.desc())
+
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is None:
+        rows.reverse()
+    return rows, has_more
+
+
+def conversation_room(conversation_id):
+    """Return the Socket.IO room of a conversation.
+
+    Args:
+        conversation_id (int): The conversation ID.
+
+    Returns:
+        str: The room name.
+    """
+    return f'{CONVERSATION_ROOM_PREFIX}{conversation_id}'
+
+
+def is_member(conversation_id, user_id):
+    """Return whether a user belongs to a conversation.
+
+    Args:
+        conversation_id (int): The conversation ID.
+        user_id (int): The user ID.
+
+    Returns:
+        bool: True if the user is a member.
+    """
+    return db.session.get(
+        ConversationMember, (conversation_id, user_id)
+    ) is not None
+
+
+def direct_conversation(dm_key):
+    """Return the one-to-one conversation stored under a pair key.
+
+    Args:
+        dm_key (str): The pair's user IDs, lowest first, joined by a colon.
+
+    Returns:
+        Conversation: The conversation, or None.
+    """
+    return db.session.execute(
+        select(Conversation).where(Conversation.dm_key == dm_key)
+    ).scalar_one_or_none()
+
+
+def start_conversation(user, others, name=None):
+    """Start a conversation between a user and others.
+
+    A one-to-one conversation without a name is reused if the pair
+    already has one; anything else starts a new group. If another request
+    creates the pair's conversation first, the unique ``dm_key`` refuses
+    this one and the stored conversation is returned instead.
+
+    Args:
+        user (User): The user starting the conversation.
+        others (list): The other members, as User objects.
+        name (str): An optional name for the conversation.
+
+    Returns:
+        tuple: The conversation and whether it was created.
+    """
+    others = [other for other in others if other.id != user.id]
+    dm_key = None
+    if len(others) == 1 and not name:
+        low, high = sorted((user.id, others[0].id))
+        dm_key = f'{low}:{high}'
+        conversation = direct_conversation(dm_key)
+        if conversation is not None:
+            return conversation, False
+
+    conversation = Conversation(
+        name=name, is_group=dm_key is None, dm_key=dm_key
+    )
+    conversation.members = [
+        ConversationMember(user_id=member.id)
+        for member in [user] + others
+    ]
+    db.session.add(conversation)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if dm_key is None:
+            raise
+        return direct_conversation(dm_key), False
+    return conversation, True
+
+
+def unread_counts(user_id):
+    """Count the unread messages in each of a user's conversations.
+
+    Each count is a range count on the (conversation_id, id) index above
+    the member's read watermark; the user's own messages are not counted.
+
+    Args:
+        user_id (int): The user ID.
+
+    Returns:
+        dict: Unread counts keyed by conversation ID.
+    """
+    query = select(
+        ConversationMember.conversation_id, func.count(ChatMessage.id)
+    ).outerjoin(ChatMessage, and_(
+        ChatMessage.conversation_id == ConversationMember.conversation_id,
+        ChatMessage.id > ConversationMember.last_read_id,
+        ChatMessage.user_id != ConversationMember.user_id
+    )).where(
+        ConversationMember.user_id == user_id
+    ).group_by(ConversationMember.conversation_id)
+    return dict(db.session.execute(query).all())
+
+
+def list_conversations(user_id):
+    """Return a user's conversations with their members and unread counts.
+
+    Args:
+        user_id (int): The user ID.
+
+    Returns:
+        list: One dict per conversation, newest first.
+    """
+    conversations = db.session.execute(
+        select(Conversation).join(ConversationMember).where(
+            ConversationMember.user_id == user_id
+        ).options(
+            selectinload(Conversation.members).joinedload(
+                ConversationMember.user
+            )
+        ).order_by(Conversation.id.desc())
+    ).scalars().all()
+    unread = unread_counts(user_id)
+    return [
+        serialize_conversation(conversation, unread.get(conversation.id, 0))
+        for conversation in conversations
+    ]
+
+
+def serialize_conversation(conversation, unread=0):
+    """Convert a conversation to a JSON-serializable dict.
+
+    Args:
+        conversation (Conversation): The conversation.
+        unread (int): The requesting member's unread count.
+
+    Returns:
+        dict: The conversation data.
+    """
+    return {
+        'id': conversation.id,
+        'name': conversation.name,
+        'is_group': conversation.is_group,
+        'members': sorted(
+            member.user.username for member in conversation.members
+        ),
+        'unread': unread
+    }
+
+
+def serialize_message(row):
+    """Convert a message row to a JSON-serializable dict.
+
+    Args:
+        row (Row): A row from message_rows.
+
+    Returns:
+        dict: The message data.
+    """
+    message_id, content, timestamp, username, uid = row
+    return {
+        'id': message_id,
+        'uid': uid,
+        'username': username,
+        'content': content,
+        'timestamp': timestamp.isoformat() if timestamp else None
+    }
+
+
+def chat_frame(username, text, timestamp, uid=None, compact=False):
+    """Build the payload that carries one live chat message to clients.
+
+    Args:
+        username (str): The sender's name.
+        text (str): The message text.
+        timestamp (str): When the message was sent, in ISO format.
+        uid (str): The message's uid, which clients use to skip it when
+            it comes round again in history.
+        compact (bool): Whether to pack the message as a
+            ``[username, text, timestamp, uid]`` array instead of a dict,
+            which keeps repeated keys off the wire and batches into a
+            plain list of lists.
+
+    Returns:
+        dict or list: The payload.
+    """
+    if compact:
+        return [username, text, timestamp, uid]
+    return {'msg': f'{username}: {text}', 'timestamp': timestamp, 'uid': uid}
+
+
+class RoomBacklog:
+    """
+    The most recent messages of each chat room, kept in memory.
+
+    Each room holds a bounded deque that is seeded from the database the
+    first time the room is used, so replaying history on join never
+    touches the database again, however many users join at once.
+
+    A worker only appends the messages sent through it. When several
+    workers share rooms over a message queue, ``refresh`` is set and a
+    join re-reads the room from the database once the seed is that many
+    seconds old, keeping the messages this worker has not stored yet.
+    """
+
+    def __init__(self, maxlen=50, refresh=None):
+        self.maxlen = maxlen
+        self.refresh = refresh
+        self._rooms = {}
+        self._seeded_at = {}
+        self._lock = Lock()
+
+    def _seed(self, room):
+        """Return a room's newest stored messages, oldest first."""
+        rows = []
+        if room == DEFAULT_ROOM:
+            rows, _ = fetch_messages(limit=self.maxlen)
+        elif room.startswith(CONVERSATION_ROOM_PREFIX):
+            rows, _ = fetch_conversation_messages(
+                int(room[len(CONVERSATION_ROOM_PREFIX):]), limit=self.maxlen
+            )
+        self._seeded_at[room] = monotonic()
+        return [serialize_message(row) for row in rows]
+
+    def _room(self, room, refresh=False):
+        """Return a room's deque, seeding it on first use.
+
+        Seeding happens under the lock, so a burst of joins to a cold room
+        costs one query rather than one each. With ``refresh``, a seed
+        older than ``self.refresh`` seconds is read again.
+        """
+        backlog = self._rooms.get(room)
+        if backlog is None:
+            backlog = self._rooms[room] = deque(
+                self._seed(room), maxlen=self.maxlen
+            )
+        elif refresh and self.refresh is not None and (
+            monotonic() - self._seeded_at[room] >= self.refresh
+        ):
+            seed = self._seed(room)
+            stored = {message.get('uid') for message in seed}
+            # Messages still waiting in this worker's write-behind buffer
+            unsaved = [
+                message for message in backlog
+                if message.get('id') is None
+                and message.get('uid') not in stored
+            ]
+            merged = sorted(
+                seed + unsaved, key=lambda message: message['timestamp'] or ''
+            )
+            backlog = self._rooms[room] = deque(merged, maxlen=self.maxlen)
+        return backlog
+
+    def get(self, room):
+        """Return a room's recent messages, oldest first.
+
+        Args:
+            room (str): The room name.
+
+        Returns:
+            list: The message dicts in the room's backlog.
+        """
+        with self._lock:
+            return list(self._room(room, refresh=True))
+
+    def append(self, room, message):
+        """Add a message to a room's backlog, evicting the oldest if full.
+
+        Args:
+            room (str): The room name.
+            message (dict): The message as sent to clients.
+        """
+        with self._lock:
+            self._room(room).append(message)
+
+
+def get_room_backlog():
+    """Return the current app's room backlog, creating it on first use.
+
+    Returns:
+        RoomBacklog: The backlog sized by CHAT_BACKLOG_SIZE, refreshed
+        every CHAT_BACKLOG_REFRESH seconds behind a message queue.
+    """
+    backlog = current_app.extensions.get('chat_backlog')
+    if backlog is None:
+        config = current_app.config
+        backlog = current_app.extensions['chat_backlog'] = RoomBacklog(
+            config['CHAT_BACKLOG_SIZE'],
+            refresh=(
+                config['CHAT_BACKLOG_REFRESH']
+                if config.get('SOCKETIO_MESSAGE_QUEUE') else None
+            )
+        )
+    return backlog
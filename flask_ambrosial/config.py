@@ -17,9 +17,99 @@ class Config:
     MAIL_USE_TLS = True
     MAIL_USERNAME = os.environ.get('EMAIL_USER')
     MAIL_PASSWORD = os.environ.get('EMAIL_PASS')
+    # Mail is queued in the outbound_mail table and sent by a worker (the
+    # server started by run.py, or `flask mail-worker`; `flask send-mail`
+    # sends it once) every MAIL_OUTBOX_INTERVAL seconds, up
+    # to MAIL_OUTBOX_BATCH_SIZE messages over one SMTP connection. A
+    # message the server refuses is retried after MAIL_OUTBOX_RETRY_DELAY
+    # seconds, doubling up to MAIL_OUTBOX_MAX_DELAY, and dropped as failed
+    # after MAIL_OUTBOX_MAX_ATTEMPTS tries
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    MAIL_OUTBOX_INTERVAL = 1.0
+    MAIL_OUTBOX_RETRY_DELAY = 60
+    MAIL_OUTBOX_MAX_DELAY = 3600
+    MAIL_OUTBOX_MAX_ATTEMPTS = 5
     LANGUAGES = ['en', 'fr', 'ha', 'ig', 'yo']
     BABEL_DEFAULT_LOCALE = 'en'
     BABEL_TRANSLATION_DIRECTORIES = './translations'
+    # Database connection pool: DB_POOL_SIZE connections kept open and up
+    # to DB_MAX_OVERFLOW more under load, a request waiting at most
+    # DB_POOL_TIMEOUT seconds for one; connections are replaced after
+    # DB_POOL_RECYCLE seconds and checked before use. In-memory SQLite
+    # keeps its single shared connection, so only the last two apply
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    # In green mode (run.py with GREEN_MODE=1, the default) SQLite calls
+    # run on eventlet's thread pool, whose size is set by the
+    # EVENTLET_THREADPOOL_SIZE environment variable (20 by default)
+    SQLITE_THREAD_POOL = True
+    # Maximum SQL statements per request; None disables query counting
+    QUERY_BUDGET = None
+    # Number of rendered post cards kept in the in-process LRU cache
+    POST_CARD_CACHE_SIZE = 1024
+    # Number of anonymous page responses kept in memory
+    RESPONSE_CACHE_SIZE = 256
+    # With HUB_MONITOR=1 the Socket.IO server samples the eventlet hub's
+    # lag every HUB_MONITOR_INTERVAL seconds and logs the stack of any
+    # green thread that blocks it for over HUB_MONITOR_THRESHOLD seconds;
+    # the results, with the cache, buffer and worker counters, are served
+    # at /diagnostics/hub to requests bearing HUB_MONITOR_TOKEN
+    # (``Authorization: Bearer <token>``)
+    HUB_MONITOR = os.environ.get('HUB_MONITOR') == '1'
+    HUB_MONITOR_TOKEN = os.environ.get('HUB_MONITOR_TOKEN')
+    HUB_MONITOR_INTERVAL = 0.05
+    HUB_MONITOR_THRESHOLD = 0.1
+    # Password hashes computed at once on worker threads, off the eventlet
+    # hub; further logins wait for a free worker
+    PASSWORD_HASH_WORKERS = 2
+    # Logged-in users resolved by the user loader are kept in memory, at
+    # most this many for IDENTITY_CACHE_TTL seconds
+    IDENTITY_CACHE_SIZE = 4096
+    IDENTITY_CACHE_TTL = 60
+    # Socket chat messages are inserted in batches: once this many are
+    # pending, or every CHAT_BUFFER_INTERVAL seconds, holding at most
+    # CHAT_BUFFER_MAXSIZE in memory
+    CHAT_BUFFER_BATCH_SIZE = 100
+    CHAT_BUFFER_INTERVAL = 0.25
+    CHAT_BUFFER_MAXSIZE = 5000
+    # Recent messages per chat room kept in memory and replayed on join.
+    # Behind a message queue, other workers' messages reach it through the
+    # database, re-read on join at most every CHAT_BACKLOG_REFRESH seconds
+    CHAT_BACKLOG_SIZE = 50
+    CHAT_BACKLOG_REFRESH = 1.0
+    # Socket.IO message queue shared by every worker, e.g.
+    # redis://localhost:6379/0; local:// and file:///path are stand-ins
+    # for development and tests. Unset runs a single worker.
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = 'flask-ambrosial'
+    # Seconds over which each room's chat messages are coalesced into one
+    # frame; 0 sends every message as it arrives
+    CHAT_EMIT_INTERVAL = 0
+    # Clients with more frames than this waiting to be sent are skipped
+    # ('drop') or disconnected ('disconnect'); 0 disables the check
+    CHAT_CLIENT_QUEUE_LIMIT = 100
+    CHAT_SLOW_CLIENT_POLICY = 'drop'
+    # Read events are coalesced for this many seconds before the members'
+    # watermarks are written and pushed to the conversation; 0 sends each
+    CHAT_READ_INTERVAL = 1.0
+    # Chat messages older than CHAT_RETENTION_DAYS are moved, in batches,
+    # to gzipped NDJSON files under CHAT_ARCHIVE_DIR (the instance folder's
+    # chat_archive by default) by `flask chat archive`, and every
+    # CHAT_ARCHIVE_INTERVAL seconds by one Socket.IO worker; 0 disables it
+    CHAT_RETENTION_DAYS = 90
+    CHAT_ARCHIVE_DIR = os.environ.get('CHAT_ARCHIVE_DIR')
+    CHAT_ARCHIVE_BATCH_SIZE = 1000
+    CHAT_ARCHIVE_INTERVAL = 0
+    # 'msgpack' sends Socket.IO frames as MessagePack, with chat messages
+    # packed into [username, text, timestamp, uid] arrays; 'default' is
+    # JSON with dict frames. The arrays are what make frames smaller
+    # (unbatched, about 125 bytes a message as JSON against 148 for the
+    # dicts); MessagePack is no smaller than JSON for them (about 133
+    # bytes), but about four times cheaper to encode and decode
+    # (python -m benchmarks.chat_framing)
+    SOCKETIO_SERIALIZER = os.environ.get('SOCKETIO_SERIALIZER', 'default')
 
 class TestingConfig(Config):
     """
@@ -32,3 +122,4 @@ class TestingConfig(Config):
     MAIL_USERNAME = 'test@example.com'
     MAIL_PASSWORD = 'password'
     WTF_CSRF_ENABLED = False
+    QUERY_BUDGET = 10
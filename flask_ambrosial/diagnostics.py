@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Event-loop diagnostics for the eventlet server used by the Flask
+application.
+"""
+
+import logging
+import os
+import sys
+import traceback
+from bisect import bisect_left
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in milliseconds, of the hub lag histogram buckets
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Frames kept from the stack of a greenlet caught holding the hub
+STACK_DEPTH = 15
+
+_package_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class HubMonitor:
+    """
+    Measures eventlet hub lag and catches green threads that block it.
+
+    A probe green thread sleeps for ``interval`` seconds at a time; how
+    late it wakes up is the hub's lag, kept as a histogram. A greenlet
+    switch hook notes which green thread is running and since when, and a
+    watchdog on a real OS thread takes the stack of any green thread that
+    has held the hub for more than ``threshold`` seconds. Stalls are
+    logged and grouped by the innermost application frame, so the worst
+    offenders can be read from stats().
+    """
+
+    def __init__(self, interval=0.05, threshold=0.1, config_prefix=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.config_prefix = config_prefix
+        self._running = False
+        self._hub_greenlet = None
+        self._hub_thread = None
+        self._current = None
+        self._switched_at = 0.0
+        self._stall = None
+        self._trace = None
+        self._previous_trace = None
+        self._reset_counters()
+
+    def _reset_counters(self):
+        """Zero the lag histogram and the stall records."""
+        self.lag_counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.max_lag_ms = 0.0
+        self.stalls = 0
+        self.offenders = {}
+
+    def init_app(self, app):
+        """Configure the monitor from the app config.
+
+        Args:
+            app (Flask): The application being configured.
+        """
+        if self.config_prefix:
+            for name in ('interval', 'threshold'):
+                key = f'{self.config_prefix}_{name.upper()}'
+                setattr(self, name, app.config.get(key, getattr(self, name)))
+        self._reset_counters()
+
+    def start(self):
+        """Install the switch hook and start the probe and the watchdog.
+
+        Must be called from the thread that runs the eventlet hub.
+        """
+        if self._running:
+            return
+        import eventlet
+        import greenlet
+        from eventlet import hubs
+        from eventlet.patcher import original
+
+        self._running = True
+        self._hub_greenlet = hubs.get_hub().greenlet
+        self._hub_thread = original('_thread').get_ident()
+        previous = self._previous_trace = greenlet.gettrace()
+
+        def trace(event, args):
+            if event in ('switch', 'throw'):
+                self._switched(args[1])
+            if previous is not None:
+                previous(event, args)
+
+        self._trace = trace
+        greenlet.settrace(trace)
+        eventlet.spawn(self._probe)
+        # A real thread, so it keeps running while the hub is blocked
+        original('threading').Thread(
+            target=self._watch, args=(original('time').sleep,),
+            name='hub-monitor', daemon=True
+        ).start()
+
+    def stop(self):
+        """Stop monitoring.
+
+        The switch hook is removed at once; the probe and the watchdog
+        exit after their next tick.
+        """
+        import greenlet
+
+        self._running = False
+        if self._trace is not None and greenlet.gettrace() is self._trace:
+            greenlet.settrace(self._previous_trace)
+        self._trace = None
+
+    def _switched(self, target):
+        """Note the greenlet taking over the hub's thread."""
+        now = perf_counter()
+        stall = self._stall
+        if stall is not None:
+            # The stall caught by the watchdog ends here
+            self._stall = None
+            stall['total_ms'] += (now - self._switched_at) * 1000
+        self._current = target
+        self._switched_at = now
+
+    def _probe(self):
+        """Sample the hub's lag every ``interval`` seconds."""
+        import eventlet
+
+        while self._running:
+            start = perf_counter()
+            eventlet.sleep(self.interval)
+            lag = (perf_counter() - start - self.interval) * 1000
+            self.record_lag(max(lag, 0.0))
+
+    def record_lag(self, lag_ms):
+        """Add one lag sample to the histogram.
+
+        Args:
+            lag_ms (float): How late the probe woke up, in milliseconds.
+        """
+        self.lag_counts[bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        self.samples += 1
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def _watch(self, sleep):
+        """Catch green threads holding the hub past the threshold."""
+        while self._running:
+            sleep(self.threshold / 2)
+            current, since = self._current, self._switched_at
+            if current is None or current is self._hub_greenlet:
+                continue
+            if self._stall is not None:
+                continue
+            held = perf_counter() - since
+            if held > self.threshold and current is self._current:
+                frame = sys._current_frames().get(self._hub_thread)
+                if frame is not None:
+                    self.record_stall(traceback.extract_stack(frame), held)
+
+    def record_stall(self, stack, held):
+        """Record a green thread caught holding the hub.
+
+        Args:
+            stack (StackSummary): The blocking green thread's stack.
+            held (float): Seconds it had held the hub when caught.
+        """
+        stack = stack[-STACK_DEPTH:]
+        where = offender(stack)
+        stall = self.offenders.get(where)
+        if stall is None:
+            stall = self.offenders[where] = {
+                'where': where, 'count': 0, 'total_ms': 0.0,
+                'stack': ''.join(traceback.format_list(stack))
+            }
+        stall['count'] += 1
+        self.stalls += 1
+        self._stall = stall
+        logger.warning(
+            'Green thread has blocked the hub for %.0f ms at %s\n%s',
+            held * 1000, where, stall['stack']
+        )
+
+    def stats(self, top=10):
+        """Return the lag histogram and the worst offenders.
+
+        Args:
+            top (int): Number of offenders to return.
+
+        Returns:
+            dict: Lag samples per bucket (keyed by upper bound in ms), the
+            maximum lag, the number of stalls and the offenders that held
+            the hub longest in total.
+        """
+        bounds = [f'<={bound}' for bound in LAG_BUCKETS_MS]
+        bounds.append(f'>{LAG_BUCKETS_MS[-1]}')
+        offenders = sorted(
+            self.offenders.values(), key=lambda stall: stall['total_ms'],
+            reverse=True
+        )
+        return {
+            'samples': self.samples,
+            'lag_ms': dict(zip(bounds, self.lag_counts)),
+            'max_lag_ms': self.max_lag_ms,
+            'stalls': self.stalls,
+            'offenders': [dict(stall) for stall in offenders[:top]]
+        }
+
+
+def offender(stack):
+    """Name the frame to blame for a stall.
+
+    Args:
+        stack (StackSummary): The blocking green thread's stack.
+
+    Returns:
+        str: ``file:line in function`` of the innermost application frame,
+        or of the innermost frame if none is in the application.
+    """
+    blamed = stack[-1]
+    for frame in reversed(stack):
+        if frame.filename.startswith(_package_dir) and \
+                frame.filename != __file__:
+            blamed = frame
+            break
+    filename = os.path.relpath(
+        blamed.filename, os.path.dirname(_package_dir)
+    )
+    return f'{filename}:{blamed.lineno} in {blamed.name}'
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Cooperative database access for the eventlet ("green") run mode.
+
+run.py monkey-patches the standard library before the application is
+imported, so sockets, locks and sleeps yield to the eventlet hub. The
+sqlite3 driver is C code that eventlet cannot patch: its calls would still
+hold the hub, so in green mode they are run on eventlet's thread pool.
+"""
+
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def monkey_patched():
+    """Return whether eventlet has patched the standard library.
+
+    Returns:
+        bool: True if the process runs in green mode.
+    """
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('socket')
+
+
+def engine_options(config):
+    """Return the engine's pool options from the DB_POOL_* settings.
+
+    Pool sizing is left out for in-memory SQLite, whose one connection is
+    shared through a StaticPool that takes no size.
+
+    Args:
+        config (Config): The app config.
+
+    Returns:
+        dict: Keyword arguments for create_engine().
+    """
+    options = {
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+    uri = config.get('SQLALCHEMY_DATABASE_URI')
+    if uri is None:
+        return options
+    url = make_url(uri)
+    in_memory = url.get_backend_name() == 'sqlite' and (
+        url.database in (None, '', ':memory:')
+        or url.query.get('mode') == 'memory'
+    )
+    if not in_memory:
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT']
+        )
+    return options
+
+
+def dbapi_connection(connection):
+    """Return the driver's own connection behind a thread pool proxy.
+
+    Args:
+        connection: A DBAPI connection, proxied or not.
+
+    Returns:
+        The connection object created by the driver.
+    """
+    return getattr(connection, '_obj', connection)
+
+
+def sqlite_thread_pool(engine):
+    """Run an SQLite engine's driver calls on eventlet's thread pool.
+
+    Each new connection is wrapped in a ``tpool.Proxy``, as are the cursors
+    it opens, so executing, fetching and committing run on a pool thread
+    while the calling green thread yields. Other drivers are left alone.
+
+    Args:
+        engine (Engine): The engine whose connections to wrap.
+
+    Returns:
+        bool: True if the engine uses SQLite and is now routed.
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    from eventlet import tpool
+
+    @event.listens_for(engine, 'do_connect')
+    def connect(dialect, connection_record, cargs, cparams):
+        # Pool threads take turns with each connection
+        cparams['check_same_thread'] = False
+        connection = dialect.loaded_dbapi.connect(*cargs, **cparams)
+        return tpool.Proxy(connection, autowrap=(sqlite3.Cursor,))
+
+    return True
+
+
+def init_green_database(app, db):
+    """Route the app's SQLite engines through the thread pool.
+
+    Does nothing unless the process is monkey-patched and the
+    SQLITE_THREAD_POOL setting is on.
+
+    Args:
+        app (Flask): The application being configured.
+        db (SQLAlchemy): The database extension bound to the app.
+    """
+    if not (app.config.get('SQLITE_THREAD_POOL') and monkey_patched()):
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            sqlite_thread_pool(engine)
@@ -4,14 +4,25 @@
 Main routes module for the Flask application.
 """
 
-from flask import Blueprint, render_template, url_for, request
-from flask_ambrosial.models import Post
+import hmac
+from flask import (
+    Blueprint, render_template, url_for, request, jsonify, abort, current_app
+)
+from flask_ambrosial import (
+    hub_monitor, identity_cache, post_card_cache, response_cache,
+    chat_buffer, password_hasher, outbox
+)
+from flask_ambrosial.posts.forms import CommentForm
+from flask_ambrosial.posts.utils import (
+    feed_query, paginate_by_cursor, cached_page
+)
 
 # Create a Blueprint for the main routes
 main = Blueprint('main', __name__)
 
 @main.route("/")
 @main.route("/home")
+@cached_page
 def home():
     """
     Render the home page.
@@ -19,12 +30,11 @@ def home():
     Returns:
         str: Rendered template with posts and associated image files.
     """
-    # Get the page number from the request arguments, default is 1
-    page = request.args.get('page', 1, type=int)
-    # Query posts ordered by date posted in descending order, paginated
-    posts = Post.query.order_by(
-        Post.date_posted.desc()
-    ).paginate(page=page, per_page=3)
+    # Query posts newest first, one keyset page at a time
+    posts = paginate_by_cursor(
+        feed_query(), after=request.args.get('after'),
+        before=request.args.get('before'), per_page=3
+    )
     # Generate URLs for associated image files
     image_files = [
         url_for('static', filename='post_pics/' + post.image_filename)
@@ -32,10 +42,12 @@ def home():
     ]
     # Render the home template with posts and image files
     return render_template(
-        'home.html', posts=posts, image_files=image_files
+        'home.html', posts=posts, image_files=image_files,
+        comment_form=CommentForm()
     )
 
 @main.route("/about")
+@cached_page
 def about():
     """
     Render the about page.
@@ -44,3 +56,41 @@ def about():
         str: Rendered template for the about page.
     """
     return render_template('about.html', title='About')
+
+@main.route("/diagnostics/hub")
+def hub_diagnostics():
+    """
+    Report the eventlet hub's lag and the code that blocked it, along
+    with the counters of the app's caches, buffers and workers.
+
+    Only available when the hub monitor is enabled (HUB_MONITOR) and a
+    HUB_MONITOR_TOKEN is set, to requests that send the token as
+    ``Authorization: Bearer <token>``. The stacks it reports show the
+    application's internals, so signing in is not enough.
+
+    Returns:
+        jsonify: JSON response containing the monitor's statistics and,
+        under ``counters``, each component's ``stats()``.
+    """
+    token = current_app.config['HUB_MONITOR_TOKEN']
+    if not current_app.config['HUB_MONITOR'] or not token:
+        abort(404)
+    scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(
+        given.encode('utf-8'), token.encode('utf-8')
+    ):
+        abort(403)
+    counters = {
+        'identity_cache': identity_cache.stats(),
+        'post_card_cache': post_card_cache.stats(),
+        'response_cache': response_cache.stats(),
+        'chat_buffer': chat_buffer.stats(),
+        'password_hasher': password_hasher.stats(),
+        'outbox': outbox.stats()
+    }
+    # Created on first use by the socket handlers, so absent until then
+    for name in ('chat_emitter', 'chat_receipts'):
+        component = current_app.extensions.get(name)
+        if component is not None:
+            counters[name] = component.stats()
+    return jsonify(dict(hub_monitor.stats(), counters=counters))
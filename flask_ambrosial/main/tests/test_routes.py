@@ -6,8 +6,11 @@ Unit tests for main routes in the Flask application.
 
 import unittest
 from flask import Flask
-from flask_ambrosial import create_app, db
+from flask_ambrosial import create_app, db, response_cache
+from flask_ambrosial.models import User, Post
 from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.posts.utils import delete_post_cascade
+from flask_ambrosial.profiling import count_queries
 
 class MainRoutesTestCase(unittest.TestCase):
     """
@@ -50,5 +53,50 @@ class MainRoutesTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'About', response.data)
 
+    def test_anonymous_response_cache(self):
+        """
+        Test that anonymous pages are cached and revalidated by ETag.
+        """
+        user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        db.session.add(Post(
+            title='Cached Post', content='Content', author=user,
+            image_filename='default.jpg'
+        ))
+        db.session.commit()
+        first = self.client.get('/about')
+        second = self.client.get('/about')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(response_cache.stats()['hits'], 1)
+        etag = first.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertIn('Accept-Language', first.headers['Vary'])
+        response = self.client.get('/about', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Any post change moves the stamp, so the old ETag stops matching
+        db.session.add(Post(
+            title='Newer Post', content='Content', author=user,
+            image_filename='default.jpg'
+        ))
+        db.session.commit()
+        response = self.client.get('/about', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # Deleting an older post moves it too, without counting posts
+        etag = response.headers['ETag']
+        with count_queries() as statements:
+            self.client.get('/about', headers={'If-None-Match': etag})
+        self.assertNotIn('count(', ' '.join(statements))
+        delete_post_cascade(Post.query.filter_by(title='Cached Post').one())
+        db.session.commit()
+        response = self.client.get('/about', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+
 if __name__ == '__main__':
     unittest.main()
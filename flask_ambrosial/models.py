@@ -3,14 +3,48 @@
 Database models for User, Post, Comment, and Reaction entities.
 """
 
+import sqlite3
 from time import time
+from uuid import uuid4
 from flask import current_app
-from flask_ambrosial import db, login_manager
+from flask_ambrosial import db, login_manager, identity_cache
+from flask_ambrosial.green import dbapi_connection as driver_connection
 from datetime import datetime, timezone
 from flask_login import UserMixin
 from itsdangerous import URLSafeTimedSerializer as Serializer
 from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import relationship, validates
+
+
+def sqlite_foreign_keys(engine):
+    """
+    Turn on foreign key enforcement, so ON DELETE CASCADE applies on SQLite.
+
+    The pragma is issued on each new connection of the engine; connections
+    of other drivers are left alone.
+
+    Args:
+        engine (Engine): The engine whose connections to configure.
+    """
+    @event.listens_for(engine, 'connect')
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        if isinstance(driver_connection(dbapi_connection), sqlite3.Connection):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA foreign_keys=ON')
+            cursor.close()
+
+
+def init_foreign_keys(app):
+    """
+    Enforce foreign keys on every engine of the app.
+
+    Args:
+        app (Flask): The application being configured.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            sqlite_foreign_keys(engine)
 
 
 @login_manager.user_loader
@@ -18,13 +52,56 @@ def load_user(user_id):
     """
     Load a user by ID.
 
+    The user is served from the identity cache when possible, so most
+    requests do not query the user table at all.
+
     Args:
         user_id (int): The ID of the user.
 
     Returns:
-        User: The user object.
+        UserSnapshot: The user's snapshot, or None if there is no such user.
     """
-    return User.query.get(int(user_id))
+    key = (int(user_id),)
+    snapshot = identity_cache.get(key)
+    if snapshot is None:
+        user = db.session.get(User, int(user_id))
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        identity_cache.set(key, snapshot)
+    return snapshot
+
+
+class UserSnapshot(UserMixin):
+    """
+    The fields of a logged-in user that requests read, detached from the
+    database session.
+
+    It stands in for the User as ``current_user``; code that changes the
+    user loads the User itself and then invalidates the identity cache.
+    """
+
+    def __init__(self, id, username, email, image_file):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.image_file = image_file
+
+    @classmethod
+    def from_user(cls, user):
+        """
+        Take a snapshot of a user.
+
+        Args:
+            user (User): The user.
+
+        Returns:
+            UserSnapshot: The snapshot.
+        """
+        return cls(user.id, user.username, user.email, user.image_file)
+
+    def __repr__(self):
+        return f"UserSnapshot('{self.username}', '{self.email}')"
 
 
 class User(db.Model, UserMixin):
@@ -38,6 +115,13 @@ class User(db.Model, UserMixin):
         db.String(20), nullable=False, default='default.jpg'
     )
     password = db.Column(db.String(60), nullable=False)
+    # Denormalized totals maintained by the counter events below
+    post_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
+    comment_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
     posts = db.relationship('Post', backref='author', lazy=True)
     comments = db.relationship('Comment', backref='author', lazy=True)
 
@@ -91,20 +175,80 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     date_posted = db.Column(
-        db.DateTime, nullable=False, default=datetime.now(timezone.utc)
+        db.DateTime, nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        server_default=db.func.current_timestamp()
     )
     content = db.Column(db.Text, nullable=False)
+    # First EXCERPT_WORDS words of content, stored so feeds never split
+    # the full body at render time
+    excerpt = db.Column(db.Text)
     user_id = db.Column(
         db.Integer, db.ForeignKey('user.id', name='fk_post_user_id'), 
         nullable=False
     )
     image_filename = db.Column(db.String(100), nullable=False)
-    comments = db.relationship('Comment', backref='post', lazy=True)
+    # Raised to a new site-wide maximum whenever the post or its discussion
+    # changes; keys the post-card cache and the anonymous page ETags
+    version = db.Column(
+        db.Integer, nullable=False, default=1, server_default='1',
+        index=True
+    )
+    # Comments and replies on this post, maintained by the counter events
+    comment_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
+    # Comments are removed by the database's ON DELETE CASCADE
+    comments = db.relationship(
+        'Comment', backref='post', lazy=True, passive_deletes=True
+    )
+
+    # Keyset pagination walks the feed, and each author's posts, in
+    # (date_posted, id) order
+    __table_args__ = (
+        db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+        db.Index(
+            'ix_post_user_id_date_posted', 'user_id', 'date_posted', 'id'
+        ),
+    )
+
+    EXCERPT_WORDS = 20
+
+    @staticmethod
+    def make_excerpt(content):
+        """
+        Build the feed excerpt for a post body.
+
+        Args:
+            content (str): The full post content.
+
+        Returns:
+            str: The first EXCERPT_WORDS words of the content.
+        """
+        return ' '.join(content.split(' ')[:Post.EXCERPT_WORDS])
+
+    @validates('content')
+    def update_excerpt(self, key, content):
+        """
+        Keep the stored excerpt in step with the content.
+        """
+        self.excerpt = Post.make_excerpt(content or '')
+        return content
 
     def __repr__(self):
         return f"Post('{self.title}', '{self.date_posted}')"
 
 
+@event.listens_for(Post, 'before_insert')
+def stamp_post_version(mapper, connection, target):
+    """
+    Give a new post the next site-wide version number.
+    """
+    target.version = connection.scalar(
+        select(func.coalesce(func.max(Post.version), 0) + 1)
+    )
+
+
 class Comment(db.Model):
     """
     Comment model for storing comments on posts.
@@ -115,19 +259,94 @@ class Comment(db.Model):
         db.DateTime, nullable=False, default=datetime.utcnow
     )
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    post_id = db.Column(
+        db.Integer,
+        db.ForeignKey(
+            'post.id', name='fk_comment_post_id', ondelete='CASCADE'
+        ),
+        nullable=False
+    )
     parent_id = db.Column(
-        db.Integer, db.ForeignKey('comment.id'), nullable=True
+        db.Integer,
+        db.ForeignKey(
+            'comment.id', name='fk_comment_parent_id', ondelete='CASCADE'
+        ),
+        nullable=True
     )
     replies = db.relationship(
         'Comment', backref=db.backref('parent', remote_side=[id]), 
         lazy=True, cascade="all, delete-orphan"
     )
 
+    # Threads are read per post (top-level first) and replies per parent
+    __table_args__ = (
+        db.Index(
+            'ix_comment_post_id_parent_id', 'post_id', 'parent_id',
+            'date_posted', 'id'
+        ),
+        db.Index('ix_comment_parent_id', 'parent_id'),
+        db.Index('ix_comment_user_id', 'user_id'),
+    )
+
     def __repr__(self):
         return f"Comment('{self.content}', '{self.date_posted}')"
 
 
+class Conversation(db.Model):
+    """
+    Conversation model for private one-to-one and group chats.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100))
+    is_group = db.Column(
+        db.Boolean, nullable=False, default=False, server_default='0'
+    )
+    # "<lower user id>:<higher user id>" for one-to-one chats, so each pair
+    # of users shares a single conversation
+    dm_key = db.Column(db.String(40), unique=True)
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc)
+    )
+    members = db.relationship(
+        'ConversationMember', backref='conversation', lazy=True,
+        cascade='all, delete-orphan', passive_deletes=True
+    )
+
+    def __repr__(self):
+        return f"Conversation('{self.name}', '{self.is_group}')"
+
+
+class ConversationMember(db.Model):
+    """
+    ConversationMember model linking users to the conversations they are in.
+    """
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('user.id'), primary_key=True
+    )
+    joined_at = db.Column(
+        db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc)
+    )
+    # ID of the newest message the member has read
+    last_read_id = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
+    user = db.relationship('User', backref='memberships')
+
+    # A user's conversations are listed through their memberships
+    __table_args__ = (
+        db.Index('ix_conversation_member_user_id', 'user_id'),
+    )
+
+    def __repr__(self):
+        return (
+            f"ConversationMember('{self.conversation_id}', '{self.user_id}')"
+        )
+
+
 class ChatMessage(db.Model):
     """
     ChatMessage model for storing chat messages.
@@ -135,10 +354,123 @@ class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(500))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # Unset for the public room
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey(
+            'conversation.id', name='fk_chat_message_conversation_id',
+            ondelete='CASCADE'
+        )
+    )
+    # Set in Python so stored values compare cleanly with history cursors
     timestamp = db.Column(
-        db.DateTime, default=db.func.current_timestamp()
+        db.DateTime, default=lambda: datetime.now(timezone.utc)
     )
+    # Assigned when the message is sent, before the write-behind buffer
+    # gives it an id, so clients can match live messages to stored ones
+    uid = db.Column(db.String(32), default=lambda: uuid4().hex)
     user = db.relationship('User', backref='messages')
 
+    # History is read newest first in (timestamp, id) order; each
+    # conversation's history and unread counts use its own id range
+    __table_args__ = (
+        db.Index('ix_chat_message_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_chat_message_user_id', 'user_id'),
+        db.Index(
+            'ix_chat_message_conversation_id_id', 'conversation_id', 'id'
+        ),
+    )
+
     def __repr__(self):
         return f"ChatMessage('{self.content}', '{self.timestamp}')"
+
+
+class OutboundMail(db.Model):
+    """
+    OutboundMail model for email waiting to be sent by the mail outbox.
+
+    A row is deleted once its message is sent; rows the outbox gave up on
+    are kept with status 'failed' and the last error.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200), nullable=False)
+    sender = db.Column(db.String(200), nullable=False)
+    # One address per line
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(
+        db.String(10), nullable=False, default='queued',
+        server_default='queued'
+    )
+    attempts = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
+    # When the message is next due; pushed forward while a worker that
+    # has claimed it is sending, so a crashed worker's mail comes due again
+    next_attempt_at = db.Column(
+        db.DateTime, nullable=False,
+        default=lambda: datetime.now(timezone.utc)
+    )
+    claim = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(
+        db.DateTime, nullable=False,
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+    # Workers pick up queued mail that is due, oldest first
+    __table_args__ = (
+        db.Index(
+            'ix_outbound_mail_status_next_attempt_at',
+            'status', 'next_attempt_at'
+        ),
+    )
+
+    def __repr__(self):
+        return f"OutboundMail('{self.subject}', '{self.status}')"
+
+
+def _bump(connection, model, row_id, column, delta):
+    """
+    Add delta to a counter column on one row, inside the current flush.
+    """
+    table = model.__table__
+    connection.execute(
+        table.update().where(table.c.id == row_id).values(
+            {column: table.c[column] + delta}
+        )
+    )
+
+
+@event.listens_for(Post, 'after_insert')
+def count_new_post(mapper, connection, target):
+    """
+    Count a new post against its author.
+    """
+    _bump(connection, User, target.user_id, 'post_count', 1)
+
+
+@event.listens_for(Post, 'after_delete')
+def count_deleted_post(mapper, connection, target):
+    """
+    Remove a deleted post from its author's total.
+    """
+    _bump(connection, User, target.user_id, 'post_count', -1)
+
+
+@event.listens_for(Comment, 'after_insert')
+def count_new_comment(mapper, connection, target):
+    """
+    Count a new comment or reply against its post and author.
+    """
+    _bump(connection, Post, target.post_id, 'comment_count', 1)
+    _bump(connection, User, target.user_id, 'comment_count', 1)
+
+
+@event.listens_for(Comment, 'after_delete')
+def count_deleted_comment(mapper, connection, target):
+    """
+    Remove a deleted comment or reply from its post and author totals.
+    """
+    _bump(connection, Post, target.post_id, 'comment_count', -1)
+    _bump(connection, User, target.user_id, 'comment_count', -1)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Outbound mail queue used by the Flask application.
+"""
+
+import logging
+import smtplib
+import secrets
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import formataddr
+from time import monotonic
+import click
+from flask_mail import Message, BadHeaderError
+from sqlalchemy import func, select, update
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker may hold claimed mail before it comes due again, in
+# case the worker died while sending it
+CLAIM_SECONDS = 300
+
+# Refusals of one message; the connection stays usable for the next
+MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError, BadHeaderError
+)
+
+
+def utcnow():
+    """Return the current time as a naive UTC datetime, as stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def address(value):
+    """Return an address given as a string or a (name, address) pair."""
+    return formataddr(value) if isinstance(value, tuple) else value
+
+
+def is_permanent(error):
+    """Return whether the server refused a message for good.
+
+    Args:
+        error (Exception): The error raised while sending the message.
+
+    Returns:
+        bool: True for 5xx replies and messages Flask-Mail rejects itself.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    code = getattr(error, 'smtp_code', None)
+    return code is None or code >= 500
+
+
+def build_message(row):
+    """Rebuild the Flask-Mail message stored in a queue row.
+
+    Args:
+        row (OutboundMail): The queued mail.
+
+    Returns:
+        Message: The message to send.
+    """
+    return Message(
+        row.subject, sender=row.sender,
+        recipients=row.recipients.splitlines(), body=row.body, html=row.html
+    )
+
+
+class MailOutbox:
+    """
+    A durable queue of outgoing mail, sent in batches by a worker.
+
+    enqueue() stores a message in the outbound_mail table and returns at
+    once, so a request never waits on the mail provider. The worker claims
+    up to ``batch_size`` due messages at a time and sends them over one
+    SMTP connection (``mail.connect()``). A message the server refuses for
+    now is retried after ``retry_delay`` seconds, doubling each time up to
+    ``max_delay``, and marked failed after ``max_attempts`` tries or a
+    permanent (5xx) refusal. If the server cannot be reached, the claimed
+    mail is put back untouched and the worker backs off the same way.
+    """
+
+    def __init__(self, db, mail, batch_size=50, interval=1.0,
+                 retry_delay=60, max_delay=3600, max_attempts=5,
+                 config_prefix=None):
+        self.db = db
+        self.mail = mail
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.config_prefix = config_prefix
+        self.app = None
+        self._task = None
+        self._stopping = threading.Event()
+        self._backoff = 0
+        self._resume_at = 0.0
+        self._reset_counters()
+
+    def _reset_counters(self):
+        """Zero the sending counters."""
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.connection_failures = 0
+
+    def init_app(self, app):
+        """Configure the outbox from the app config.
+
+        Args:
+            app (Flask): The application whose mail is sent.
+        """
+        if self.config_prefix:
+            for name in ('batch_size', 'interval', 'retry_delay',
+                         'max_delay', 'max_attempts'):
+                key = f'{self.config_prefix}_{name.upper()}'
+                setattr(self, name, app.config.get(key, getattr(self, name)))
+        self.app = app
+        self._backoff = 0
+        self._resume_at = 0.0
+        self._reset_counters()
+
+    def start(self, socketio=None):
+        """Send due mail every ``interval`` seconds from a background task.
+
+        Args:
+            socketio (SocketIO): The server whose async mode runs the task.
+                Without one, the task runs on a daemon thread.
+        """
+        if self._task is not None or not self.interval:
+            return
+        self._stopping.clear()
+        if socketio is not None:
+            self._task = socketio.start_background_task(
+                self._work, socketio.sleep
+            )
+        else:
+            self._task = threading.Thread(
+                target=self._work, args=(self._stopping.wait,),
+                name='mail-outbox', daemon=True
+            )
+            self._task.start()
+
+    def run(self):
+        """Send due mail every ``interval`` seconds on the calling thread.
+
+        Returns once stop() is called from another thread.
+        """
+        self._stopping.clear()
+        self._work(self._stopping.wait)
+
+    def _work(self, sleep):
+        """Send due mail every ``interval`` seconds until stopped.
+
+        Args:
+            sleep (callable): Waits the given number of seconds. A thread
+                sleeps on the stop event, so stop() need not wait it out.
+        """
+        app = self.app
+        while True:
+            sleep(self.interval)
+            if self._stopping.is_set():
+                return
+            with app.app_context():
+                try:
+                    self.send_pending()
+                except Exception:
+                    self.db.session.rollback()
+                    logger.exception('Sending queued mail failed')
+
+    def stop(self):
+        """Stop the background task after its current round."""
+        task, self._task = self._task, None
+        self._stopping.set()
+        if task is not None:
+            task.join()
+
+    def enqueue(self, message):
+        """Queue a message to be sent by the worker.
+
+        Only the subject, sender, recipients and the text and HTML bodies
+        are kept.
+
+        Args:
+            message (Message): The Flask-Mail message to send.
+
+        Returns:
+            OutboundMail: The queued row.
+        """
+        from flask_ambrosial.models import OutboundMail
+
+        if not message.sender or not message.recipients:
+            raise ValueError('Queued mail needs a sender and recipients')
+        row = OutboundMail(
+            subject=message.subject, sender=address(message.sender),
+            recipients='\n'.join(
+                address(recipient) for recipient in message.recipients
+            ),
+            body=message.body, html=message.html
+        )
+        self.db.session.add(row)
+        self.db.session.commit()
+        return row
+
+    def send_pending(self):
+        """Send every message that is due, one batch at a time.
+
+        Does nothing while backing off from an unreachable server.
+
+        Returns:
+            int: Number of messages sent.
+        """
+        total = 0
+        while monotonic() >= self._resume_at:
+            sent, claimed = self.send_batch()
+            total += sent
+            if claimed < self.batch_size:
+                break
+        return total
+
+    def send_batch(self):
+        """Claim up to ``batch_size`` due messages and send them together.
+
+        Sent mail is deleted and each outcome is committed as it happens,
+        so at most the message in flight is sent twice if the process
+        dies.
+
+        Returns:
+            tuple: Messages sent and messages claimed.
+        """
+        from flask_ambrosial.models import OutboundMail
+
+        session = self.db.session
+        now = utcnow()
+        token = secrets.token_hex(8)
+        due = (OutboundMail.status == 'queued') & \
+            (OutboundMail.next_attempt_at <= now)
+        session.execute(
+            update(OutboundMail)
+            .where(OutboundMail.id.in_(
+                select(OutboundMail.id).where(due)
+                .order_by(OutboundMail.id).limit(self.batch_size)
+            ), due)
+            .values(
+                claim=token,
+                next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+            ),
+            execution_options={'synchronize_session': False}
+        )
+        session.commit()
+        rows = session.scalars(
+            select(OutboundMail).where(OutboundMail.claim == token)
+            .order_by(OutboundMail.id)
+        ).all()
+        if not rows:
+            return 0, 0
+
+        self.batches += 1
+        sent = 0
+        sending = None
+        try:
+            with self.mail.connect() as connection:
+                for row in rows:
+                    sending = row
+                    try:
+                        connection.send(build_message(row))
+                    except MESSAGE_ERRORS as error:
+                        self._retry(row, error, is_permanent(error))
+                    else:
+                        session.delete(row)
+                        sent += 1
+                        self.sent += 1
+                    sending = None
+                    session.commit()
+        except (smtplib.SMTPException, OSError) as error:
+            session.rollback()
+            self._connection_failed(token, sending, error)
+        else:
+            self._backoff = 0
+        return sent, len(rows)
+
+    def _retry(self, row, error, permanent):
+        """Schedule a refused message for another try, or give up on it."""
+        row.attempts += 1
+        row.claim = None
+        row.last_error = str(error)
+        if permanent or row.attempts >= self.max_attempts:
+            row.status = 'failed'
+            self.failed += 1
+            logger.error(
+                'Giving up on mail %d to %s after %d attempts: %s',
+                row.id, row.recipients, row.attempts, error
+            )
+            return
+        delay = min(
+            self.retry_delay * 2 ** (row.attempts - 1), self.max_delay
+        )
+        row.next_attempt_at = utcnow() + timedelta(seconds=delay)
+        self.retried += 1
+        logger.warning(
+            'Mail %d to %s refused, retrying in %d s: %s',
+            row.id, row.recipients, delay, error
+        )
+
+    def _connection_failed(self, token, sending, error):
+        """Back off and put the rest of a failed batch back in the queue."""
+        from flask_ambrosial.models import OutboundMail
+
+        self.connection_failures += 1
+        self._backoff = min(
+            max(self._backoff * 2, self.retry_delay), self.max_delay
+        )
+        self._resume_at = monotonic() + self._backoff
+        logger.warning(
+            'Mail server unavailable, retrying in %d s: %s',
+            self._backoff, error
+        )
+        session = self.db.session
+        if sending is not None:
+            # The message in flight may be what the server choked on
+            self._retry(sending, error, False)
+            session.flush()
+        session.execute(
+            update(OutboundMail).where(OutboundMail.claim == token)
+            .values(
+                claim=None,
+                next_attempt_at=utcnow() + timedelta(seconds=self._backoff)
+            ),
+            execution_options={'synchronize_session': False}
+        )
+        session.commit()
+
+    def pending(self):
+        """Return the number of messages waiting to be sent.
+
+        Returns:
+            int: Queued messages, due or not.
+        """
+        from flask_ambrosial.models import OutboundMail
+
+        return self.db.session.scalar(
+            select(func.count()).select_from(OutboundMail)
+            .where(OutboundMail.status == 'queued')
+        )
+
+    def stats(self):
+        """Return the sending counters.
+
+        Returns:
+            dict: Messages sent, retried and failed, batches sent,
+            connection failures and the current backoff in seconds.
+        """
+        return {
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'batches': self.batches,
+            'connection_failures': self.connection_failures,
+            'backoff': self._backoff
+        }
+
+
+@click.command('send-mail')
+def send_mail_command():
+    """Send the mail waiting in the outbound queue."""
+    from flask_ambrosial import outbox
+
+    sent = outbox.send_pending()
+    click.echo(f'Sent {sent} messages, {outbox.pending()} still queued')
+
+
+@click.command('mail-worker')
+def mail_worker_command():
+    """Send queued mail as it comes due, until interrupted."""
+    from flask_ambrosial import outbox
+
+    click.echo(f'Sending queued mail every {outbox.interval} seconds')
+    try:
+        outbox.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Password hashing off the request's thread, used by the Flask application.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+
+def in_green_thread():
+    """Return whether the caller runs in a green thread (under eventlet).
+
+    Returns:
+        bool: True if the current greenlet is scheduled by a hub.
+    """
+    try:
+        import greenlet
+    except ImportError:
+        return False
+    return greenlet.getcurrent().parent is not None
+
+
+class PasswordHasher:
+    """
+    Runs Flask-Bcrypt's hashing and checking on a pool of OS threads.
+
+    bcrypt spends a quarter of a second or so of CPU per call. Called from
+    a green thread it would stall the eventlet hub, and every socket and
+    request in the process with it, so green callers hand the work to
+    eventlet's thread pool (``tpool``) and yield until it is done; other
+    callers use a small thread pool. At most ``workers`` hashes run at
+    once and the rest wait their turn, so a flood of logins queues rather
+    than taking every core.
+    """
+
+    def __init__(self, bcrypt, workers=2, config_key=None):
+        self.bcrypt = bcrypt
+        self.workers = workers
+        self.config_key = config_key
+        self._executor = None
+        self._slots = BoundedSemaphore(workers)
+        self._green_slots = None
+        self._lock = Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        """Zero the hashing counters."""
+        self.calls = 0
+        self.waiting = 0
+        self.max_wait_ms = 0.0
+
+    def init_app(self, app):
+        """Size the pool from the app config.
+
+        Args:
+            app (Flask): The application being configured.
+        """
+        if self.config_key:
+            self.workers = app.config.get(self.config_key, self.workers)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = None
+        self._slots = BoundedSemaphore(self.workers)
+        self._green_slots = None
+        self._reset_counters()
+
+    def generate_password_hash(self, password):
+        """Hash a password, as Bcrypt.generate_password_hash does.
+
+        Args:
+            password (str): The password to hash.
+
+        Returns:
+            bytes: The bcrypt hash.
+        """
+        return self._run(self.bcrypt.generate_password_hash, password)
+
+    def check_password_hash(self, pw_hash, password):
+        """Check a password against a hash, as Bcrypt.check_password_hash.
+
+        Args:
+            pw_hash (str): The stored bcrypt hash.
+            password (str): The password to check.
+
+        Returns:
+            bool: True if the password matches.
+        """
+        return self._run(self.bcrypt.check_password_hash, pw_hash, password)
+
+    def _run(self, function, *args):
+        """Run a hashing call on the pool once a slot is free."""
+        with self._lock:
+            self.calls += 1
+            self.waiting += 1
+        start = perf_counter()
+        if in_green_thread():
+            from eventlet import tpool
+            with self._green_semaphore():
+                self._started(start)
+                return tpool.execute(function, *args)
+        with self._slots:
+            self._started(start)
+            return self._pool().submit(function, *args).result()
+
+    def _started(self, start):
+        """Record how long a call waited for a slot."""
+        waited = (perf_counter() - start) * 1000
+        with self._lock:
+            self.waiting -= 1
+            self.max_wait_ms = max(self.max_wait_ms, waited)
+
+    def _green_semaphore(self):
+        """Return the semaphore green callers queue on.
+
+        A plain threading semaphore would block the whole hub while a
+        green thread waits on it.
+        """
+        if self._green_slots is None:
+            from eventlet.semaphore import Semaphore
+            self._green_slots = Semaphore(self.workers)
+        return self._green_slots
+
+    def _pool(self):
+        """Return the thread pool, starting it on first use."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='password-hash'
+                )
+            return self._executor
+
+    def stats(self):
+        """Return the hashing counters.
+
+        Returns:
+            dict: Calls made, calls waiting for a slot, the longest wait
+            in milliseconds and the number of workers.
+        """
+        return {
+            'calls': self.calls,
+            'waiting': self.waiting,
+            'max_wait_ms': self.max_wait_ms,
+            'workers': self.workers
+        }
@@ -6,18 +6,41 @@ Routes for handling post-related operations in the Flask application.
 
 import os
 import secrets
+import click
 from flask import (
     Blueprint, current_app, render_template, url_for, flash, redirect, 
-    request, abort, jsonify
+    request, abort, jsonify, make_response
 )
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 from flask_ambrosial import db
-from flask_ambrosial.models import Post, Comment
+from flask_ambrosial.models import User, Post, Comment
 from flask_ambrosial.posts.forms import PostForm, CommentForm, ReplyForm
+from flask_ambrosial.posts.utils import (
+    feed_query, paginate_by_cursor, serialize_post, load_comment_tree,
+    serialize_comment, load_comment_page, render_post_card, touch_post,
+    cached_page, reconcile_counters, delete_comment_subtree,
+    delete_post_cascade, comment_page_etag
+)
 
 # Blueprint for handling post-related routes
 posts = Blueprint('posts', __name__)
 
+@posts.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """
+    Repair drift in the denormalized post and comment counters.
+    """
+    for name, rows in reconcile_counters().items():
+        click.echo(f'{name}: {rows} row(s) repaired')
+
+@posts.app_context_processor
+def inject_post_card():
+    """
+    Make the cached post-card renderer available to templates.
+    """
+    return dict(render_post_card=render_post_card)
+
 @posts.route("/post/new", methods=['GET', 'POST'])
 @login_required
 def new_post():
@@ -44,7 +67,7 @@ def new_post():
             )
         post = Post(
             title=form.title.data, content=form.content.data, 
-            image_filename=image_filename, author=current_user
+            image_filename=image_filename, user_id=current_user.id
         )
         db.session.add(post)
         db.session.commit()
@@ -58,26 +81,44 @@ def new_post():
     )
 
 @posts.route("/post/<int:post_id>", methods=['GET', 'POST'], endpoint='post')
+@cached_page
 def post(post_id):
     """
     View a specific post and handle comments.
     """
-    post = Post.query.get_or_404(post_id)
+    post = Post.query.options(joinedload(Post.author)).filter(
+        Post.id == post_id
+    ).first_or_404()
     comment_form = CommentForm()
     reply_form = ReplyForm()
     if comment_form.validate_on_submit():
         comment = Comment(
-            content=comment_form.content.data, author=current_user, post=post
+            content=comment_form.content.data, user_id=current_user.id,
+            post=post
         )
         db.session.add(comment)
+        touch_post(post.id)
         db.session.commit()
         flash('Your comment has been posted!', 'success')
         return redirect(url_for('posts.post', post_id=post.id))
     return render_template(
-        'post.html', title=post.title, post=post, 
+        'post.html', title=post.title, post=post,
+        comments=load_comment_tree(post.id),
         comment_form=comment_form, reply_form=reply_form
     )
 
+@posts.route("/post/<int:post_id>/content", methods=['GET'])
+def post_content(post_id):
+    """
+    Return the full body of a post for the "Read more" link.
+    """
+    content = db.session.query(Post.content).filter(
+        Post.id == post_id
+    ).scalar()
+    if content is None:
+        abort(404)
+    return jsonify({'success': True, 'content': content}), 200
+
 @posts.route("/post/<int:post_id>/update", methods=['GET', 'POST'])
 @login_required
 def update_post(post_id):
@@ -85,7 +126,7 @@ def update_post(post_id):
     Update an existing post.
     """
     post = Post.query.get_or_404(post_id)
-    if post.author != current_user:
+    if post.user_id != current_user.id:
         abort(403)
     form = PostForm()
     if form.validate_on_submit():
@@ -108,6 +149,7 @@ def update_post(post_id):
                 'create_post.html', title='Update Post', form=form, 
                 legend='Update Post'
             )
+        touch_post(post.id)
         db.session.commit()
         flash('Your post has been updated', 'success')
         return redirect(url_for('posts.post', post_id=post.id))
@@ -126,16 +168,11 @@ def delete_post(post_id):
     Delete an existing post along with its associated comments.
     """
     post = Post.query.get_or_404(post_id)
-    if post.author != current_user:
+    if post.user_id != current_user.id:
         abort(403)
     
-    # Delete all comments associated with the post
-    comments = Comment.query.filter_by(post_id=post_id).all()
-    for comment in comments:
-        db.session.delete(comment)
-    
-    # Delete the post
-    db.session.delete(post)
+    # Delete the post and its comments in bulk; the image goes on commit
+    delete_post_cascade(post)
     db.session.commit()
     
     flash('Your post and all associated comments have been deleted', 'success')
@@ -149,17 +186,33 @@ def add_comment():
     """
     data = request.form
     content = data.get('content')
-    post_id = data.get('post_id')
+    post_id = data.get('post_id', type=int)
     parent_comment_id = data.get('parent_comment_id')
 
     if not content or not post_id:
         return jsonify({'success': False, 'message': 'Invalid data'}), 400
 
+    # Foreign keys are enforced, so check the references up front rather
+    # than letting the insert fail with an IntegrityError on flush.
+    post = Post.query.get_or_404(post_id)
+    if parent_comment_id:
+        parent = None
+        if parent_comment_id.isdigit():
+            parent = db.session.get(Comment, int(parent_comment_id))
+        if parent is None or parent.post_id != post.id:
+            return jsonify(
+                {'success': False, 'message': 'Invalid parent comment'}
+            ), 400
+        parent_comment_id = parent.id
+    else:
+        parent_comment_id = None
+
     comment = Comment(
-        content=content, author=current_user, post_id=post_id, 
+        content=content, user_id=current_user.id, post_id=post_id,
         parent_id=parent_comment_id
     )
     db.session.add(comment)
+    touch_post(post_id)
     db.session.commit()
 
     flash('Your comment has been posted!', 'success')
@@ -168,63 +221,60 @@ def add_comment():
 @posts.route("/comments", methods=['GET'])
 def get_comments():
     """
-    Retrieve comments for a specific post.
+    Retrieve the nested comment tree for a specific post.
     """
-    post_id = request.args.get('post_id')
+    post_id = request.args.get('post_id', type=int)
     if not post_id:
         return jsonify({'success': False, 'message': 'Invalid post ID'}), 400
 
-    comments = Comment.query.filter_by(
-        post_id=post_id, parent_id=None
-    ).all()
-    comments_data = []
-    for comment in comments:
-        comments_data.append({
-            'id': comment.id,
-            'content': comment.content,
-            'timestamp': comment.date_posted,
-            'author': {
-                'name': comment.author.username,
-                'profile_picture': url_for(
-                    'static', filename='profile_pics/' + 
-                    comment.author.image_file
-                )
-            }
-        })
+    comments = load_comment_tree(post_id)
+    return jsonify({
+        'success': True,
+        'comments': [serialize_comment(comment) for comment in comments]
+    }), 200
 
-    return jsonify({'success': True, 'comments': comments_data}), 200
-
-def get_replies(comment_id):
-    """
-    Retrieve replies for a specific comment.
-    """
-    replies = Comment.query.filter_by(parent_id=comment_id).all()
-    replies_data = []
-    for reply in replies:
-        replies_data.append({
-            'id': reply.id,
-            'content': reply.content,
-            'timestamp': reply.date_posted,
-            'author': {
-                'name': reply.author.username,
-                'profile_picture': url_for(
-                    'static', filename='profile_pics/' + 
-                    reply.author.image_file
-                )
-            }
-        })
-    return replies_data
+@posts.route("/post/<int:post_id>/comments", methods=['GET'])
+def post_comments(post_id):
+    """
+    Return one page of a post's comments, as an HTML fragment for the
+    feed or as JSON when ``format=json`` is requested.
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
+    if request.args.get('format') == 'json':
+        comments, next_page = load_comment_page(post_id, page=page)
+        return jsonify({
+            'success': True,
+            'comments': [
+                serialize_comment(comment, depth=1) for comment in comments
+            ],
+            'next_page': next_page
+        }), 200
+    etag = comment_page_etag(post_id, page)
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        comments, next_page = load_comment_page(post_id, page=page)
+        response = make_response(render_template(
+            'comments_fragment.html', comments=comments, post_id=post_id,
+            next_page=next_page, comment_form=CommentForm()
+        ))
+    # Let the browser revalidate instead of downloading the thread again
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
 
 @posts.route("/")
 @posts.route("/home")
+@cached_page
 def home():
     """
     Display the home page with paginated posts.
     """
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(
-        Post.date_posted.desc()
-    ).paginate(page=page, per_page=5)
+    posts = paginate_by_cursor(
+        feed_query(), after=request.args.get('after'),
+        before=request.args.get('before'), per_page=5
+    )
     post_form = PostForm()
     comment_form = CommentForm()
     reply_form = ReplyForm()
@@ -233,6 +283,30 @@ def home():
         comment_form=comment_form, reply_form=reply_form
     )
 
+@posts.route("/api/posts", methods=['GET'])
+def api_posts():
+    """
+    Return a page of the feed as JSON with opaque next/prev cursors.
+    """
+    per_page = min(request.args.get('per_page', 5, type=int), 50)
+    query = feed_query()
+    username = request.args.get('username')
+    if username:
+        user = User.query.filter_by(username=username).first_or_404()
+        query = query.filter(Post.user_id == user.id)
+    page = paginate_by_cursor(
+        query, after=request.args.get('after'),
+        before=request.args.get('before'), per_page=max(per_page, 1),
+        with_total=request.args.get('total', type=int) == 1
+    )
+    return jsonify({
+        'success': True,
+        'posts': [serialize_post(post) for post in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'total': page.total
+    }), 200
+
 @posts.route("/comment/<int:comment_id>/delete", methods=['POST'])
 @login_required
 def delete_comment(comment_id):
@@ -240,9 +314,9 @@ def delete_comment(comment_id):
     Delete a specific comment.
     """
     comment = Comment.query.get_or_404(comment_id)
-    if comment.author != current_user:
+    if comment.user_id != current_user.id:
         abort(403)
-    db.session.delete(comment)
+    delete_comment_subtree(comment)
     db.session.commit()
     flash('Your comment has been deleted', 'success')
     return redirect(url_for('posts.home'))
@@ -254,9 +328,9 @@ def delete_reply(reply_id):
     Delete a specific reply.
     """
     reply = Comment.query.get_or_404(reply_id)
-    if reply.author != current_user:
+    if reply.user_id != current_user.id:
         abort(403)
-    db.session.delete(reply)
+    delete_comment_subtree(reply)
     db.session.commit()
     flash('Your reply has been deleted', 'success')
     return redirect(url_for('posts.home'))
@@ -268,11 +342,12 @@ def edit_comment(comment_id):
     Edit a specific comment.
     """
     comment = Comment.query.get_or_404(comment_id)
-    if comment.author != current_user:
+    if comment.user_id != current_user.id:
         abort(403)
     form = CommentForm()
     if form.validate_on_submit():
         comment.content = form.content.data
+        touch_post(comment.post_id)
         db.session.commit()
         flash('Your comment has been updated', 'success')
         return redirect(url_for('posts.post', post_id=comment.post_id))
@@ -290,11 +365,12 @@ def edit_reply(reply_id):
     Edit a specific reply.
     """
     reply = Comment.query.get_or_404(reply_id)
-    if reply.author != current_user:
+    if reply.user_id != current_user.id:
         abort(403)
     form = ReplyForm()
     if form.validate_on_submit():
         reply.content = form.content.data
+        touch_post(reply.post_id)
         db.session.commit()
         flash('Your reply has been updated', 'success')
         return redirect(url_for('posts.post', post_id=reply.post_id))
@@ -315,9 +391,9 @@ def delete_post_comment(post_id, comment_id):
     Delete a comment from a specific post.
     """
     comment = Comment.query.get_or_404(comment_id)
-    if comment.author != current_user:
+    if comment.user_id != current_user.id:
         abort(403)
-    db.session.delete(comment)
+    delete_comment_subtree(comment)
     db.session.commit()
     flash('Your comment has been deleted', 'success')
     return redirect(url_for('posts.post', post_id=post_id))
@@ -332,9 +408,9 @@ def delete_post_reply(post_id, reply_id):
     Delete a reply from a specific post.
     """
     reply = Comment.query.get_or_404(reply_id)
-    if reply.author != current_user:
+    if reply.user_id != current_user.id:
         abort(403)
-    db.session.delete(reply)
+    delete_comment_subtree(reply)
     db.session.commit()
     flash('Your reply has been deleted', 'success')
     return redirect(url_for('posts.post', post_id=post_id))
@@ -349,11 +425,12 @@ def edit_post_comment(post_id, comment_id):
     Edit a comment on a specific post.
     """
     comment = Comment.query.get_or_404(comment_id)
-    if comment.author != current_user:
+    if comment.user_id != current_user.id:
         abort(403)
     form = CommentForm()
     if form.validate_on_submit():
         comment.content = form.content.data
+        touch_post(comment.post_id)
         db.session.commit()
         flash('Your comment has been updated', 'success')
         return redirect(url_for('posts.post', post_id=post_id))
@@ -374,11 +451,12 @@ def edit_post_reply(post_id, reply_id):
     Edit a reply on a specific post.
     """
     reply = Comment.query.get_or_404(reply_id)
-    if reply.author != current_user:
+    if reply.user_id != current_user.id:
         abort(403)
     form = ReplyForm()
     if form.validate_on_submit():
         reply.content = form.content.data
+        touch_post(reply.post_id)
         db.session.commit()
         flash('Your reply has been updated', 'success')
         return redirect(url_for('posts.post', post_id=post_id))
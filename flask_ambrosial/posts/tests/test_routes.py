@@ -4,13 +4,15 @@
 Unit tests for Flask routes in the Flask Ambrosial application.
 """
 
+import time
 import unittest
 from io import BytesIO
-from flask import url_for
-from flask_ambrosial import create_app, db
+from flask import g, url_for
+from flask_ambrosial import create_app, db, post_card_cache
 from flask_ambrosial.models import User, Post, Comment
 from flask_login import login_user
 from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.posts.utils import touch_post
 
 
 class PostRoutesTestCase(unittest.TestCase):
@@ -140,6 +142,51 @@ class PostRoutesTestCase(unittest.TestCase):
             )
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'Your comment has been posted!', response.data)
+        with self.app.test_request_context():
+            response = self.client.post(
+                url_for('posts.add_comment'),
+                data={'content': 'Lost comment.', 'post_id': 'abc'}
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Comment.query.count(), 1)
+
+    def test_add_comment_missing_post(self):
+        """Test that commenting on a missing post returns 404."""
+        with self.app.test_request_context():
+            response = self.client.post(
+                url_for('posts.add_comment'),
+                data={'content': 'Lost comment.', 'post_id': 999}
+            )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Comment.query.count(), 0)
+
+    def test_add_comment_bad_parent(self):
+        """Test that a reply to an unknown or foreign comment returns 400."""
+        post = Post(
+            title='Test Post', content='This is a test post.',
+            author=self.user, image_filename='default.jpg'
+        )
+        other = Post(
+            title='Other Post', content='This is another post.',
+            author=self.user, image_filename='default.jpg'
+        )
+        db.session.add_all([post, other])
+        db.session.commit()
+        foreign = Comment(content='Elsewhere.', author=self.user, post=other)
+        db.session.add(foreign)
+        db.session.commit()
+        for parent_id in ('777', 'abc', str(foreign.id)):
+            with self.app.test_request_context():
+                response = self.client.post(
+                    url_for('posts.add_comment'),
+                    data={
+                        'content': 'Stray reply.', 'post_id': post.id,
+                        'parent_comment_id': parent_id
+                    }
+                )
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Comment.query.count(), 1)
+        self.assertEqual(db.session.get(Post, post.id).comment_count, 0)
 
     def test_get_comments(self):
         """Test retrieving comments for a post."""
@@ -161,6 +208,247 @@ class PostRoutesTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'This is a test comment.', response.data)
 
+    def test_get_comments_nested(self):
+        """Test that replies are nested under their parent comment."""
+        self.add_discussion(posts=1, comments=1, replies=2)
+        post = Post.query.first()
+        with self.app.test_request_context():
+            response = self.client.get(
+                url_for('posts.get_comments', post_id=post.id)
+            )
+        comments = response.get_json()['comments']
+        self.assertEqual(len(comments), 1)
+        self.assertEqual(
+            [reply['content'] for reply in comments[0]['replies']],
+            ['Reply 0', 'Reply 1']
+        )
+
+    def test_home_renders_counts_only(self):
+        """Test that the feed carries comment counts, not comment bodies."""
+        self.add_discussion(posts=1, comments=2, replies=1)
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'Comment 0', response.data)
+        self.assertIn(b'<small class="text-muted">4</small>', response.data)
+
+    def test_post_comments_fragment(self):
+        """Test paging through a post's comments on demand."""
+        self.add_discussion(posts=1, comments=12, replies=1)
+        post = Post.query.first()
+        with self.app.test_request_context():
+            first = self.client.get(
+                url_for('posts.post_comments', post_id=post.id)
+            )
+            second = self.client.get(url_for(
+                'posts.post_comments', post_id=post.id, page=2,
+                format='json'
+            ))
+            cached = self.client.get(
+                url_for('posts.post_comments', post_id=post.id),
+                headers={'If-None-Match': first.headers['ETag']}
+            )
+        self.assertIn(b'Comment 9', first.data)
+        self.assertIn(b'load-more-comments', first.data)
+        self.assertNotIn(b'Comment 10', first.data)
+        data = second.get_json()
+        self.assertEqual(
+            [comment['content'] for comment in data['comments']],
+            ['Comment 10', 'Comment 11']
+        )
+        self.assertEqual(len(data['comments'][0]['replies']), 1)
+        self.assertIsNone(data['next_page'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_post_comments_etag_with_csrf(self):
+        """Test that comment pages revalidate with CSRF protection on."""
+        self.app.config['WTF_CSRF_ENABLED'] = True
+        self.add_discussion(posts=1, comments=2, replies=0)
+        post = Post.query.first()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.user.id)
+            session['_fresh'] = True
+        url = f'/post/{post.id}/comments'
+        # Forget the user Flask-Login cached in the test's g
+        g.pop('_login_user', None)
+        first = self.client.get(url)
+        self.assertIn(b'reply-form', first.data)
+        self.assertNotIn(b'csrf_token', first.data)
+        etag = first.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        time.sleep(1)
+        g.pop('_login_user', None)
+        cached = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+
+        # A new comment raises the post's version and so the ETag
+        db.session.add(Comment(content='New', author=self.user, post=post))
+        touch_post(post.id)
+        db.session.commit()
+        g.pop('_login_user', None)
+        fresh = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh.headers['ETag'], etag)
+
+    def test_post_card_cache(self):
+        """Test that cards are reused until their post changes."""
+        self.add_discussion(posts=2, comments=1, replies=0)
+        self.client.get('/')
+        self.assertEqual(post_card_cache.stats()['misses'], 2)
+        self.client.get('/')
+        self.assertEqual(post_card_cache.stats()['hits'], 2)
+        comment = Comment.query.first()
+        version = comment.post.version
+        with self.app.test_request_context():
+            self.client.post(
+                url_for('posts.edit_comment', comment_id=comment.id),
+                data={'content': 'Edited comment'}
+            )
+        db.session.expire_all()
+        self.assertEqual(
+            comment.post.version,
+            db.session.query(db.func.max(Post.version)).scalar()
+        )
+        self.assertGreater(comment.post.version, version)
+        self.client.get('/')
+        stats = post_card_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 3))
+
+    def test_post_content(self):
+        """Test that the feed sends the excerpt and fetches the body."""
+        content = ' '.join(f'word{i}' for i in range(30))
+        post = Post(
+            title='Long Post', content=content, author=self.user,
+            image_filename='default.jpg'
+        )
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(post.excerpt, ' '.join(content.split(' ')[:20]))
+        response = self.client.get('/')
+        self.assertIn(b'word19...', response.data)
+        self.assertNotIn(b'word25', response.data)
+        with self.app.test_request_context():
+            response = self.client.get(
+                url_for('posts.post_content', post_id=post.id)
+            )
+            missing = self.client.get(
+                url_for('posts.post_content', post_id=post.id + 1)
+            )
+        self.assertEqual(response.get_json()['content'], content)
+        self.assertEqual(missing.status_code, 404)
+
+    def test_api_posts_cursor(self):
+        """Test paging through the JSON feed with cursors."""
+        for i in range(3):
+            db.session.add(Post(
+                title=f'Post {i}', content='This is a test post.',
+                author=self.user, image_filename='default.jpg'
+            ))
+        db.session.commit()
+        with self.app.test_request_context():
+            response = self.client.get(
+                url_for('posts.api_posts', per_page=2)
+            )
+            first = response.get_json()
+            response = self.client.get(url_for(
+                'posts.api_posts', per_page=2, after=first['next_cursor']
+            ))
+        second = response.get_json()
+        self.assertEqual(
+            [post['title'] for post in first['posts']],
+            ['Post 2', 'Post 1']
+        )
+        self.assertEqual(
+            [post['title'] for post in second['posts']], ['Post 0']
+        )
+        self.assertIsNone(second['next_cursor'])
+        self.assertIsNotNone(second['prev_cursor'])
+
+        # Items carry the excerpt; the body is fetched from content_url
+        content = ' '.join(f'word{i}' for i in range(30))
+        db.session.add(Post(
+            title='Long Post', content=content, author=self.user,
+            image_filename='default.jpg'
+        ))
+        db.session.commit()
+        response = self.client.get('/api/posts?per_page=1')
+        item = response.get_json()['posts'][0]
+        self.assertNotIn('content', item)
+        self.assertNotIn(b'word25', response.data)
+        self.assertTrue(item['excerpt'].endswith('word19'))
+        response = self.client.get(item['content_url'])
+        self.assertEqual(response.get_json()['content'], content)
+
+    def add_discussion(self, posts=1, comments=2, replies=2):
+        """Create posts, each with comments that have replies."""
+        for i in range(posts):
+            post = Post(
+                title=f'Post {i}', content='This is a test post.',
+                author=self.user, image_filename='default.jpg'
+            )
+            db.session.add(post)
+            for j in range(comments):
+                comment = Comment(
+                    content=f'Comment {j}', author=self.user, post=post
+                )
+                db.session.add(comment)
+                for k in range(replies):
+                    db.session.add(Comment(
+                        content=f'Reply {k}', author=self.user,
+                        post=post, parent=comment
+                    ))
+        db.session.commit()
+        db.session.expire_all()
+
+    def test_home_query_budget(self):
+        """Test that the feed query count does not grow with comments."""
+        self.add_discussion(posts=1, comments=1, replies=1)
+        response = self.client.get('/')
+        small = int(response.headers['X-Query-Count'])
+        self.add_discussion(posts=4, comments=3, replies=3)
+        response = self.client.get('/')
+        large = int(response.headers['X-Query-Count'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.app.config['QUERY_BUDGET'])
+
+    def test_post_query_budget(self):
+        """Test that a post page loads its thread in a fixed query count."""
+        self.add_discussion(posts=1, comments=5, replies=3)
+        post = Post.query.first()
+        response = self.client.get(f'/post/{post.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            int(response.headers['X-Query-Count']),
+            self.app.config['QUERY_BUDGET']
+        )
+
+    def test_api_posts_query_budget(self):
+        """Test that the JSON feed loads authors without a query per post."""
+        for i in range(5):
+            author = User(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='password'
+            )
+            db.session.add(Post(
+                title=f'Post {i}', content='This is a test post.',
+                author=author, image_filename='default.jpg'
+            ))
+        db.session.commit()
+        db.session.expire_all()
+        counts = []
+        for per_page in (1, 5):
+            response = self.client.get(f'/api/posts?per_page={per_page}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.get_json()['posts']), per_page)
+            counts.append(int(response.headers['X-Query-Count']))
+        self.assertEqual(counts[0], counts[1])
+        response = self.client.get('/api/posts?username=author0')
+        self.assertEqual(len(response.get_json()['posts']), 1)
+        self.assertLessEqual(
+            int(response.headers['X-Query-Count']),
+            self.app.config['QUERY_BUDGET']
+        )
+
     def test_delete_comment(self):
         """Test deleting a comment."""
         post = Post(
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the post helpers in the flask_ambrosial.posts module.
+"""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from flask_ambrosial import create_app, db
+from flask_ambrosial.models import User, Post, Comment
+from flask_ambrosial.profiling import count_queries
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.posts.utils import (
+    encode_cursor, decode_cursor, paginate_by_cursor, load_comment_tree,
+    reconcile_counters, delete_comment_subtree, delete_post_cascade,
+    remove_after_commit
+)
+
+
+class PostUtilsTestCase(unittest.TestCase):
+    """
+    Test cases for post helper functions.
+    """
+
+    def setUp(self):
+        """
+        Set up the database with a user and a handful of posts.
+        """
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        db.session.add(self.user)
+        start = datetime(2024, 1, 1)
+        # Two posts share a timestamp so the id tie-breaker is exercised
+        for i in range(7):
+            db.session.add(Post(
+                title=f'Post {i}', content='Content', author=self.user,
+                image_filename='default.jpg',
+                date_posted=start + timedelta(days=min(i, 5))
+            ))
+        db.session.commit()
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_cursor_round_trip(self):
+        """
+        Test that a cursor decodes back to the post's sort key.
+        """
+        post = Post.query.first()
+        self.assertEqual(
+            decode_cursor(encode_cursor(post)),
+            (post.date_posted, post.id)
+        )
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertIsNone(decode_cursor(None))
+
+    def test_walk_forwards_and_back(self):
+        """
+        Test that following next/prev cursors visits every post once.
+        """
+        expected = [
+            post.id for post in Post.query.order_by(
+                Post.date_posted.desc(), Post.id.desc()
+            )
+        ]
+        page = paginate_by_cursor(Post.query, per_page=3)
+        self.assertFalse(page.has_prev)
+        seen = [post.id for post in page.items]
+        while page.next_cursor:
+            page = paginate_by_cursor(
+                Post.query, after=page.next_cursor, per_page=3
+            )
+            seen.extend(post.id for post in page.items)
+        self.assertEqual(seen, expected)
+
+        page = paginate_by_cursor(
+            Post.query, before=page.prev_cursor, per_page=3
+        )
+        self.assertEqual([post.id for post in page.items], expected[3:6])
+
+    def test_total_is_optional(self):
+        """
+        Test that the total is only counted when requested.
+        """
+        self.assertIsNone(paginate_by_cursor(Post.query).total)
+        self.assertEqual(
+            paginate_by_cursor(Post.query, with_total=True).total, 7
+        )
+
+    def test_load_comment_tree(self):
+        """
+        Test that a nested thread is loaded in a single query.
+        """
+        post = Post.query.first()
+        root = Comment(content='Root', author=self.user, post=post)
+        reply = Comment(
+            content='Reply', author=self.user, post=post, parent=root
+        )
+        nested = Comment(
+            content='Nested', author=self.user, post=post, parent=reply
+        )
+        other = Comment(content='Other', author=self.user, post=post)
+        db.session.add_all([root, reply, nested, other])
+        db.session.commit()
+        post_id = post.id
+        db.session.expire_all()
+        with count_queries() as statements:
+            roots = load_comment_tree(post_id)
+            tree = [
+                (c.content, [(r.content, [n.content for n in r.replies])
+                             for r in c.replies], c.author.username)
+                for c in roots
+            ]
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(tree, [
+            ('Root', [('Reply', ['Nested'])], 'testuser'),
+            ('Other', [], 'testuser')
+        ])
+
+    def test_counters_follow_writes(self):
+        """
+        Test that post and comment counters track inserts and deletes.
+        """
+        post = Post.query.first()
+        comment = Comment(content='Root', author=self.user, post=post)
+        reply = Comment(
+            content='Reply', author=self.user, post=post, parent=comment
+        )
+        db.session.add_all([comment, reply])
+        db.session.commit()
+        self.assertEqual(post.comment_count, 2)
+        self.assertEqual(self.user.post_count, 7)
+        self.assertEqual(self.user.comment_count, 2)
+
+        # Deleting the comment cascades to its reply
+        db.session.delete(comment)
+        db.session.commit()
+        self.assertEqual(post.comment_count, 0)
+        self.assertEqual(self.user.comment_count, 0)
+
+    def test_reconcile_counters(self):
+        """
+        Test that drifted counters are repaired.
+        """
+        post = Post.query.first()
+        db.session.add(Comment(content='Root', author=self.user, post=post))
+        db.session.commit()
+        post.comment_count = 5
+        self.user.post_count = 0
+        db.session.commit()
+        repaired = reconcile_counters()
+        self.assertEqual(repaired, {
+            'post.comment_count': 1, 'user.post_count': 1,
+            'user.comment_count': 0
+        })
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(self.user.post_count, 7)
+
+    def add_thread(self, post, depth):
+        """
+        Add a chain of depth nested comments to a post and return the root.
+        """
+        parent = root = None
+        for i in range(depth):
+            comment = Comment(
+                content=f'Level {i}', author=self.user, post=post,
+                parent=parent
+            )
+            db.session.add(comment)
+            root = root or comment
+            parent = comment
+        db.session.commit()
+        return root
+
+    def test_delete_comment_subtree(self):
+        """
+        Test that a thread is deleted in the same statements at any depth
+        or width.
+        """
+        post = Post.query.first()
+        other = Comment(content='Other', author=self.user, post=post)
+        db.session.add(other)
+        shallow = self.add_thread(post, 2)
+        deep = self.add_thread(post, 6)
+        db.session.add_all([
+            Comment(content='Reply', author=self.user, post=post, parent=deep)
+            for _ in range(20)
+        ])
+        db.session.commit()
+        with count_queries() as shallow_statements:
+            self.assertEqual(delete_comment_subtree(shallow), 2)
+        with count_queries() as deep_statements:
+            self.assertEqual(delete_comment_subtree(deep), 26)
+        db.session.commit()
+        # No statement binds a parameter per deleted comment
+        self.assertEqual(shallow_statements, deep_statements)
+        self.assertEqual(Comment.query.all(), [other])
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(self.user.comment_count, 1)
+
+    def test_delete_post_cascade(self):
+        """
+        Test that a post goes with its comments, counters and image file.
+        """
+        post = Post.query.first()
+        self.add_thread(post, 3)
+        self.app.root_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.app.root_path, 'static/post_pics'))
+        path = os.path.join(
+            self.app.root_path, 'static/post_pics', post.image_filename
+        )
+        open(path, 'w').close()
+
+        delete_post_cascade(post)
+        self.assertTrue(os.path.exists(path))
+        db.session.commit()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(Comment.query.count(), 0)
+        self.assertEqual(Post.query.count(), 6)
+        self.assertEqual(self.user.post_count, 6)
+        self.assertEqual(self.user.comment_count, 0)
+
+    def test_remove_after_commit_skips_rollback(self):
+        """
+        Test that queued files are kept when the transaction rolls back.
+        """
+        with tempfile.NamedTemporaryFile(delete=False) as image:
+            path = image.name
+        delete_comment_subtree(self.add_thread(Post.query.first(), 1))
+        remove_after_commit(path)
+        db.session.rollback()
+        db.session.commit()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Comment.query.count(), 1)
+        os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+"""
+Helpers for paginating and loading posts in the Flask application.
+"""
+
+import os
+import base64
+import hashlib
+from datetime import datetime
+from functools import wraps
+from sqlalchemy import delete, event, func, select, tuple_, update
+from flask import (
+    current_app, make_response, render_template, request, session, url_for
+)
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy.orm import Session, aliased, joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from flask_ambrosial import db, get_locale, post_card_cache, response_cache
+from flask_ambrosial.models import User, Post, Comment
+
+
+def encode_cursor(post):
+    """Encode a post's position in the feed as an opaque cursor.
+
+    Args:
+        post (Post): The post the cursor points at.
+
+    Returns:
+        str: A URL-safe cursor string.
+    """
+    raw = f'{post.date_posted.isoformat()}|{post.id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor.
+
+    Args:
+        cursor (str): The opaque cursor string.
+
+    Returns:
+        tuple: A (date_posted, id) pair, or None if the cursor is invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        date_posted, post_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(date_posted), int(post_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def feed_options():
+    """Loader options that fetch everything a post card renders.
+
+    Authors are joined into the same SELECT as their posts. Comments are
+    not rendered into the feed, so they are not loaded here; cards show
+    the stored Post.comment_count and threads come from
+    load_comment_page.
+
+    Returns:
+        tuple: Options to pass to ``Query.options``.
+    """
+    return (joinedload(Post.author),)
+
+
+def feed_query():
+    """Return a Post query with the feed loader options applied.
+
+    Returns:
+        Query: The eager-loading Post query.
+    """
+    return Post.query.options(*feed_options())
+
+
+class CursorPage:
+    """
+    A single page of posts fetched with keyset pagination.
+    """
+
+    def __init__(self, items, has_next, has_prev, total=None):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.total = total
+
+    @property
+    def next_cursor(self):
+        """Cursor for the page of older posts, or None on the last page."""
+        if self.has_next and self.items:
+            return encode_cursor(self.items[-1])
+        return None
+
+    @property
+    def prev_cursor(self):
+        """Cursor for the page of newer posts, or None on the first page."""
+        if self.has_prev and self.items:
+            return encode_cursor(self.items[0])
+        return None
+
+
+def paginate_by_cursor(query, after=None, before=None, per_page=5,
+                       with_total=False):
+    """Paginate a post query newest first, keyed on (date_posted, id).
+
+    Unlike ``paginate`` this never issues an OFFSET scan, so deep pages
+    cost the same as the first one, and the COUNT query only runs when
+    the caller asks for it.
+
+    Args:
+        query (Query): A Post query, without ordering applied.
+        after (str): Cursor of the last post seen; fetch older posts.
+        before (str): Cursor of the first post seen; fetch newer posts.
+        per_page (int): Number of posts per page.
+        with_total (bool): Whether to count the total number of posts.
+
+    Returns:
+        CursorPage: The requested page.
+    """
+    key = tuple_(Post.date_posted, Post.id)
+    total = query.order_by(None).count() if with_total else None
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if after_key is None else None
+
+    if before_key is not None:
+        # Walk forwards in time from the cursor, then flip the page back
+        rows = query.filter(key > tuple_(*before_key)).order_by(
+            Post.date_posted.asc(), Post.id.asc()
+        ).limit(per_page + 1).all()
+        if len(rows) > per_page:
+            items = list(reversed(rows[:per_page]))
+            return CursorPage(items, has_next=True, has_prev=True,
+                              total=total)
+        # Reached the newest posts: fall through to a regular first page
+        # rather than serving a short one
+
+    if after_key is not None:
+        query = query.filter(key < tuple_(*after_key))
+    rows = query.order_by(
+        Post.date_posted.desc(), Post.id.desc()
+    ).limit(per_page + 1).all()
+    return CursorPage(rows[:per_page], has_next=len(rows) > per_page,
+                      has_prev=after_key is not None, total=total)
+
+
+def serialize_post(post):
+    """Serialize a post for the JSON feed.
+
+    Feed items carry the excerpt only; ``content_url`` points at the full
+    body, which clients fetch on demand.
+
+    Args:
+        post (Post): The post to serialize.
+
+    Returns:
+        dict: The JSON-ready post representation.
+    """
+    return {
+        'id': post.id,
+        'title': post.title,
+        'excerpt': post.excerpt,
+        'content_url': url_for('posts.post_content', post_id=post.id),
+        'date_posted': post.date_posted.isoformat(),
+        'image_filename': post.image_filename,
+        'author': post.author.username
+    }
+
+
+def render_post_card(post):
+    """Render a post card, reusing the cached HTML when possible.
+
+    Entries are keyed by post ID, post version, locale and whether the
+    viewer is the author (who also sees the Update/Delete buttons).
+
+    Args:
+        post (Post): The post to render.
+
+    Returns:
+        Markup: The rendered card.
+    """
+    is_author = (
+        current_user.is_authenticated and current_user.id == post.user_id
+    )
+    key = (
+        post.id, post.version, str(get_locale()),
+        'author' if is_author else 'other'
+    )
+    html = post_card_cache.get(key)
+    if html is None:
+        html = Markup(render_template('post_card.html', post=post))
+        post_card_cache.set(key, html)
+    return html
+
+
+def _next_version():
+    """Return a scalar subquery for the next site-wide post version."""
+    newest = aliased(Post)
+    return select(
+        func.coalesce(func.max(newest.version), 0) + 1
+    ).scalar_subquery()
+
+
+def touch_post(post_id):
+    """Raise a post's version and drop the cached HTML that shows it.
+
+    Call this in the same transaction as any change to the post or its
+    comments, before committing.
+
+    Args:
+        post_id (int): The ID of the changed post.
+    """
+    Post.query.filter_by(id=post_id).update(
+        {Post.version: _next_version()}, synchronize_session=False
+    )
+    post_card_cache.invalidate(int(post_id))
+    response_cache.clear()
+
+
+def touch_user_posts(user_id):
+    """Raise the version of every post by a user or commented on by them.
+
+    Used when the user's name or picture changes, which shows on their
+    post cards and in the comment pages of the posts they commented on.
+    Their old post cards can no longer be reached once the versions move,
+    so they are left to age out of the LRU.
+
+    Args:
+        user_id (int): The ID of the changed user.
+    """
+    Post.query.filter(
+        (Post.user_id == user_id) | Post.id.in_(
+            select(Comment.post_id).where(Comment.user_id == user_id)
+        )
+    ).update({Post.version: _next_version()}, synchronize_session=False)
+    response_cache.clear()
+
+
+def content_stamp():
+    """Return a value that changes whenever any post or comment changes.
+
+    New posts and edits raise the highest post version, and deleting a
+    post hands a fresh version to the newest one left (see
+    delete_post_cascade), so the maximum never repeats. It is read from
+    the end of the version index.
+
+    Returns:
+        str: The stamp.
+    """
+    return str(db.session.scalar(select(func.max(Post.version))) or 0)
+
+
+def comment_page_etag(post_id, page):
+    """Return the weak ETag of one rendered page of a post's comments.
+
+    Every comment change raises the post's version (see touch_post), so
+    the tag is derived from the version, page, viewer and locale without
+    loading or rendering the comments.
+
+    Args:
+        post_id (int): The ID of the post.
+        page (int): The 1-based page of top-level comments.
+
+    Returns:
+        str: The ETag, or None if there is no such post.
+    """
+    version = db.session.scalar(
+        select(Post.version).where(Post.id == post_id)
+    )
+    if version is None:
+        return None
+    viewer = current_user.get_id() if current_user.is_authenticated else ''
+    return hashlib.sha1(
+        f'{post_id}|{version}|{page}|{viewer}|{get_locale()}'.encode('utf-8')
+    ).hexdigest()
+
+
+def cached_page(view):
+    """Serve a page from the response cache for anonymous visitors.
+
+    The weak ETag is derived from the content stamp, path and locale, so a
+    matching ``If-None-Match`` gets a 304 before anything is rendered.
+    Logged-in users, pending flash messages and language switches always
+    bypass the cache.
+
+    Args:
+        view (callable): The view function to wrap.
+
+    Returns:
+        callable: The wrapped view.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if (request.method != 'GET' or current_user.is_authenticated
+                or '_flashes' in session or 'lang' in request.args):
+            return view(*args, **kwargs)
+        locale = str(get_locale())
+        key = (request.full_path, locale)
+        etag = hashlib.sha1(
+            f'{key}|{content_stamp()}'.encode('utf-8')
+        ).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            cached = response_cache.get(key)
+            if cached is not None and cached[0] == etag:
+                response = current_app.response_class(
+                    cached[1], mimetype=cached[2]
+                )
+            else:
+                response = make_response(view(*args, **kwargs))
+                if (response.status_code == 200
+                        and 'Set-Cookie' not in response.headers):
+                    response_cache.set(
+                        key, (etag, response.get_data(), response.mimetype)
+                    )
+        if response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'public, no-cache'
+        # The locale comes from Accept-Language unless the session has one
+        response.vary.update(('Cookie', 'Accept-Language'))
+        return response
+    return wrapper
+
+
+def reconcile_counters():
+    """Recompute the denormalized post and comment counters.
+
+    Each counter is rebuilt with one correlated UPDATE that only touches
+    rows which have drifted.
+
+    Returns:
+        dict: Number of rows repaired per counter.
+    """
+    post_comments = select(func.count(Comment.id)).where(
+        Comment.post_id == Post.id
+    ).scalar_subquery()
+    user_posts = select(func.count(Post.id)).where(
+        Post.user_id == User.id
+    ).scalar_subquery()
+    user_comments = select(func.count(Comment.id)).where(
+        Comment.user_id == User.id
+    ).scalar_subquery()
+    repaired = {}
+    for name, model, column, actual in (
+        ('post.comment_count', Post, Post.comment_count, post_comments),
+        ('user.post_count', User, User.post_count, user_posts),
+        ('user.comment_count', User, User.comment_count, user_comments),
+    ):
+        result = db.session.execute(
+            update(model).where(column != actual).values(
+                {column: actual}
+            ).execution_options(synchronize_session=False)
+        )
+        repaired[name] = result.rowcount
+    db.session.commit()
+    return repaired
+
+
+def remove_after_commit(path):
+    """Queue a file to be removed once the current transaction commits.
+
+    The file stays in place if the transaction is rolled back, so a failed
+    delete never leaves a row pointing at a missing image.
+
+    Args:
+        path (str): The path of the file to remove.
+    """
+    db.session.info.setdefault('remove_after_commit', []).append(path)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remove_queued_files(session):
+    """
+    Remove the files queued during the transaction that just committed.
+    """
+    for path in session.info.pop('remove_after_commit', []):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_queued_files(session, previous_transaction):
+    """
+    Keep the files queued during a transaction that was rolled back.
+    """
+    session.info.pop('remove_after_commit', None)
+
+
+def _delete_comments(criterion):
+    """Bulk delete the comments matching criterion and fix their counters.
+
+    Comment authors' counters are lowered with one grouped UPDATE, then
+    the rows go in one DELETE, so the cost does not grow with the size of
+    the thread.
+
+    Args:
+        criterion (ColumnElement): A filter selecting the Comment rows.
+    """
+    per_author = select(func.count(Comment.id)).where(
+        criterion, Comment.user_id == User.id
+    ).scalar_subquery()
+    db.session.execute(
+        update(User).where(
+            User.id.in_(select(Comment.user_id).where(criterion))
+        ).values(
+            {User.comment_count: User.comment_count - per_author}
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(Comment).where(criterion).execution_options(
+            synchronize_session='fetch'
+        )
+    )
+
+
+def delete_comment_subtree(comment):
+    """Delete a comment together with every reply beneath it.
+
+    The subtree is selected by a recursive CTE inside each statement, so
+    the whole thread goes in a fixed number of statements however deep
+    or wide it is. Call db.session.commit afterwards.
+
+    Args:
+        comment (Comment): The root of the subtree to delete.
+
+    Returns:
+        int: Number of comments deleted.
+    """
+    # Nested, so the WITH is rendered inside the IN subquery: pysqlite
+    # does not open a transaction for statements that start with WITH, so
+    # a CTE-led UPDATE or DELETE would commit on its own
+    subtree = select(Comment.id).where(Comment.id == comment.id).cte(
+        'subtree', recursive=True, nesting=True
+    )
+    subtree = subtree.union_all(
+        select(Comment.id).where(Comment.parent_id == subtree.c.id)
+    )
+    post_id = comment.post_id
+    deleted = db.session.scalar(select(func.count()).select_from(subtree))
+    _delete_comments(Comment.id.in_(select(subtree.c.id)))
+    db.session.execute(
+        update(Post).where(Post.id == post_id).values(
+            {
+                Post.comment_count: Post.comment_count - deleted,
+                Post.version: _next_version()
+            }
+        ).execution_options(synchronize_session=False)
+    )
+    post_card_cache.invalidate(post_id)
+    response_cache.clear()
+    return deleted
+
+
+def delete_post_cascade(post):
+    """Delete a post, its whole discussion and, after commit, its image.
+
+    Runs a fixed number of statements whatever the size of the discussion.
+    Call db.session.commit afterwards.
+
+    Args:
+        post (Post): The post to delete.
+    """
+    post_id, user_id = post.id, post.user_id
+    _delete_comments(Comment.post_id == post_id)
+    # The content stamp is the highest version, which the deletion could
+    # lower to a value already served; give the newest other post a fresh
+    # one, taken while this post still counts
+    newest = aliased(Post)
+    db.session.execute(
+        update(Post).where(Post.id == select(func.max(newest.id)).where(
+            newest.id != post_id
+        ).scalar_subquery()).values(
+            {Post.version: _next_version()}
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(User).where(User.id == user_id).values(
+            {User.post_count: User.post_count - 1}
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(Post).where(Post.id == post_id).execution_options(
+            synchronize_session='fetch'
+        )
+    )
+    remove_after_commit(os.path.join(
+        current_app.root_path, 'static/post_pics',
+        os.path.basename(post.image_filename)
+    ))
+    post_card_cache.invalidate(post_id)
+    response_cache.clear()
+
+
+def load_comment_page(post_id, page=1, per_page=10):
+    """Load one page of top-level comments together with their replies.
+
+    Args:
+        post_id (int): The ID of the post.
+        page (int): The 1-based page of top-level comments.
+        per_page (int): Number of top-level comments per page.
+
+    Returns:
+        tuple: The comments on the page and the next page number, or
+        None if this is the last page.
+    """
+    comments = Comment.query.options(
+        joinedload(Comment.author),
+        selectinload(Comment.replies).joinedload(Comment.author)
+    ).filter_by(post_id=post_id, parent_id=None).order_by(
+        Comment.date_posted, Comment.id
+    ).offset((page - 1) * per_page).limit(per_page + 1).all()
+    next_page = page + 1 if len(comments) > per_page else None
+    return comments[:per_page], next_page
+
+
+def load_comment_tree(post_id):
+    """Load every comment on a post and assemble the reply tree.
+
+    Each comment carries its post_id, so the whole thread (with authors)
+    comes back from a single SELECT however deep it is nested. The
+    ``replies`` collections are then filled in place in one pass, so
+    templates can walk ``comment.replies`` without lazy loads.
+
+    Args:
+        post_id (int): The ID of the post.
+
+    Returns:
+        list: The top-level comments, oldest first.
+    """
+    comments = Comment.query.options(
+        joinedload(Comment.author)
+    ).filter_by(post_id=post_id).order_by(
+        Comment.date_posted, Comment.id
+    ).all()
+    children = {comment.id: [] for comment in comments}
+    roots = []
+    for comment in comments:
+        if comment.parent_id in children:
+            children[comment.parent_id].append(comment)
+        else:
+            roots.append(comment)
+    for comment in comments:
+        set_committed_value(comment, 'replies', children[comment.id])
+    return roots
+
+
+def serialize_comment(comment, depth=None):
+    """Serialize a comment and its loaded replies as nested JSON.
+
+    Args:
+        comment (Comment): A comment from load_comment_tree.
+        depth (int): How many levels of replies to include, or None for
+            the whole loaded tree.
+
+    Returns:
+        dict: The JSON-ready comment with a ``replies`` list.
+    """
+    return {
+        'id': comment.id,
+        'content': comment.content,
+        'timestamp': comment.date_posted,
+        'author': {
+            'name': comment.author.username,
+            'profile_picture': url_for(
+                'static', filename='profile_pics/' +
+                comment.author.image_file
+            )
+        },
+        'replies': [] if depth == 0 else [
+            serialize_comment(reply, None if depth is None else depth - 1)
+            for reply in comment.replies
+        ]
+    }
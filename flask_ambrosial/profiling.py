@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Query counting and query-plan helpers for keeping per-request database work
+in check.
+"""
+
+from contextlib import contextmanager
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_counters = []
+_captures = []
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """
+    Count every statement sent to the database.
+    """
+    for counter in _counters:
+        counter.append(statement)
+    for capture in _captures:
+        capture.append((statement, parameters))
+    if has_app_context() and 'query_count' in g:
+        g.query_count += 1
+
+
+@contextmanager
+def count_queries():
+    """Record the statements executed inside the block.
+
+    Yields:
+        list: The SQL statements executed so far, in order.
+    """
+    statements = []
+    _counters.append(statements)
+    try:
+        yield statements
+    finally:
+        _counters.remove(statements)
+
+
+@contextmanager
+def capture_queries():
+    """Record the statements executed inside the block with their parameters.
+
+    Yields:
+        list: ``(statement, parameters)`` pairs, in execution order.
+    """
+    captured = []
+    _captures.append(captured)
+    try:
+        yield captured
+    finally:
+        _captures.remove(captured)
+
+
+def explain_query_plan(connection, statement, parameters=()):
+    """Return SQLite's query plan for a captured statement.
+
+    Args:
+        connection (Connection): The connection to explain on.
+        statement (str): The SQL statement as sent to the driver.
+        parameters (tuple): The statement's bound parameters.
+
+    Returns:
+        list: The ``detail`` column of each plan step.
+    """
+    rows = connection.exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + statement, tuple(parameters or ())
+    )
+    return [row[-1] for row in rows]
+
+
+def find_full_scans(connection, captured):
+    """Find captured SELECTs that scan a whole table instead of an index.
+
+    A plan step such as ``SCAN post`` reads every row, while
+    ``SCAN post USING INDEX ...`` or ``SEARCH ...`` walks an index.
+
+    Args:
+        connection (Connection): The connection to explain on.
+        captured (list): ``(statement, parameters)`` pairs from
+            :func:`capture_queries`.
+
+    Returns:
+        list: ``(statement, detail)`` pairs for every full-table scan.
+    """
+    scans = []
+    for statement, parameters in captured:
+        if not statement.lstrip().upper().startswith('SELECT'):
+            continue
+        for detail in explain_query_plan(connection, statement, parameters):
+            if detail.startswith('SCAN') and 'INDEX' not in detail:
+                scans.append((statement, detail))
+    return scans
+
+
+def init_query_budget(app):
+    """Count queries per request and flag requests over QUERY_BUDGET.
+
+    The count is returned in the ``X-Query-Count`` response header so tests
+    can assert against it, and requests that exceed the budget are logged.
+
+    Args:
+        app (Flask): The application to instrument.
+    """
+    @app.before_request
+    def start_query_count():
+        g.query_count = 0
+
+    @app.after_request
+    def report_query_count(response):
+        count = g.pop('query_count', 0)
+        budget = current_app.config['QUERY_BUDGET']
+        response.headers['X-Query-Count'] = str(count)
+        if count > budget:
+            current_app.logger.warning(
+                'Query budget exceeded on %s: %d > %d',
+                request.path, count, budget
+            )
+        return response
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Socket.IO message-queue backends shared by the application's workers.
+
+With a message queue, every worker publishes its emits and room changes to
+a shared channel, so a message emitted on one worker reaches clients that
+are connected to another. Production deployments point
+SOCKETIO_MESSAGE_QUEUE at Redis; the local backends below stand in for it
+during development and tests.
+"""
+
+import os
+from threading import Lock
+import socketio
+
+
+class LocalManager(socketio.PubSubManager):
+    """
+    An in-process pub/sub channel, for several servers in one process.
+
+    Messages are JSON encoded on the way through, as they would be over
+    Redis, so anything that works here survives a real queue. Every
+    listening manager in the process is registered under its channel
+    until it is closed.
+    """
+    name = 'local'
+
+    # Channel -> queues of the listening managers, shared by the process
+    _subscribers = {}
+    _lock = Lock()
+
+    def __init__(self, url='local://', channel='socketio', write_only=False,
+                 logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only,
+                         logger=logger, json=json)
+        self.queue = None
+
+    def initialize(self):
+        # The queue comes from the server so it blocks the right way for
+        # its async mode (a green thread under eventlet)
+        if not self.write_only:
+            self.queue = self.server.eio.create_queue()
+            with self._lock:
+                self._subscribers.setdefault(self.channel, []).append(
+                    self.queue
+                )
+        super().initialize()
+
+    def close(self):
+        """Stop listening and leave the channel.
+
+        Messages published afterwards are no longer queued for this
+        manager, and its listener task ends (python-socketio logs that it
+        exited, as it expects listeners to run for good).
+        """
+        queue, self.queue = self.queue, None
+        if queue is None:
+            return
+        with self._lock:
+            queues = self._subscribers.get(self.channel, [])
+            if queue in queues:
+                queues.remove(queue)
+            if not queues:
+                self._subscribers.pop(self.channel, None)
+        queue.put(None)
+
+    def _publish(self, data):
+        message = self.json.dumps(data)
+        with self._lock:
+            queues = list(self._subscribers.get(self.channel, ()))
+        for queue in queues:
+            queue.put(message)
+
+    def _listen(self):
+        queue = self.queue
+        while True:
+            message = queue.get()
+            if message is None:
+                return
+            yield message
+
+
+class FileManager(socketio.PubSubManager):
+    """
+    A pub/sub channel backed by an append-only spool file.
+
+    Lets several worker processes on one host share rooms without Redis:
+    each publish appends one JSON line and every listener tails the file.
+    The spool is never truncated, so it is meant for development only.
+    """
+    name = 'file'
+
+    def __init__(self, url, channel='socketio', write_only=False,
+                 logger=None, json=None, poll_interval=0.05):
+        super().__init__(channel=channel, write_only=write_only,
+                         logger=logger, json=json)
+        self.path = url[len('file://'):]
+        self.poll_interval = poll_interval
+        self._offset = None
+
+    def initialize(self):
+        # Only messages published after the server starts are delivered
+        with open(self.path, 'a'):
+            pass
+        self._offset = os.path.getsize(self.path)
+        super().initialize()
+
+    def _publish(self, data):
+        line = self.json.dumps({'channel': self.channel, 'data': data})
+        # One write per message; O_APPEND keeps concurrent lines whole
+        with open(self.path, 'a') as spool:
+            spool.write(line + '\n')
+
+    def _listen(self):
+        with open(self.path) as spool:
+            spool.seek(self._offset)
+            while True:
+                position = spool.tell()
+                line = spool.readline()
+                if not line.endswith('\n'):
+                    # Nothing new, or a line still being written
+                    spool.seek(position)
+                    self.server.sleep(self.poll_interval)
+                    continue
+                message = self.json.loads(line)
+                if message.get('channel') == self.channel:
+                    yield message['data']
+
+
+def message_queue_options(config):
+    """Build the SocketIO.init_app options for the configured queue.
+
+    ``redis://`` (and any other URL Flask-SocketIO understands) is passed
+    through; ``local://`` and ``file:///path`` select the stand-ins above.
+
+    Args:
+        config (Config): The application config.
+
+    Returns:
+        dict: Keyword arguments for SocketIO.init_app.
+    """
+    url = config.get('SOCKETIO_MESSAGE_QUEUE')
+    channel = config.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    if not url:
+        return {}
+    if url.startswith('local://'):
+        return {'client_manager': LocalManager(url, channel=channel)}
+    if url.startswith('file://'):
+        return {'client_manager': FileManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
@@ -1,35 +1,188 @@
 document.addEventListener('DOMContentLoaded', function() {
-    const socket = io.connect(window.location.protocol + "//" + window.location.host);
+    // MessagePack framing has to match the server's serializer
+    const options = serializer === 'msgpack' ? {parser: msgpackParser} : {};
+    const socket = io.connect(window.location.protocol + "//" + window.location.host, options);
 
     const chatBox = document.getElementById('chat-box');
     const chatForm = document.getElementById('chat-form');
     const messageInput = document.getElementById('message-input');
 
-    // Join the chat room
-    socket.emit('join', {
-        'username': username,  // Use the username variable from the HTML context
-        'room': 'default'
+    // Server timestamps are naive UTC
+    function parseTimestamp(timestamp) {
+        if (!timestamp) {
+            return new Date();
+        }
+        return new Date(/[zZ]|[+-]\d\d:\d\d$/.test(timestamp) ? timestamp : timestamp + 'Z');
+    }
+
+    // Messages on screen, by uid (or id for messages stored before uids),
+    // so history replayed after a reconnect only adds what was missed
+    const shown = new Set();
+    // ID of the newest stored message seen, where catching up starts
+    let lastId = null;
+    let joined = false;
+    // Server timestamp of the newest message on screen, reported as read
+    let lastShownRaw = null;
+    let lastReported = null;
+    let readTimer = null;
+
+    // Tell the conversation how far we have read, at most once a second
+    // and only while the page is visible
+    function scheduleRead() {
+        if (conversation === null || readTimer !== null) {
+            return;
+        }
+        readTimer = setTimeout(function() {
+            readTimer = null;
+            if (document.visibilityState === 'visible' && lastShownRaw !== null && lastShownRaw !== lastReported) {
+                socket.emit('read', {'conversation': conversation, 'timestamp': lastShownRaw});
+                lastReported = lastShownRaw;
+            }
+        }, 1000);
+    }
+    document.addEventListener('visibilitychange', scheduleRead);
+
+    // Show which other members have read up to the latest message
+    const readReceipts = document.getElementById('read-receipts');
+    const readers = new Set();
+    socket.on('read', function(receipts) {
+        receipts.forEach(receipt => {
+            if (receipt.username !== username) {
+                readers.add(receipt.username);
+            }
+        });
+        readReceipts.textContent = readers.size ? `Seen by ${[...readers].join(', ')}` : '';
     });
 
-    // Listen for incoming messages
-    socket.on('message', function(data) {
+    function appendMessage(text, timestamp) {
         const messageElement = document.createElement('div');
-        const timestamp = new Date().toLocaleTimeString();
 
-        if (data.msg.startsWith(username + ':')) {  // Use the username variable from the HTML context
+        if (text.startsWith(username + ':')) {  // Use the username variable from the HTML context
             messageElement.classList.add('text-right', 'bg-primary', 'text-white', 'rounded', 'p-2', 'mb-2');
             messageElement.style.maxWidth = '60%';
             messageElement.style.marginLeft = 'auto';
-            messageElement.textContent = `[${timestamp}] ${data.msg}`;
         } else {
             messageElement.classList.add('text-left', 'bg-light', 'text-dark', 'rounded', 'p-2', 'mb-2');
             messageElement.style.maxWidth = '60%';
             messageElement.style.marginRight = 'auto';
-            messageElement.textContent = `[${timestamp}] ${data.msg}`;
         }
+        messageElement.textContent = `[${timestamp.toLocaleTimeString()}] ${text}`;
 
         chatBox.appendChild(messageElement);
         chatBox.scrollTop = chatBox.scrollHeight; // Auto-scroll to the bottom
+    }
+
+    // The public room, or the private conversation this page was opened for
+    const target = conversation === null ? {'room': 'default'} : {'conversation': conversation};
+
+    // List the user's conversations, with unread counts, above the chat box
+    const conversationList = document.getElementById('conversation-list');
+    fetch('/api/conversations')
+        .then(response => response.json())
+        .then(data => {
+            data.conversations.forEach(item => {
+                const link = document.createElement('a');
+                link.classList.add('list-group-item', 'list-group-item-action');
+                if (item.id === conversation) {
+                    link.classList.add('active');
+                }
+                link.href = `/chat/${item.id}`;
+                link.textContent = item.name || item.members.filter(name => name !== username).join(', ');
+                if (item.unread > 0) {
+                    const badge = document.createElement('span');
+                    badge.classList.add('badge', 'badge-primary', 'ml-2');
+                    badge.textContent = item.unread;
+                    link.appendChild(badge);
+                }
+                conversationList.appendChild(link);
+            });
+        })
+        .catch(error => console.error('Error loading conversations:', error));
+
+    // Join the chat room on every (re)connect; the server replies with the
+    // room's recent messages
+    socket.on('connect', function() {
+        // The server knows who we are from the session cookie
+        socket.emit('join', target);
+    });
+
+    function messageKey(message) {
+        return message.uid || (message.id != null ? `id:${message.id}` : null);
+    }
+
+    // Show a message from history unless it is already on screen
+    function showStored(message) {
+        const key = messageKey(message);
+        if (key !== null && shown.has(key)) {
+            return;
+        }
+        shown.add(key);
+        appendMessage(`${message.username}: ${message.content}`, parseTimestamp(message.timestamp));
+        lastShownRaw = message.timestamp;
+        if (message.id != null && (lastId === null || message.id > lastId)) {
+            lastId = message.id;
+        }
+    }
+
+    // Fetch every stored message after the newest one seen, page by page
+    function catchUp() {
+        if (lastId === null) {
+            return Promise.resolve();
+        }
+        const url = conversation === null
+            ? `/api/messages?since_id=${lastId}`
+            : `/api/conversations/${conversation}/messages?after=${lastId}`;
+        return fetch(url)
+            .then(response => response.json())
+            .then(data => {
+                data.messages.forEach(showStored);
+                if (data.has_more && data.messages.length) {
+                    return catchUp();
+                }
+            });
+    }
+
+    // Show the replayed backlog. After a reconnect the backlog may not
+    // reach back far enough, so first fetch everything stored since the
+    // last message seen; the backlog then only adds newer, unsaved ones
+    socket.on('history', function(messages) {
+        const missed = joined ? catchUp() : Promise.resolve();
+        joined = true;
+        missed
+            .catch(error => console.error('Error catching up on messages:', error))
+            .then(() => {
+                messages.forEach(showStored);
+                scheduleRead();
+            });
+    });
+
+    // Compact frames are [username, text, timestamp, uid] arrays
+    function showMessage(data) {
+        if (Array.isArray(data)) {
+            data = {msg: `${data[0]}: ${data[1]}`, timestamp: data[2], uid: data[3]};
+        }
+        if (data.uid) {
+            if (shown.has(data.uid)) {
+                return;
+            }
+            shown.add(data.uid);
+        }
+        const timestamp = parseTimestamp(data.timestamp);
+        appendMessage(data.msg, timestamp);
+        if (data.timestamp) {
+            lastShownRaw = data.timestamp;
+            // A new message has not been seen by anyone else yet
+            readers.clear();
+            readReceipts.textContent = '';
+            scheduleRead();
+        }
+    }
+
+    // Listen for incoming messages; busy rooms send them in batches, as a
+    // list of messages
+    socket.on('message', function(data) {
+        const isSingle = !Array.isArray(data) || typeof data[0] === 'string';
+        (isSingle ? [data] : data).forEach(showMessage);
     });
 
     // Handle form submission
@@ -38,11 +191,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
         const msg = messageInput.value;
         if (msg.trim() !== "") {
-            socket.emit('message', {
-                'username': username,  // Use the username variable from the HTML context
-                'room': 'default',
-                'msg': msg
-            });
+            socket.emit('message', Object.assign({'msg': msg}, target));
 
             // Clear the input field
             messageInput.value = '';
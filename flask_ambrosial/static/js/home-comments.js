@@ -3,8 +3,6 @@ document.addEventListener('DOMContentLoaded', function() {
     const addCommentIcons = document.querySelectorAll('.add-comment-icon');
     // Select all elements with the class 'view-comments-icon'
     const viewCommentsIcons = document.querySelectorAll('.view-comments-icon');
-    // Select all elements with the class 'read-more'
-    const readMoreLinks = document.querySelectorAll('.read-more');
     // Select the "Back to Top" button
     const backToTopButton = document.getElementById('back-to-top');
 
@@ -13,109 +11,160 @@ document.addEventListener('DOMContentLoaded', function() {
         icon.addEventListener('click', function() {
             const commentForm = this.closest('.media-body')
                 .querySelector('.comment-form');
+            // Signed-out visitors get no form; send them to log in instead
+            if (!commentForm) {
+                window.location.href = '/login';
+                return;
+            }
             commentForm.style.display = commentForm.style.display === 'none' 
                 || commentForm.style.display === '' ? 'block' : 'none';
         });
     });
 
-    // Toggle the display of the comments section when the view comments icon is clicked
+    // Fetch the first page of comments on the first click, then just toggle
     viewCommentsIcons.forEach(icon => {
         icon.addEventListener('click', function() {
             const commentsDisplay = this.closest('.media-body')
                 .querySelector('.comments-display');
+            if (!commentsDisplay.dataset.loaded) {
+                commentsDisplay.dataset.loaded = 'true';
+                loadComments(commentsDisplay, commentsDisplay.dataset.url);
+            }
             commentsDisplay.style.display = commentsDisplay.style.display === 'none' 
                 || commentsDisplay.style.display === '' ? 'block' : 'none';
         });
     });
 
-    // Toggle the display of the reply form when the reply icon is clicked
-    document.querySelectorAll('.reply-icon').forEach(icon => {
-        icon.addEventListener('click', function() {
-            const replyForm = this.closest('.media-body')
-                .querySelector('.reply-form');
-            replyForm.style.display = replyForm.style.display === 'none' 
-                || replyForm.style.display === '' ? 'block' : 'none';
+    // Append a page of rendered comments to the container
+    function loadComments(container, url) {
+        fetch(url, { credentials: 'same-origin' })
+            .then(response => response.text())
+            .then(html => {
+                const page = document.createElement('div');
+                page.innerHTML = html;
+                // Fragments are revalidated by ETag, so their forms carry
+                // no CSRF token of their own; give them the page's
+                const token = document.querySelector('input[name="csrf_token"]');
+                if (token) {
+                    page.querySelectorAll('form').forEach(form => {
+                        const input = token.cloneNode();
+                        input.removeAttribute('id');
+                        form.prepend(input);
+                    });
+                }
+                container.appendChild(page);
+                addCommentEventListeners(page);
+            });
+    }
+
+    // Attach the comment and reply handlers to freshly loaded markup
+    function addCommentEventListeners(root) {
+        // Toggle the display of the reply form when the reply icon is clicked
+        root.querySelectorAll('.reply-icon').forEach(icon => {
+            icon.addEventListener('click', function() {
+                const replyForm = this.closest('.media-body')
+                    .querySelector('.reply-form');
+                replyForm.style.display = replyForm.style.display === 'none' 
+                    || replyForm.style.display === '' ? 'block' : 'none';
+            });
         });
-    });
 
-    // Redirect to the edit comment page when the edit comment icon is clicked
-    document.querySelectorAll('.edit-comment-icon').forEach(icon => {
-        icon.addEventListener('click', function() {
-            const commentId = this.dataset.commentId;
-            window.location.href = `/comment/${commentId}/edit`;
+        // Redirect to the edit comment page when the edit comment icon is clicked
+        root.querySelectorAll('.edit-comment-icon').forEach(icon => {
+            icon.addEventListener('click', function() {
+                const commentId = this.dataset.commentId;
+                window.location.href = `/comment/${commentId}/edit`;
+            });
         });
-    });
 
-    // Handle the deletion of a comment when the delete comment icon is clicked
-    document.querySelectorAll('.delete-comment-icon').forEach(icon => {
-        icon.addEventListener('click', function() {
-            const commentId = this.dataset.commentId;
-            if (confirm('Are you sure you want to delete this comment?')) {
-                fetch(`/comment/${commentId}/delete`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'X-CSRFToken': document.querySelector('input[name="csrf_token"]').value
-                    }
-                }).then(response => {
-                    if (response.ok) {
-                        location.reload();
-                    } else {
-                        alert('Failed to delete comment.');
-                    }
-                });
-            }
+        // Handle the deletion of a comment when the delete comment icon is clicked
+        root.querySelectorAll('.delete-comment-icon').forEach(icon => {
+            icon.addEventListener('click', function() {
+                const commentId = this.dataset.commentId;
+                if (confirm('Are you sure you want to delete this comment?')) {
+                    fetch(`/comment/${commentId}/delete`, {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json',
+                            'X-CSRFToken': document.querySelector('input[name="csrf_token"]').value
+                        }
+                    }).then(response => {
+                        if (response.ok) {
+                            location.reload();
+                        } else {
+                            alert('Failed to delete comment.');
+                        }
+                    });
+                }
+            });
         });
-    });
 
-    // Redirect to the edit reply page when the edit reply icon is clicked
-    document.querySelectorAll('.edit-reply-icon').forEach(icon => {
-        icon.addEventListener('click', function() {
-            const replyId = this.dataset.replyId;
-            window.location.href = `/reply/${replyId}/edit`;
+        // Redirect to the edit reply page when the edit reply icon is clicked
+        root.querySelectorAll('.edit-reply-icon').forEach(icon => {
+            icon.addEventListener('click', function() {
+                const replyId = this.dataset.replyId;
+                window.location.href = `/reply/${replyId}/edit`;
+            });
         });
-    });
 
-    // Handle the deletion of a reply when the delete reply icon is clicked
-    document.querySelectorAll('.delete-reply-icon').forEach(icon => {
-        icon.addEventListener('click', function() {
-            const replyId = this.dataset.replyId;
-            if (confirm('Are you sure you want to delete this reply?')) {
-                fetch(`/reply/${replyId}/delete`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'X-CSRFToken': document.querySelector('input[name="csrf_token"]').value
-                    }
-                }).then(response => {
-                    if (response.ok) {
-                        location.reload();
-                    } else {
-                        alert('Failed to delete reply.');
-                    }
-                });
-            }
+        // Handle the deletion of a reply when the delete reply icon is clicked
+        root.querySelectorAll('.delete-reply-icon').forEach(icon => {
+            icon.addEventListener('click', function() {
+                const replyId = this.dataset.replyId;
+                if (confirm('Are you sure you want to delete this reply?')) {
+                    fetch(`/reply/${replyId}/delete`, {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json',
+                            'X-CSRFToken': document.querySelector('input[name="csrf_token"]').value
+                        }
+                    }).then(response => {
+                        if (response.ok) {
+                            location.reload();
+                        } else {
+                            alert('Failed to delete reply.');
+                        }
+                    });
+                }
+            });
         });
-    });
+
+        // Replace the "load more" link with the next page of comments
+        root.querySelectorAll('.load-more-comments').forEach(link => {
+            link.addEventListener('click', function(event) {
+                event.preventDefault();
+                const container = this.closest('.comments-display');
+                const url = this.dataset.url;
+                this.remove();
+                loadComments(container, url);
+            });
+        });
+    }
 
     // Function to add event listeners to 'read more' links
     function addReadMoreEventListeners() {
         document.querySelectorAll('.read-more').forEach(link => {
             link.addEventListener('click', function(event) {
                 event.preventDefault();
-                const fullContent = this.getAttribute('data-full-content');
-                const articleContent = this.closest('.article-content');
-                if (this.textContent === 'Read more') {
-                    articleContent.innerHTML = fullContent + 
-                        ' <a href="#" class="read-more" data-full-content="' + 
-                        fullContent + '">Show less</a>';
-                } else {
-                    articleContent.innerHTML = fullContent.split(' ')
-                        .slice(0, 20).join(' ') + 
-                        '... <a href="#" class="read-more" data-full-content="' + 
-                        fullContent + '">Read more</a>';
+                const articleText = this.closest('.article-content')
+                    .querySelector('.article-text');
+                if (this.dataset.expanded) {
+                    // Restore the excerpt that was rendered with the page
+                    articleText.textContent = this.dataset.excerpt;
+                    this.textContent = this.dataset.label;
+                    delete this.dataset.expanded;
+                    return;
                 }
-                addReadMoreEventListeners();
+                // Fetch the full body only when the reader asks for it
+                fetch(this.dataset.url)
+                    .then(response => response.json())
+                    .then(data => {
+                        this.dataset.excerpt = articleText.textContent;
+                        this.dataset.label = this.textContent;
+                        this.dataset.expanded = 'true';
+                        articleText.textContent = data.content;
+                        this.textContent = 'Show less';
+                    });
             });
         });
     }
@@ -3,13 +3,16 @@ document.addEventListener('DOMContentLoaded', function() {
     const addCommentIcons = document.querySelectorAll('.add-comment-icon');
     // Select all elements with the class 'view-comments-icon'
     const viewCommentsIcons = document.querySelectorAll('.view-comments-icon');
-    // Select all elements with the class 'read-more'
-    const readMoreLinks = document.querySelectorAll('.read-more');
 
     // Toggle the display of the comment form when the add comment icon is clicked
     addCommentIcons.forEach(icon => {
         icon.addEventListener('click', function() {
             const commentForm = document.querySelector('.comment-form');
+            // Signed-out visitors get no form; send them to log in instead
+            if (!commentForm) {
+                window.location.href = '/login';
+                return;
+            }
             commentForm.style.display = commentForm.style.display === 'none' 
                 || commentForm.style.display === '' ? 'block' : 'none';
         });
@@ -99,19 +102,25 @@ document.addEventListener('DOMContentLoaded', function() {
         document.querySelectorAll('.read-more').forEach(link => {
             link.addEventListener('click', function(event) {
                 event.preventDefault();
-                const fullContent = this.getAttribute('data-full-content');
-                const articleContent = this.closest('.article-content');
-                if (this.textContent === 'Read more') {
-                    articleContent.innerHTML = fullContent + 
-                        ' <a href="#" class="read-more" data-full-content="' + 
-                        fullContent + '">Show less</a>';
-                } else {
-                    articleContent.innerHTML = fullContent.split(' ')
-                        .slice(0, 20).join(' ') + 
-                        '... <a href="#" class="read-more" data-full-content="' + 
-                        fullContent + '">Read more</a>';
+                const articleText = this.closest('.article-content')
+                    .querySelector('.article-text');
+                if (this.dataset.expanded) {
+                    // Restore the excerpt that was rendered with the page
+                    articleText.textContent = this.dataset.excerpt;
+                    this.textContent = this.dataset.label;
+                    delete this.dataset.expanded;
+                    return;
                 }
-                addReadMoreEventListeners();
+                // Fetch the full body only when the reader asks for it
+                fetch(this.dataset.url)
+                    .then(response => response.json())
+                    .then(data => {
+                        this.dataset.excerpt = articleText.textContent;
+                        this.dataset.label = this.textContent;
+                        this.dataset.expanded = 'true';
+                        articleText.textContent = data.content;
+                        this.textContent = 'Show less';
+                    });
             });
         });
     }
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the write-behind buffer in the flask_ambrosial.buffer module.
+"""
+
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from flask_ambrosial import create_app, db
+from flask_ambrosial.buffer import WriteBehindBuffer
+from flask_ambrosial.models import User, ChatMessage
+from flask_ambrosial.profiling import count_queries
+from flask_ambrosial.config import TestingConfig
+
+# Queues a row in a fresh process and sends it SIGTERM; the database given
+# as the argument must afterwards hold the row
+TERMINATED_WORKER = """
+import os, signal, sys, time
+from flask_ambrosial import create_app, db
+from flask_ambrosial.buffer import WriteBehindBuffer
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.models import ChatMessage
+
+class WorkerConfig(TestingConfig):
+    SQLALCHEMY_DATABASE_URI = sys.argv[1]
+
+app = create_app(WorkerConfig)
+with app.app_context():
+    db.create_all()
+buffer = WriteBehindBuffer(db)
+buffer.init_app(app)
+buffer.flush_on_signal()
+buffer.add(ChatMessage, {'content': 'Last words'})
+os.kill(os.getpid(), signal.SIGTERM)
+time.sleep(5)
+"""
+
+
+class WriteBehindBufferTestCase(unittest.TestCase):
+    """
+    Test case for the WriteBehindBuffer class.
+    """
+
+    def setUp(self):
+        """
+        Set up the database with a user to attribute messages to.
+        """
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        db.session.add(self.user)
+        db.session.commit()
+        self.buffer = WriteBehindBuffer(db, batch_size=3, maxsize=5)
+        self.buffer.init_app(self.app)
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        self.buffer.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_messages(self, count):
+        """
+        Queue count chat messages from the test user.
+        """
+        for i in range(count):
+            self.buffer.add(
+                ChatMessage, {'content': f'Message {i}', 'user_id': self.user.id}
+            )
+
+    def test_flush_is_one_insert_and_commit(self):
+        """
+        Test that a batch of rows is written with a single INSERT.
+        """
+        self.add_messages(2)
+        self.assertEqual(ChatMessage.query.count(), 0)
+        with count_queries() as statements:
+            self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(
+            [s for s in statements if s.startswith('INSERT')],
+            [statements[0]]
+        )
+        self.assertEqual(ChatMessage.query.count(), 2)
+        stats = self.buffer.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['flushed'], 2)
+        self.assertEqual(stats['batches'], 1)
+
+    def test_batch_size_triggers_flush(self):
+        """
+        Test that reaching batch_size writes the pending rows.
+        """
+        self.add_messages(4)
+        self.assertEqual(ChatMessage.query.count(), 3)
+        self.assertEqual(len(self.buffer), 1)
+
+    def test_failed_flush_is_retried_within_maxsize(self):
+        """
+        Test that rows survive a failed flush and memory stays bounded.
+        """
+        self.buffer._task = object()  # Pretend a background task flushes
+        ChatMessage.__table__.drop(db.engine)
+        self.add_messages(4)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 4)
+        self.add_messages(3)
+        self.assertEqual(len(self.buffer), 5)
+        self.assertEqual(self.buffer.stats()['dropped'], 2)
+        ChatMessage.__table__.create(db.engine)
+        self.assertEqual(self.buffer.flush(), 5)
+        self.assertEqual(ChatMessage.query.count(), 5)
+
+    def test_rejected_rows_are_dropped(self):
+        """
+        Test that one bad row does not hold back the rest of its batch.
+        """
+        self.buffer.add(ChatMessage, {'content': 'Good', 'user_id': self.user.id})
+        # No such user, so the foreign key refuses the row
+        self.buffer.add(ChatMessage, {'content': 'Bad', 'user_id': 999})
+        with self.assertLogs('flask_ambrosial.buffer', 'ERROR') as logs:
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertIn("'Bad'", logs.output[-1])
+        self.assertEqual(
+            [m.content for m in ChatMessage.query.all()], ['Good']
+        )
+        stats = self.buffer.stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['failures'], 1)
+
+    def test_sigterm_flushes_then_passes_signal_on(self):
+        """
+        Test that SIGTERM flushes pending rows before the handler it
+        replaced runs.
+        """
+        received = []
+        previous = signal.signal(
+            signal.SIGTERM, lambda number, frame: received.append(
+                ChatMessage.query.count()
+            )
+        )
+        self.addCleanup(signal.signal, signal.SIGTERM, previous)
+        self.buffer.flush_on_signal()
+        self.add_messages(2)
+        os.kill(os.getpid(), signal.SIGTERM)
+        self.assertEqual(received, [2])
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_sigterm_flushes_before_exiting(self):
+        """
+        Test that a process killed with SIGTERM writes its pending rows,
+        which atexit alone would lose, and still ends on the signal.
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'worker.db')
+        self.addCleanup(os.rmdir, directory)
+        self.addCleanup(os.remove, path)
+        root = os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__))
+        ))
+        env = dict(os.environ, PYTHONPATH=root)
+        process = subprocess.run(
+            [sys.executable, '-c', TERMINATED_WORKER, f'sqlite:///{path}'],
+            env=env, cwd=directory, timeout=60
+        )
+        self.assertEqual(process.returncode, -signal.SIGTERM)
+        connection = sqlite3.connect(path)
+        self.addCleanup(connection.close)
+        self.assertEqual(
+            connection.execute('SELECT content FROM chat_message').fetchall(),
+            [('Last words',)]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
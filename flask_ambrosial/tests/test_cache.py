@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the LRU and TTL caches in the flask_ambrosial.cache module.
+"""
+
+import unittest
+from unittest.mock import patch
+from flask_ambrosial.cache import LRUCache, TTLCache
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    """
+    Test case for the LRUCache class.
+    """
+
+    def test_hits_and_misses(self):
+        """
+        Test that lookups are counted as hits or misses.
+        """
+        cache = LRUCache(maxsize=2)
+        self.assertIsNone(cache.get((1, 'a')))
+        cache.set((1, 'a'), 'card')
+        self.assertEqual(cache.get((1, 'a')), 'card')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_evicts_least_recently_used(self):
+        """
+        Test that the oldest unused entry is evicted when full.
+        """
+        cache = LRUCache(maxsize=2)
+        cache.set((1,), 'one')
+        cache.set((2,), 'two')
+        cache.get((1,))
+        cache.set((3,), 'three')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get((2,)))
+        self.assertEqual(cache.get((1,)), 'one')
+
+    def test_invalidate_owner(self):
+        """
+        Test that invalidating an owner drops all of its entries.
+        """
+        cache = LRUCache()
+        cache.set((1, 'en', 'author'), 'a')
+        cache.set((1, 'fr', 'other'), 'b')
+        cache.set((2, 'en', 'other'), 'c')
+        cache.invalidate(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get((2, 'en', 'other')), 'c')
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    """
+    Test case for the TTLCache class.
+    """
+
+    def test_entries_expire(self):
+        """
+        Test that an entry is a miss once its TTL has passed.
+        """
+        cache = TTLCache(maxsize=2, ttl=10)
+        with patch('flask_ambrosial.cache.monotonic', return_value=100):
+            cache.set((1,), 'user')
+        with patch('flask_ambrosial.cache.monotonic', return_value=105):
+            self.assertEqual(cache.get((1,)), 'user')
+        with patch('flask_ambrosial.cache.monotonic', return_value=110):
+            self.assertIsNone(cache.get((1,)))
+        self.assertEqual(len(cache), 0)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
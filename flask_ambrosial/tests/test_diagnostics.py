@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the hub monitor in the flask_ambrosial.diagnostics module.
+"""
+
+import time
+import unittest
+import eventlet
+from flask_ambrosial import create_app, db, identity_cache
+from flask_ambrosial.models import User
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.diagnostics import HubMonitor, LAG_BUCKETS_MS
+from flask_ambrosial.chats.emitter import get_room_emitter
+
+
+def block_the_hub(seconds):
+    """
+    Hold the hub with a call that does not yield, like a slow bcrypt.
+    """
+    time.sleep(seconds)
+
+
+class HubMonitorTestCase(unittest.TestCase):
+    """
+    Test cases for the HubMonitor class.
+    """
+
+    def test_lag_histogram(self):
+        """
+        Test that lag samples land in the right buckets.
+        """
+        monitor = HubMonitor()
+        for lag in (0.5, 3, 3, 2000):
+            monitor.record_lag(lag)
+        stats = monitor.stats()
+        self.assertEqual(stats['samples'], 4)
+        self.assertEqual(stats['lag_ms']['<=1'], 1)
+        self.assertEqual(stats['lag_ms']['<=5'], 2)
+        self.assertEqual(stats['lag_ms'][f'>{LAG_BUCKETS_MS[-1]}'], 1)
+        self.assertEqual(stats['max_lag_ms'], 2000)
+
+    def test_blocking_green_thread_is_caught(self):
+        """
+        Test that a green thread holding the hub is reported with its
+        stack, and that the probe sees the lag it caused.
+        """
+        monitor = HubMonitor(interval=0.01, threshold=0.05)
+        monitor.start()
+        try:
+            eventlet.sleep(0.05)
+            eventlet.spawn(block_the_hub, 0.3).wait()
+            eventlet.sleep(0.05)
+        finally:
+            monitor.stop()
+        stats = monitor.stats()
+        self.assertEqual(stats['stalls'], 1)
+        stall = stats['offenders'][0]
+        self.assertIn('test_diagnostics.py', stall['where'])
+        self.assertIn('in block_the_hub', stall['where'])
+        self.assertIn('time.sleep(seconds)', stall['stack'])
+        self.assertGreaterEqual(stall['total_ms'], 250)
+        self.assertGreaterEqual(stats['max_lag_ms'], 200)
+
+    def test_endpoint_is_opt_in(self):
+        """
+        Test that the diagnostics endpoint is hidden unless enabled, and
+        only served to requests with the monitor token.
+        """
+        app = create_app(TestingConfig)
+        with app.app_context():
+            db.create_all()
+            user = User(
+                username='testuser', email='test@example.com',
+                password='password'
+            )
+            db.session.add(user)
+            db.session.commit()
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user.id)
+            self.assertEqual(client.get('/diagnostics/hub').status_code, 404)
+            app.config['HUB_MONITOR'] = True
+            # No token configured, so nobody gets in
+            self.assertEqual(client.get('/diagnostics/hub').status_code, 404)
+            app.config['HUB_MONITOR_TOKEN'] = 's3cret'
+            # Signing in is not enough
+            self.assertEqual(client.get('/diagnostics/hub').status_code, 403)
+            response = client.get(
+                '/diagnostics/hub', headers={'Authorization': 'Bearer nope'}
+            )
+            self.assertEqual(response.status_code, 403)
+            response = client.get(
+                '/diagnostics/hub', headers={'Authorization': 'Bearer s3cret'}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('lag_ms', response.get_json())
+            db.session.remove()
+            db.drop_all()
+
+    def test_endpoint_reports_counters(self):
+        """
+        Test that the diagnostics endpoint reports the cache, buffer and
+        fan-out counters.
+        """
+        app = create_app(TestingConfig)
+        app.config['HUB_MONITOR'] = True
+        app.config['HUB_MONITOR_TOKEN'] = 's3cret'
+        with app.app_context():
+            db.create_all()
+            identity_cache.set(('hit',), 1)
+            identity_cache.get(('hit',))
+            identity_cache.get(('miss',))
+            get_room_emitter()
+            response = app.test_client().get(
+                '/diagnostics/hub', headers={'Authorization': 'Bearer s3cret'}
+            )
+            counters = response.get_json()['counters']
+            self.assertEqual(counters['identity_cache']['hits'], 1)
+            self.assertEqual(counters['identity_cache']['misses'], 1)
+            self.assertEqual(counters['identity_cache']['hit_ratio'], 0.5)
+            self.assertIn('hits', counters['post_card_cache'])
+            self.assertIn('depth', counters['chat_buffer'])
+            self.assertIn('max_flush_ms', counters['chat_buffer'])
+            self.assertIn('dropped', counters['chat_emitter'])
+            self.assertNotIn('chat_receipts', counters)
+            db.session.remove()
+            db.drop_all()
+
+if __name__ == '__main__':
+    unittest.main()
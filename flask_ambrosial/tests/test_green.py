@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Unit tests for green-mode database access in the flask_ambrosial.green
+module.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import eventlet
+from eventlet import tpool
+from sqlalchemy import create_engine, create_mock_engine, text
+from flask_ambrosial import create_app, db
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.green import (
+    monkey_patched, sqlite_thread_pool, dbapi_connection
+)
+from flask_ambrosial.models import sqlite_foreign_keys
+
+SLOW_QUERY = text(
+    'WITH RECURSIVE r(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM r '
+    'WHERE n < 2000000) SELECT count(*) FROM r'
+)
+
+
+class GreenDatabaseTestCase(unittest.TestCase):
+    """
+    Test cases for pool settings and SQLite on eventlet's thread pool.
+    """
+
+    def setUp(self):
+        """
+        Set up a scratch database directory.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.url = 'sqlite:///' + os.path.join(self.directory, 'green.db')
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        shutil.rmtree(self.directory)
+
+    def test_pool_is_configured(self):
+        """
+        Test that the engine pool follows the config, and that SQLite is
+        left on the calling thread when the process is not patched.
+        """
+        self.assertFalse(monkey_patched())
+        app = create_app(TestingConfig)
+        config = app.config
+        with app.app_context():
+            pool = db.engine.pool
+            self.assertEqual(pool.size(), config['DB_POOL_SIZE'])
+            self.assertEqual(pool._max_overflow, config['DB_MAX_OVERFLOW'])
+            self.assertEqual(pool._recycle, config['DB_POOL_RECYCLE'])
+            with db.engine.connect() as connection:
+                self.assertNotIsInstance(
+                    connection.connection.dbapi_connection, tpool.Proxy
+                )
+
+    def test_in_memory_sqlite(self):
+        """
+        Test that an app on in-memory SQLite starts without pool sizing.
+        """
+        class MemoryConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+        app = create_app(MemoryConfig)
+        self.assertNotIn('pool_size', app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        with app.app_context():
+            db.create_all()
+            self.assertEqual(
+                db.session.execute(text('SELECT count(*) FROM user')).scalar(),
+                0
+            )
+            db.session.remove()
+
+    def test_queries_run_on_the_thread_pool(self):
+        """
+        Test that a slow query leaves the hub free and that connections
+        keep their foreign key enforcement behind the proxy.
+        """
+        engine = create_engine(self.url)
+        sqlite_foreign_keys(engine)
+        self.assertTrue(sqlite_thread_pool(engine))
+        with engine.connect() as connection:
+            raw = connection.connection.dbapi_connection
+            self.assertIsInstance(raw, tpool.Proxy)
+            self.assertIsNot(dbapi_connection(raw), raw)
+            self.assertEqual(
+                connection.execute(text('PRAGMA foreign_keys')).scalar(), 1
+            )
+        # Only the engines the pragma was set up on are affected
+        with create_engine(self.url).connect() as connection:
+            self.assertEqual(
+                connection.execute(text('PRAGMA foreign_keys')).scalar(), 0
+            )
+
+        ticks = []
+
+        def probe():
+            while True:
+                ticks.append(time.perf_counter())
+                eventlet.sleep(0.005)
+
+        def slow():
+            with engine.connect() as connection:
+                return connection.execute(SLOW_QUERY).scalar()
+
+        ticker = eventlet.spawn(probe)
+        start = time.perf_counter()
+        self.assertEqual(eventlet.spawn(slow).wait(), 2000000)
+        elapsed = time.perf_counter() - start
+        ticker.kill()
+        # The probe kept ticking while the query ran
+        gaps = [later - earlier for earlier, later in zip(ticks, ticks[1:])]
+        self.assertGreater(len(ticks), elapsed / 0.005 / 4)
+        self.assertLess(max(gaps), 0.1)
+        engine.dispose()
+
+    def test_other_drivers_are_left_alone(self):
+        """
+        Test that only SQLite engines are routed.
+        """
+        engine = create_mock_engine('postgresql://', executor=None)
+        self.assertFalse(sqlite_thread_pool(engine))
+
+
+if __name__ == '__main__':
+    unittest.main()
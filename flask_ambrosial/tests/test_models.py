@@ -5,8 +5,11 @@ Unit tests for the models in the flask_ambrosial module.
 
 import unittest
 from flask import current_app
-from flask_ambrosial import create_app, db
-from flask_ambrosial.models import User, Post, Comment, ChatMessage
+from flask_ambrosial import create_app, db, identity_cache
+from flask_ambrosial.models import (
+    User, Post, Comment, ChatMessage, UserSnapshot, load_user
+)
+from flask_ambrosial.profiling import count_queries
 from flask_ambrosial.config import TestingConfig
 from datetime import datetime, timezone
 
@@ -157,5 +160,31 @@ class ModelTestCase(unittest.TestCase):
         self.assertEqual(message.content, 'This is a test message.')
         self.assertEqual(message.user, user)
 
+    def test_load_user_is_cached(self):
+        """
+        Test that the user loader queries once and then serves a snapshot
+        until the user is invalidated.
+        """
+        user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        db.session.add(user)
+        db.session.commit()
+        with count_queries() as statements:
+            first = load_user(str(user.id))
+            second = load_user(str(user.id))
+        self.assertEqual(len(statements), 1)
+        self.assertIsInstance(first, UserSnapshot)
+        self.assertIs(first, second)
+        self.assertEqual(first.username, 'testuser')
+        self.assertEqual(identity_cache.stats()['hit_ratio'], 0.5)
+
+        user.username = 'renamed'
+        db.session.commit()
+        identity_cache.invalidate(user.id)
+        self.assertEqual(load_user(str(user.id)).username, 'renamed')
+        self.assertIsNone(load_user('999'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the mail queue in the flask_ambrosial.outbox module.
+"""
+
+import socket
+import socketserver
+import threading
+import time
+import unittest
+from datetime import timedelta
+from flask_mail import Message
+from flask_ambrosial import create_app, db, mail, outbox
+from flask_ambrosial.models import User, OutboundMail
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.outbox import MailOutbox, utcnow
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP for smtplib to deliver mail.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply('220 localhost SMTP stand-in')
+        sender, recipients = None, []
+        for line in self.rfile:
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip('<>'), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = command[8:].strip('<>')
+                code = server.refusals.get(recipient)
+                if code:
+                    self.reply(f'{code} Refused')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                server.messages.append((sender, recipients, data))
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    A local SMTP server that records the mail it accepts.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPStandInHandler)
+        self.connections = 0
+        self.messages = []
+        # Recipient address -> reply code for RCPT
+        self.refusals = {}
+
+
+def free_port():
+    """Return a local port nothing is listening on."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+class MailOutboxTestCase(unittest.TestCase):
+    """
+    Test cases for queueing mail and sending it in batches.
+    """
+
+    def setUp(self):
+        """
+        Set up a user and an app sending to the SMTP stand-in.
+        """
+        self.smtp = SMTPStandIn()
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.app = create_app(TestingConfig)
+        self.app.config.update(
+            MAIL_SERVER='127.0.0.1', MAIL_PORT=self.smtp.server_address[1],
+            MAIL_USE_TLS=False, MAIL_USERNAME=None, MAIL_SUPPRESS_SEND=False,
+            MAIL_OUTBOX_BATCH_SIZE=10
+        )
+        mail.init_app(self.app)
+        outbox.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.smtp.shutdown()
+        self.smtp.server_close()
+
+    def enqueue(self, *recipients):
+        for recipient in recipients:
+            outbox.enqueue(Message(
+                'Hello', sender='noreply@demo.com', recipients=[recipient],
+                body='Hello there'
+            ))
+
+    def test_reset_request_is_queued(self):
+        """
+        Test that a reset request queues its mail instead of sending it.
+        """
+        client = self.app.test_client()
+        response = client.post(
+            '/reset_password', data={'email': 'test@example.com'},
+            follow_redirects=True
+        )
+        self.assertIn(b'An email has been sent', response.data)
+        self.assertEqual(self.smtp.connections, 0)
+        queued = OutboundMail.query.one()
+        self.assertEqual(queued.recipients, 'test@example.com')
+        self.assertIn('/reset_password/', queued.body)
+
+        self.assertEqual(outbox.send_pending(), 1)
+        self.assertEqual(OutboundMail.query.count(), 0)
+        _, recipients, data = self.smtp.messages[0]
+        self.assertEqual(recipients, ['test@example.com'])
+        self.assertIn(b'Subject: Password Reset Request', data)
+
+    def test_batches_share_one_connection(self):
+        """
+        Test that each batch is sent over a single SMTP connection.
+        """
+        self.enqueue(*[f'user{i}@example.com' for i in range(15)])
+        self.assertEqual(outbox.send_pending(), 15)
+        self.assertEqual(len(self.smtp.messages), 15)
+        # Two batches of at most 10
+        self.assertEqual(self.smtp.connections, 2)
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_refusals_are_retried_with_backoff(self):
+        """
+        Test that a temporary refusal is retried later, with a growing
+        delay, and a permanent one is given up on.
+        """
+        self.smtp.refusals = {
+            'busy@example.com': 451, 'gone@example.com': 550
+        }
+        self.enqueue('busy@example.com', 'gone@example.com', 'ok@example.com')
+        self.assertEqual(outbox.send_pending(), 1)
+        self.assertEqual(self.smtp.connections, 1)
+
+        busy, gone = OutboundMail.query.order_by(OutboundMail.id).all()
+        self.assertEqual((busy.status, busy.attempts), ('queued', 1))
+        self.assertIsNone(busy.claim)
+        delay = busy.next_attempt_at - utcnow()
+        self.assertGreater(delay, timedelta(seconds=55))
+        self.assertEqual((gone.status, gone.attempts), ('failed', 1))
+        self.assertIn('550', gone.last_error)
+
+        # Not due yet
+        self.assertEqual(outbox.send_pending(), 0)
+        busy.next_attempt_at = utcnow()
+        db.session.commit()
+        self.assertEqual(outbox.send_pending(), 0)
+        self.assertEqual(busy.attempts, 2)
+        self.assertGreater(
+            busy.next_attempt_at - utcnow(), timedelta(seconds=115)
+        )
+
+        del self.smtp.refusals['busy@example.com']
+        busy.next_attempt_at = utcnow()
+        db.session.commit()
+        self.assertEqual(outbox.send_pending(), 1)
+        self.assertEqual(outbox.stats()['retried'], 2)
+        self.assertEqual(outbox.stats()['failed'], 1)
+
+    def test_unreachable_server_keeps_mail_queued(self):
+        """
+        Test that mail survives a mail server outage untouched, and that
+        the worker backs off before trying again.
+        """
+        self.enqueue('a@example.com', 'b@example.com')
+        self.app.config['MAIL_PORT'] = free_port()
+        mail.init_app(self.app)
+        self.assertEqual(outbox.send_pending(), 0)
+        stats = outbox.stats()
+        self.assertEqual(stats['connection_failures'], 1)
+        self.assertEqual(stats['backoff'], 60)
+        queued = OutboundMail.query.all()
+        self.assertEqual([row.status for row in queued], ['queued'] * 2)
+        self.assertEqual([row.attempts for row in queued], [0, 0])
+        self.assertEqual([row.claim for row in queued], [None, None])
+
+        # The worker holds off even once the mail is due again
+        OutboundMail.query.update({'next_attempt_at': utcnow()})
+        db.session.commit()
+        self.assertEqual(outbox.send_pending(), 0)
+        self.assertEqual(outbox.stats()['connection_failures'], 1)
+
+        # A new worker, e.g. after a restart, sends it once it is due
+        self.app.config['MAIL_PORT'] = self.smtp.server_address[1]
+        mail.init_app(self.app)
+        outbox.init_app(self.app)
+        OutboundMail.query.update({'next_attempt_at': utcnow()})
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=['send-mail'])
+        self.assertIn('Sent 2 messages, 0 still queued', result.output)
+
+    def test_worker_thread_sends_without_socketio(self):
+        """
+        Test that the worker runs on a thread when there is no Socket.IO
+        server to host it.
+        """
+        worker = MailOutbox(db, mail, interval=0.05)
+        worker.init_app(self.app)
+        self.enqueue('a@example.com', 'b@example.com')
+        worker.start()
+        self.addCleanup(worker.stop)
+        deadline = time.time() + 5
+        while len(self.smtp.messages) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        worker.stop()
+        self.assertEqual(len(self.smtp.messages), 2)
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_mail_worker_command(self):
+        """
+        Test that creating the app starts no worker, and that
+        `flask mail-worker` sends queued mail until it is stopped.
+        """
+        self.assertIsNone(outbox._task)
+        outbox.interval = 0.05
+        self.enqueue('a@example.com')
+        runner = self.app.test_cli_runner()
+        results = []
+        command = threading.Thread(
+            target=lambda: results.append(runner.invoke(args=['mail-worker']))
+        )
+        command.start()
+        deadline = time.time() + 5
+        while not self.smtp.messages and time.time() < deadline:
+            time.sleep(0.05)
+        outbox.stop()
+        command.join(5)
+        self.assertEqual(len(self.smtp.messages), 1)
+        self.assertIn('Sending queued mail every 0.05 seconds',
+                      results[0].output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the password hasher in the flask_ambrosial.passwords module.
+"""
+
+import time
+import unittest
+from threading import Lock, Thread
+import eventlet
+from flask_bcrypt import Bcrypt
+from flask_ambrosial.passwords import PasswordHasher, in_green_thread
+
+
+class SlowBcrypt:
+    """
+    A stand-in for Flask-Bcrypt that sleeps like a real hash and records
+    how many calls overlap.
+    """
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.running = 0
+        self.max_running = 0
+        self._lock = Lock()
+
+    def check_password_hash(self, pw_hash, password):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.seconds)  # Blocks the OS thread, like bcrypt
+        with self._lock:
+            self.running -= 1
+        return pw_hash == password
+
+
+class PasswordHasherTestCase(unittest.TestCase):
+    """
+    Test cases for the PasswordHasher class.
+    """
+
+    def test_hash_and_check(self):
+        """
+        Test that hashes made on the pool check out.
+        """
+        hasher = PasswordHasher(Bcrypt(), workers=2)
+        hasher.bcrypt._log_rounds = 4
+        pw_hash = hasher.generate_password_hash('password')
+        self.assertTrue(hasher.check_password_hash(pw_hash, 'password'))
+        self.assertFalse(hasher.check_password_hash(pw_hash, 'wrong'))
+        self.assertEqual(hasher.stats()['calls'], 3)
+
+    def test_concurrency_is_limited(self):
+        """
+        Test that callers beyond the worker count wait their turn.
+        """
+        bcrypt = SlowBcrypt()
+        hasher = PasswordHasher(bcrypt, workers=2)
+        threads = [
+            Thread(target=hasher.check_password_hash, args=('a', 'a'))
+            for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(bcrypt.max_running, 2)
+        self.assertGreater(hasher.stats()['max_wait_ms'], 0)
+        self.assertEqual(hasher.stats()['waiting'], 0)
+
+    def test_green_callers_do_not_block_the_hub(self):
+        """
+        Test that green threads keep running while hashes are computed.
+        """
+        self.assertFalse(in_green_thread())
+        bcrypt = SlowBcrypt(seconds=0.1)
+        hasher = PasswordHasher(bcrypt, workers=2)
+        ticks = []
+
+        def probe():
+            while len(ticks) < 1000:
+                ticks.append(time.perf_counter())
+                eventlet.sleep(0.005)
+
+        ticker = eventlet.spawn(probe)
+        logins = [
+            eventlet.spawn(hasher.check_password_hash, 'a', 'a')
+            for _ in range(4)
+        ]
+        results = [login.wait() for login in logins]
+        ticker.kill()
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual(bcrypt.max_running, 2)
+        # Four 100 ms hashes, two at a time, while the probe kept ticking
+        gaps = [later - earlier for earlier, later in zip(ticks, ticks[1:])]
+        self.assertGreater(len(ticks), 10)
+        self.assertLess(max(gaps), 0.09)
+
+
+if __name__ == '__main__':
+    unittest.main()
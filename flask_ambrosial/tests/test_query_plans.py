@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Query-plan tests for the hot queries in the flask_ambrosial application.
+
+Each test runs a hot path against SQLite, captures the SELECTs it issues and
+asserts that none of them falls back to a full table scan.
+"""
+
+import unittest
+from datetime import datetime, timedelta
+from flask_ambrosial import create_app, db
+from flask_ambrosial.models import User, Post, Comment, ChatMessage
+from flask_ambrosial.profiling import capture_queries, find_full_scans
+from flask_ambrosial.config import TestingConfig
+from flask_ambrosial.chats.utils import (
+    fetch_messages, encode_message_cursor, fetch_conversation_messages,
+    start_conversation, unread_counts
+)
+from flask_ambrosial.posts.utils import (
+    feed_query, paginate_by_cursor, load_comment_page, load_comment_tree
+)
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """
+    Test cases asserting that hot queries are served by indexes.
+    """
+
+    def setUp(self):
+        """
+        Set up the database with posts, a comment thread and chat messages.
+        """
+        self.app = create_app(TestingConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.user = User(
+            username='testuser', email='test@example.com',
+            password='password'
+        )
+        db.session.add(self.user)
+        start = datetime(2024, 1, 1)
+        for i in range(6):
+            db.session.add(Post(
+                title=f'Post {i}', content='Content', author=self.user,
+                image_filename='default.jpg',
+                date_posted=start + timedelta(days=i)
+            ))
+        db.session.commit()
+        self.post = Post.query.first()
+        root = Comment(content='Root', author=self.user, post=self.post)
+        reply = Comment(
+            content='Reply', author=self.user, post=self.post, parent=root
+        )
+        db.session.add_all([root, reply])
+        db.session.add_all([
+            ChatMessage(content=f'Message {i}', user=self.user)
+            for i in range(3)
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        """
+        Clean up after each test.
+        """
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def assertNoFullScans(self, captured):
+        """
+        Assert that no captured SELECT scans a whole table.
+        """
+        self.assertTrue(captured)
+        scans = find_full_scans(db.session.connection(), captured)
+        self.assertEqual(scans, [])
+
+    def test_feed_pages(self):
+        """
+        Test that the feed's first and later pages walk the keyset index.
+        """
+        with capture_queries() as captured:
+            page = paginate_by_cursor(feed_query(), per_page=2)
+            paginate_by_cursor(
+                feed_query(), after=page.next_cursor, per_page=2
+            )
+            paginate_by_cursor(
+                feed_query(), before=page.next_cursor, per_page=2
+            )
+        self.assertNoFullScans(captured)
+
+    def test_user_posts(self):
+        """
+        Test that an author's posts are read through the author index.
+        """
+        query = feed_query().filter(Post.user_id == self.user.id)
+        with capture_queries() as captured:
+            page = paginate_by_cursor(query, per_page=2)
+            paginate_by_cursor(query, after=page.next_cursor, per_page=2)
+        self.assertNoFullScans(captured)
+
+    def test_comment_tree(self):
+        """
+        Test that a post's whole thread is read through the comment index.
+        """
+        with capture_queries() as captured:
+            load_comment_tree(self.post.id)
+        self.assertNoFullScans(captured)
+
+    def test_comment_page(self):
+        """
+        Test that top-level comments and their replies use indexes.
+        """
+        with capture_queries() as captured:
+            load_comment_page(self.post.id)
+        self.assertNoFullScans(captured)
+
+    def test_chat_history(self):
+        """
+        Test that every page of the public chat history is read from the
+        index: the newest page, and pages before a cursor, after a cursor
+        and since a message ID.
+        """
+        rows, _ = fetch_messages(limit=2)
+        cursor = encode_message_cursor(rows[0].timestamp, rows[0].id)
+        branches = {
+            'latest': {},
+            'before': {'before': cursor},
+            'after': {'after': cursor},
+            'since_id': {'since_id': rows[0].id},
+        }
+        for branch, arguments in branches.items():
+            with self.subTest(branch=branch):
+                with capture_queries() as captured:
+                    fetch_messages(limit=2, **arguments)
+                self.assertNoFullScans(captured)
+
+    def test_conversation_history_and_unread(self):
+        """
+        Test that conversation pages and unread counts use the
+        (conversation_id, id) index.
+        """
+        other = User(
+            username='otheruser', email='other@example.com',
+            password='password'
+        )
+        db.session.add(other)
+        conversation, _ = start_conversation(self.user, [other])
+        db.session.add_all([
+            ChatMessage(
+                content=f'Private {i}', user=other,
+                conversation_id=conversation.id
+            )
+            for i in range(3)
+        ])
+        db.session.commit()
+        with capture_queries() as captured:
+            rows, _ = fetch_conversation_messages(conversation.id, limit=2)
+            fetch_conversation_messages(
+                conversation.id, before_id=rows[0].id, limit=2
+            )
+            unread_counts(self.user.id)
+        self.assertNoFullScans(captured)
+
+
+if __name__ == '__main__':
+    unittest.main()
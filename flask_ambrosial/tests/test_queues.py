@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the Socket.IO message queues in the flask_ambrosial.queues
+module.
+"""
+
+import os
+import json
+import uuid
+import tempfile
+import threading
+import unittest
+from urllib.request import Request, urlopen
+from flask import Flask
+from flask_socketio import SocketIO, join_room
+from werkzeug.serving import make_server
+from flask_ambrosial.queues import LocalManager, message_queue_options
+
+
+class PollingClient:
+    """
+    A bare Socket.IO client speaking HTTP long-polling.
+
+    The Flask-SocketIO test client refuses to run over a message queue,
+    so workers are served over HTTP and driven through the wire protocol.
+    """
+
+    def __init__(self, port):
+        self.url = f'http://127.0.0.1:{port}/socket.io/?EIO=4&transport=polling'
+        handshake = self.receive()[0]
+        self.url += '&sid=' + json.loads(handshake[1:])['sid']
+        self.send('40')
+        self.receive()
+
+    def send(self, packet):
+        request = Request(self.url, data=packet.encode(), method='POST')
+        with urlopen(request, timeout=10) as response:
+            response.read()
+
+    def receive(self):
+        """Wait for the packets the server has for this client."""
+        with urlopen(self.url, timeout=10) as response:
+            return response.read().decode().split('\x1e')
+
+    def call(self, event, data):
+        """Emit an event and wait for its handler to acknowledge it."""
+        self.send('421' + json.dumps([event, data]))
+        while not any(p.startswith('431') for p in self.receive()):
+            pass
+
+    def events(self):
+        """Wait for the next events sent to this client."""
+        while True:
+            events = [
+                json.loads(p[2:]) for p in self.receive() if p.startswith('42')
+            ]
+            if events:
+                return events
+
+
+class MessageQueueTestCase(unittest.TestCase):
+    """
+    Test cases for delivering emits across workers through a queue.
+    """
+
+    def make_worker(self, url, channel):
+        """
+        Serve one "worker": an app and Socket.IO server on the queue.
+
+        Returns:
+            tuple: The SocketIO instance and the port it is served on.
+        """
+        app = Flask(__name__)
+        app.config.update(
+            SECRET_KEY='test', SOCKETIO_MESSAGE_QUEUE=url,
+            SOCKETIO_CHANNEL=channel
+        )
+        socketio = SocketIO(
+            app, async_mode='threading', **message_queue_options(app.config)
+        )
+
+        @socketio.on('join')
+        def join(room):
+            join_room(room)
+            return True
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        manager = socketio.server.manager
+        if isinstance(manager, LocalManager):
+            self.addCleanup(manager.close)
+        return socketio, server.server_port
+
+    def assert_crosses_workers(self, url):
+        """
+        Assert that an emit on worker A reaches a room member on worker B.
+        """
+        channel = f'test-{uuid.uuid4().hex}'
+        worker_a, _ = self.make_worker(url, channel)
+        _, port = self.make_worker(url, channel)
+        client = PollingClient(port)
+        client.call('join', 'default')
+
+        worker_a.emit('message', {'msg': 'from A'}, to='default')
+        self.assertEqual(client.events(), [['message', {'msg': 'from A'}]])
+
+    def test_local_queue_crosses_workers(self):
+        """
+        Test delivery between workers through the in-process queue.
+        """
+        self.assert_crosses_workers('local://')
+
+    def test_file_queue_crosses_workers(self):
+        """
+        Test delivery between workers through the spool-file queue.
+        """
+        with tempfile.TemporaryDirectory() as spool_dir:
+            self.assert_crosses_workers(
+                'file://' + os.path.join(spool_dir, 'socketio.spool')
+            )
+
+    def test_message_queue_options(self):
+        """
+        Test that the configured URL selects the queue backend.
+        """
+        self.assertEqual(message_queue_options({}), {})
+        self.assertEqual(
+            message_queue_options({
+                'SOCKETIO_MESSAGE_QUEUE': 'redis://localhost:6379/0',
+                'SOCKETIO_CHANNEL': 'chat'
+            }),
+            {'message_queue': 'redis://localhost:6379/0', 'channel': 'chat'}
+        )
+        options = message_queue_options(
+            {'SOCKETIO_MESSAGE_QUEUE': 'local://'}
+        )
+        self.assertIsInstance(options['client_manager'], LocalManager)
+
+    def test_closed_local_manager_leaves_channel(self):
+        """
+        Test that a closed local manager is dropped from its channel.
+        """
+        channel = f'test-{uuid.uuid4().hex}'
+        socketio, port = self.make_worker('local://', channel)
+        PollingClient(port)
+        manager = socketio.server.manager
+        self.assertEqual(LocalManager._subscribers[channel], [manager.queue])
+        manager.close()
+        self.assertNotIn(channel, LocalManager._subscribers)
+        manager.thread.join(timeout=5)
+        self.assertFalse(manager.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
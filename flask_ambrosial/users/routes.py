@@ -6,12 +6,15 @@ Routes for user authentication and interaction in the flask_ambrosial module.
 from flask import Blueprint, render_template, url_for, flash, redirect
 from flask import request, session
 from flask_login import login_user, current_user, logout_user, login_required
-from flask_ambrosial import db, bcrypt
+from flask_ambrosial import db, password_hasher, identity_cache
 from flask_ambrosial.models import User, Post, Comment
 from flask_ambrosial.users.forms import (RegistrationForm, LoginForm, 
                                          UpdateAccountForm, RequestResetForm, 
                                          ResetPasswordForm, CommentForm)
 from flask_ambrosial.users.utils import save_picture, send_reset_email
+from flask_ambrosial.posts.utils import (
+    feed_query, paginate_by_cursor, cached_page, touch_user_posts
+)
 
 users = Blueprint('users', __name__)
 
@@ -24,7 +27,7 @@ def register():
         return redirect(url_for('main.home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(
+        hashed_password = password_hasher.generate_password_hash(
             form.password.data).decode('utf-8')
         user = User(username=form.username.data, email=form.email.data,
                     password=hashed_password)
@@ -45,8 +48,8 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, 
-                                               form.password.data):
+        if user and password_hasher.check_password_hash(
+                user.password, form.password.data):
             login_user(user, remember=form.remember.data)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(
@@ -73,12 +76,17 @@ def account():
     """
     form = UpdateAccountForm()
     if form.validate_on_submit():
+        # current_user is a cached snapshot; changes go to the User itself
+        user = db.session.get(User, current_user.id)
         if form.picture.data:
             picture_file = save_picture(form.picture.data)
-            current_user.image_file = picture_file
-        current_user.username = form.username.data
-        current_user.email = form.email.data
+            user.image_file = picture_file
+        user.username = form.username.data
+        user.email = form.email.data
+        # Post cards and pages embed the author's name and picture
+        touch_user_posts(user.id)
         db.session.commit()
+        identity_cache.invalidate(user.id)
         flash('Your account has been updated!', 'success')
         return redirect(url_for('users.account'))
     elif request.method == 'GET':
@@ -90,14 +98,16 @@ def account():
                            image_file=image_file, form=form)
 
 @users.route("/user/<string:username>")
+@cached_page
 def user_posts(username):
     """
     Display posts by a specific user.
     """
-    page = request.args.get('page', 1, type=int)
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user).order_by(
-        Post.date_posted.desc()).paginate(page=page, per_page=3)
+    posts = paginate_by_cursor(
+        feed_query().filter(Post.user_id == user.id),
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=3)
     image_files = [url_for('static', filename='post_pics/' + post.image_filename)
                    for post in posts.items]
     return render_template('user_posts.html', posts=posts, 
@@ -133,10 +143,11 @@ def reset_token(token):
         return redirect(url_for('users.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(
+        hashed_password = password_hasher.generate_password_hash(
             form.password.data).decode('utf-8')
         user.password = hashed_password
         db.session.commit()
+        identity_cache.invalidate(user.id)
         flash('Your password has been updated! You are now able to log in', 
               'success')
         return redirect(url_for('users.login'))
@@ -8,7 +8,7 @@ from flask_ambrosial import create_app, db
 from flask_ambrosial.models import User
 from flask_bcrypt import Bcrypt
 from flask_ambrosial.config import TestingConfig
-from flask import url_for, get_flashed_messages
+from flask import url_for, get_flashed_messages, g
 
 
 class UsersRoutesTestCase(unittest.TestCase):
@@ -132,12 +132,20 @@ class UsersRoutesTestCase(unittest.TestCase):
                 'email': 'test@example.com',
                 'password': 'password'
             })
+            # Requests share the test's g; drop the user login_user left
+            # there so the next request goes through the cached loader
+            g.pop('_login_user', None)
+            self.client.get(url_for('users.account'))
             response = self.client.post(url_for('users.account'), data={
                 'username': 'updateduser',
                 'email': 'updated@example.com'
             }, follow_redirects=True)
             self.assertEqual(response.status_code, 200)
             self.assertIn(b'Your account has been updated!', response.data)
+            g.pop('_login_user', None)
+            response = self.client.get(url_for('users.account'))
+            self.assertIn(b'updateduser', response.data)
+            self.assertIn(b'updated@example.com', response.data)
 
     def test_user_posts(self):
         """
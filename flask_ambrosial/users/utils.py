@@ -5,7 +5,7 @@ import secrets
 from PIL import Image
 from flask import url_for, current_app
 from flask_mail import Message
-from flask_ambrosial import mail
+from flask_ambrosial import outbox
 
 def save_picture(form_picture):
     """Save and resize the user's profile picture.
@@ -32,7 +32,7 @@ def save_picture(form_picture):
 
 
 def send_reset_email(user):
-    """Send a password reset email to the user.
+    """Queue a password reset email to the user.
 
     Args:
         user (User): The user object for whom the password reset email is sent.
@@ -40,7 +40,7 @@ def send_reset_email(user):
     # Generate a token for password reset
     token = user.get_reset_token()
     
-    # Create and send the email message
+    # Create the email message and queue it for the outbox worker
     msg = Message('Password Reset Request',
                   sender='noreply@demo.com',
                   recipients=[user.email])
@@ -50,4 +50,4 @@ def send_reset_email(user):
 
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-    mail.send(msg)
+    outbox.enqueue(msg)
@@ -0,0 +1,26 @@
+"""Add a send-time uid to chat messages
+
+Revision ID: 4e8a2c71b9d5
+Revises: d93b7e4a1f60
+Create Date: 2026-10-17 23:02:16.540871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e8a2c71b9d5'
+down_revision = 'd93b7e4a1f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('uid', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.drop_column('uid')
@@ -0,0 +1,36 @@
+"""Add (date_posted, id) index and server default to post
+
+Revision ID: 5b2e9c41d7a3
+Revises: 28008182ab9a
+Create Date: 2026-10-17 09:12:04.118530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e9c41d7a3'
+down_revision = '28008182ab9a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.alter_column('date_posted',
+               existing_type=sa.DateTime(),
+               existing_nullable=False,
+               server_default=sa.text('CURRENT_TIMESTAMP'))
+        batch_op.create_index(
+            'ix_post_date_posted_id', ['date_posted', 'id'], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_date_posted_id')
+        batch_op.alter_column('date_posted',
+               existing_type=sa.DateTime(),
+               existing_nullable=False,
+               server_default=None)
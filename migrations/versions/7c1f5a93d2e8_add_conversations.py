@@ -0,0 +1,57 @@
+"""Add conversations, their members and per-conversation chat history
+
+Revision ID: 7c1f5a93d2e8
+Revises: b6d3e81f4a20
+Create Date: 2026-10-17 18:12:37.405118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1f5a93d2e8'
+down_revision = 'b6d3e81f4a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=True),
+    sa.Column('is_group', sa.Boolean(), server_default='0', nullable=False),
+    sa.Column('dm_key', sa.String(length=40), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('dm_key')
+    )
+    op.create_table('conversation_member',
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('joined_at', sa.DateTime(), nullable=False),
+    sa.Column('last_read_id', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversation.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('conversation_id', 'user_id')
+    )
+    with op.batch_alter_table('conversation_member', schema=None) as batch_op:
+        batch_op.create_index('ix_conversation_member_user_id', ['user_id'], unique=False)
+
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('conversation_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_chat_message_conversation_id', 'conversation', ['conversation_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_index('ix_chat_message_conversation_id_id', ['conversation_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_message_conversation_id_id')
+        batch_op.drop_constraint('fk_chat_message_conversation_id', type_='foreignkey')
+        batch_op.drop_column('conversation_id')
+
+    with op.batch_alter_table('conversation_member', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversation_member_user_id')
+
+    op.drop_table('conversation_member')
+    op.drop_table('conversation')
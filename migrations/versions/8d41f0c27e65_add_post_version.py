@@ -0,0 +1,26 @@
+"""Add version column to post
+
+Revision ID: 8d41f0c27e65
+Revises: 5b2e9c41d7a3
+Create Date: 2026-10-17 11:40:27.530914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41f0c27e65'
+down_revision = '5b2e9c41d7a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,39 @@
+"""Normalize chat and post timestamps to microsecond precision
+
+Rows written by SQLite's CURRENT_TIMESTAMP are stored as
+'YYYY-MM-DD HH:MM:SS', while SQLAlchemy writes and compares
+'YYYY-MM-DD HH:MM:SS.ffffff'. Compared as text, a second-precision value
+sorts before every row of the same second, which breaks history cursors.
+
+Revision ID: a6f03d9c5e12
+Revises: 4e8a2c71b9d5
+Create Date: 2026-10-17 23:41:08.902317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6f03d9c5e12'
+down_revision = '4e8a2c71b9d5'
+branch_labels = None
+depends_on = None
+
+COLUMNS = (('chat_message', 'timestamp'), ('post', 'date_posted'))
+
+
+def upgrade():
+    # Other databases store datetimes natively
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table, column in COLUMNS:
+        op.execute(sa.text(
+            f"UPDATE {table} SET {column} = {column} || '.000000' "
+            f"WHERE length({column}) = 19"
+        ))
+
+
+def downgrade():
+    # The padded values read back as the same datetimes
+    pass
@@ -0,0 +1,42 @@
+"""Add excerpt column to post
+
+Revision ID: a91d3e6f0c58
+Revises: e3a7c5912b04
+Create Date: 2026-10-17 14:22:10.641877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91d3e6f0c58'
+down_revision = 'e3a7c5912b04'
+branch_labels = None
+depends_on = None
+
+EXCERPT_WORDS = 20
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('excerpt', sa.Text(), nullable=True))
+
+    # Backfill excerpts for existing posts
+    post = sa.table(
+        'post', sa.column('id', sa.Integer), sa.column('content', sa.Text),
+        sa.column('excerpt', sa.Text)
+    )
+    conn = op.get_bind()
+    rows = conn.execute(sa.select(post.c.id, post.c.content)).fetchall()
+    for post_id, content in rows:
+        conn.execute(
+            post.update().where(post.c.id == post_id).values(
+                excerpt=' '.join((content or '').split(' ')[:EXCERPT_WORDS])
+            )
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('excerpt')
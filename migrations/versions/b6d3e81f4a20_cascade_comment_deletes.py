@@ -0,0 +1,39 @@
+"""Cascade comment deletes from posts and parent comments
+
+Revision ID: b6d3e81f4a20
+Revises: f4c8a2d95e17
+Create Date: 2026-10-17 17:05:48.213390
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d3e81f4a20'
+down_revision = 'f4c8a2d95e17'
+branch_labels = None
+depends_on = None
+
+# The post_id foreign key was created without a name; this convention
+# gives it one so batch mode can drop it
+naming_convention = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s',
+}
+
+
+def upgrade():
+    with op.batch_alter_table(
+        'comment', schema=None, naming_convention=naming_convention
+    ) as batch_op:
+        batch_op.drop_constraint('fk_comment_post_id', type_='foreignkey')
+        batch_op.drop_constraint('fk_comment_parent_id', type_='foreignkey')
+        batch_op.create_foreign_key('fk_comment_post_id', 'post', ['post_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_foreign_key('fk_comment_parent_id', 'comment', ['parent_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_comment_parent_id', type_='foreignkey')
+        batch_op.drop_constraint('fk_comment_post_id', type_='foreignkey')
+        batch_op.create_foreign_key('fk_comment_parent_id', 'comment', ['parent_id'], ['id'])
+        batch_op.create_foreign_key('fk_comment_post_id', 'post', ['post_id'], ['id'])
@@ -0,0 +1,48 @@
+"""Add denormalized post and comment counters
+
+Revision ID: c27f84b1e9d3
+Revises: a91d3e6f0c58
+Create Date: 2026-10-17 15:48:36.207519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c27f84b1e9d3'
+down_revision = 'a91d3e6f0c58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'))
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill the counters from the existing rows
+    op.execute(
+        'UPDATE post SET comment_count = '
+        '(SELECT count(*) FROM comment WHERE comment.post_id = post.id)'
+    )
+    op.execute(
+        'UPDATE user SET post_count = '
+        '(SELECT count(*) FROM post WHERE post.user_id = user.id)'
+    )
+    op.execute(
+        'UPDATE user SET comment_count = '
+        '(SELECT count(*) FROM comment WHERE comment.user_id = user.id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('post_count')
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('comment_count')
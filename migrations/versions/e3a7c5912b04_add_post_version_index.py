@@ -0,0 +1,28 @@
+"""Add index on post.version
+
+Revision ID: e3a7c5912b04
+Revises: 8d41f0c27e65
+Create Date: 2026-10-17 13:05:51.902317
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a7c5912b04'
+down_revision = '8d41f0c27e65'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Versions become site-wide: renumber existing posts in id order so
+    # max(version) moves on every later change
+    op.execute('UPDATE post SET version = id')
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_post_version'), ['version'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_post_version'))
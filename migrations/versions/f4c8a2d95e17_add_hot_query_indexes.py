@@ -0,0 +1,43 @@
+"""Add indexes for the hot post, comment and chat queries
+
+Revision ID: f4c8a2d95e17
+Revises: c27f84b1e9d3
+Create Date: 2026-10-17 16:31:02.774160
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c8a2d95e17'
+down_revision = 'c27f84b1e9d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_user_id_date_posted', ['user_id', 'date_posted', 'id'], unique=False)
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_post_id_parent_id', ['post_id', 'parent_id', 'date_posted', 'id'], unique=False)
+        batch_op.create_index('ix_comment_parent_id', ['parent_id'], unique=False)
+        batch_op.create_index('ix_comment_user_id', ['user_id'], unique=False)
+
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_message_timestamp_id', ['timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_chat_message_user_id', ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_message_user_id')
+        batch_op.drop_index('ix_chat_message_timestamp_id')
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_user_id')
+        batch_op.drop_index('ix_comment_parent_id')
+        batch_op.drop_index('ix_comment_post_id_parent_id')
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_user_id_date_posted')
@@ -1,16 +1,39 @@
 #!/usr/bin/env python3
-"""Entry point for running the Flask application."""
+"""Entry point for running the Flask application.
 
-from flask_ambrosial import create_app, socketio
+Imported (``flask --app run.py db upgrade``, ``flask mail-worker``, a WSGI
+host) this module only builds a plain app: nothing is monkey-patched and no
+Socket.IO background tasks or signal handlers are installed. Run as a
+script, it starts the Socket.IO server in green mode.
+"""
 
-app = create_app(use_socketio=True)
+import os
 
 if __name__ == '__main__':
+    # Green mode: patch the standard library before anything else imports
+    # it, so blocking sockets, locks and sleeps in request and socket
+    # handlers yield to the eventlet hub instead of stalling every client.
+    # GREEN_MODE=0 runs unpatched.
+    if os.environ.get('GREEN_MODE', '1') == '1':
+        import eventlet
+        eventlet.monkey_patch()
+
+    from flask_ambrosial import create_app, socketio, outbox
+
+    app = create_app(use_socketio=True)
+
     # Run the Flask application with SocketIO
     # - debug=True enables debug mode for development
     # - This means the server will reload on code changes and
     #   provide more detailed error messages
+    # The server sends queued mail itself; elsewhere run `flask mail-worker`
     if socketio:
+        outbox.start(socketio)
         socketio.run(app, debug=True)
     else:
+        outbox.start()
         app.run(debug=True)
+else:
+    from flask_ambrosial import create_app
+
+    app = create_app()